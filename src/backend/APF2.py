@@ -1,4 +1,5 @@
 import os
+import io
 import glob
 import numpy as np
 from PIL import Image, ImageOps
@@ -6,12 +7,18 @@ import shutil
 from pathlib import Path
 import json
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from backend.utils.ivf_index import IVFIndex
+from backend.utils.catalogue import as_catalogue, get_catalogue, image_url, audio_url
 
 # ====================================================================================
 # Constants
 # ====================================================================================
 
 SIMILARITY_THRESHOLD = 80.0
+TOP_K_MATCHES = 50  # Maximum number of albums returned per query
 
 # Define backend database directories
 BASE_DIR = Path(__file__).resolve().parent  # Points to 'backend/'
@@ -19,13 +26,45 @@ AUDIO_DIR = BASE_DIR / "database" / "audio"
 PICTURE_DIR = BASE_DIR / "database" / "picture"
 MAPPER_DIR = BASE_DIR / "database" / "mapper"
 
-# Processed Data Directory and Files
+# Processed Data Directory and Files (the first four are the legacy, pickled layout)
 PROCESSED_DATA_DIR = BASE_DIR / "database" / "processed_data"
 IMAGE_DB_PROJECTION_FILE = PROCESSED_DATA_DIR / "image_db_projection.npz"
 MEAN_FILE = PROCESSED_DATA_DIR / "mean.npy"
 PRINCIPAL_COMPONENTS_FILE = PROCESSED_DATA_DIR / "principal_components.npy"
 ORIGINAL_IMAGE_PATHS_FILE = PROCESSED_DATA_DIR / "original_image_paths.npy"
 
+# Memory-mapped image index: header.json, projection.npy (float32), image_ids.npy (int32),
+# mean.npy, principal_components.npy, path_offsets.npy, the path_table.bin strings and,
+# for large databases, the ann_index.npz IVF lists over the projection rows
+IMAGE_INDEX_DIR = PROCESSED_DATA_DIR / "image_index"
+ANN_INDEX_FILE_NAME = "ann_index.npz"
+IMAGE_INDEX_VERSION = 1  # Bump when the layout of the index files changes
+
+# Precision mode: "float64", "float32" (float32 compute and storage), or "float16"
+# (float16 projection storage, float32 compute and accumulation)
+PRECISION_MODE = "float32"
+SCAN_CHUNK_ROWS = 65536  # Projection rows converted at a time when scanning float16
+
+# Approximate nearest neighbour (IVF) search is only used for large databases
+ANN_MIN_ROWS = 20000  # Minimum number of projection rows before building the index
+ANN_N_PROBE = 8  # Number of inverted lists scanned per query
+
+# PCA fit mode: "covariance", "gram", "randomized", "incremental", or "auto"
+PCA_FIT_MODE = "auto"
+# Components kept by the incremental (streaming) PCA; a warning is logged when this
+# cap stops it short of the variance threshold
+IPCA_N_COMPONENTS = 256
+IPCA_BATCH_SIZE = 1024  # Augmented images per incremental PCA mini-batch
+
+# Query images: encoded JPEGs are decoded at a reduced DCT scale (PIL draft mode) to
+# at least this multiple of the target size, then resized as before
+QUERY_DRAFT_DECODE = True
+QUERY_DRAFT_MARGIN = 2
+
+# Parallel image loading (None = one worker per CPU core)
+LOADER_WORKERS = None
+LOADER_CHUNK_SIZE = 16  # Images sent to a worker at a time
+
 # Ensure the directories exist
 AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 PICTURE_DIR.mkdir(parents=True, exist_ok=True)
@@ -36,6 +75,23 @@ PROCESSED_DATA_DIR.mkdir(parents=True, exist_ok=True)
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent  # Points to 'HatsuneMix-ue-/'
 
 
+def compute_dtype(precision=PRECISION_MODE):
+    """
+    Floating point type the PCA is fitted and the distances are computed in.
+    """
+    if precision not in ("float64", "float32", "float16"):
+        raise ValueError(f"Unknown precision mode: {precision}")
+    return np.float64 if precision == "float64" else np.float32
+
+
+def storage_dtype(precision=PRECISION_MODE):
+    """
+    Floating point type the database projections are stored in.
+    """
+    compute_dtype(precision)  # Validates the mode
+    return np.dtype(precision).type
+
+
 # ====================================================================================
 # Step 1: Image Processing and Loading
 # ====================================================================================
@@ -94,43 +150,116 @@ def augment_image(image, size=(60, 60)):
     return augmented_images
 
 
-def load_image_database(directory_path, size=(60, 60)):
+def list_image_files(directory_path):
     # Handle multiple image file extensions
     image_extensions = {".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG"}
 
-    imageDB = []
-    original_image_paths = []
-
+    image_paths = []
     with os.scandir(directory_path) as entries:
         for entry in entries:
             if entry.is_file():
                 _, ext = os.path.splitext(entry.name)
                 if ext in image_extensions:
-                    image_path = entry.path
-                    try:
-                        image = Image.open(image_path)
-                        augmented_images = augment_image(image, size)
-                        image.close()
-                        imageDB.extend(augmented_images)
-                        original_image_paths.extend(
-                            [image_path] * len(augmented_images)
-                        )
-                    except Exception as e:
-                        print(f"Error processing image {image_path}: {e}")
+                    image_paths.append(entry.path)
+    return image_paths
+
+
+def load_augmented_image(image_path, size=(60, 60)):
+    try:
+        with Image.open(image_path) as image:
+            return augment_image(image, size)
+    except Exception as e:
+        print(f"Error processing image {image_path}: {e}")
+        return None
+
+
+def map_augmented_images(
+    image_paths, size=(60, 60), workers=LOADER_WORKERS, chunksize=LOADER_CHUNK_SIZE
+):
+    """
+    Decode and augment the images on a process pool.
+
+    Yields:
+        tuple: (image path, augmented images or None), in the order of image_paths.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(image_paths) <= chunksize:
+        for image_path in image_paths:
+            yield image_path, load_augmented_image(image_path, size)
+        return
+
+    # Submit a bounded window at a time so results never pile up in memory. Workers
+    # are spawned: forking the server would copy its threads, locks and resident data.
+    window = workers * chunksize * 2
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for start in range(0, len(image_paths), window):
+            window_paths = image_paths[start : start + window]
+            results = executor.map(
+                load_augmented_image,
+                window_paths,
+                repeat(size),
+                chunksize=chunksize,
+            )
+            yield from zip(window_paths, results)
+
+
+def load_image_database(
+    directory_path, size=(60, 60), workers=LOADER_WORKERS, chunksize=LOADER_CHUNK_SIZE
+):
+    imageDB = []
+    original_image_paths = []
+
+    for image_path, augmented_images in map_augmented_images(
+        list_image_files(directory_path), size, workers, chunksize
+    ):
+        if augmented_images is not None:
+            imageDB.extend(augmented_images)
+            original_image_paths.extend([image_path] * len(augmented_images))
 
     imageDB = np.array(imageDB) if imageDB else np.array([])
 
     return imageDB, original_image_paths
 
 
+def iter_image_batches(
+    image_paths, size=(60, 60), batch_size=IPCA_BATCH_SIZE, workers=LOADER_WORKERS
+):
+    """
+    Stream the augmented images in mini-batches of about batch_size rows, so the whole
+    database never has to fit in memory.
+
+    Yields:
+        tuple: (batch of flattened images as a 2D array, original path of every row)
+    """
+    batch, batch_paths = [], []
+    for image_path, augmented_images in map_augmented_images(
+        image_paths, size, workers
+    ):
+        if augmented_images is None:
+            continue
+        batch.extend(augmented_images)
+        batch_paths.extend([image_path] * len(augmented_images))
+        if len(batch) >= batch_size:
+            yield np.array(batch), batch_paths
+            batch, batch_paths = [], []
+    if batch:
+        yield np.array(batch), batch_paths
+
+
 # ====================================================================================
 # Step 2: Data Centering (Standardization)
 # ====================================================================================
 
 
-def standardize_data(imageDB):
-    mean = np.mean(imageDB, axis=0)
-    imageDB_centered = imageDB - mean
+def standardize_data(imageDB, dtype=np.float64):
+    """
+    Center the (uint8) images in the given floating point type; the mean is
+    accumulated in that type instead of silently upcasting to float64.
+    """
+    mean = np.mean(imageDB, axis=0, dtype=dtype)
+    imageDB_centered = imageDB.astype(dtype) - mean
     return imageDB_centered, mean
 
 
@@ -140,7 +269,7 @@ def standardize_data(imageDB):
 
 
 def compute_covariance_matrix(imageDB_centered):
-    return np.cov(imageDB_centered, rowvar=False)
+    return np.cov(imageDB_centered, rowvar=False, dtype=imageDB_centered.dtype)
 
 
 def perform_svd(covariance_matrix):
@@ -148,18 +277,231 @@ def perform_svd(covariance_matrix):
     return U, S, Vt
 
 
-def select_principal_components(U, S, threshold=0.95):
+def select_principal_components(U, S, threshold=0.95, total_variance=None):
     """
     Select the top k principal components based on the cumulative variance threshold.
+
+    total_variance defaults to sum(S); pass it when S only holds the leading variances.
     """
-    cumulative_variance = np.cumsum(S) / np.sum(S)
-    k = np.argmax(cumulative_variance >= threshold) + 1
+    if total_variance is None:
+        total_variance = np.sum(S)
+    if total_variance <= 0:
+        k = 1  # No variance to explain (identical images): one component is enough
+    else:
+        cumulative_variance = np.cumsum(S) / total_variance
+        reached = cumulative_variance >= threshold
+        k = np.argmax(reached) + 1 if reached.any() else len(S)
     print(
         f"Selected {k} principal components based on {threshold*100}% variance threshold."
     )
     return U[:, :k]
 
 
+class IncrementalPCA:
+    """
+    PCA updated one mini-batch at a time (Ross et al. incremental SVD, as in
+    scikit-learn's IncrementalPCA). Only n_components x D values are kept between
+    batches, plus the running per-pixel mean and sum of squared deviations.
+    """
+
+    def __init__(self, n_components=IPCA_N_COMPONENTS, dtype=np.float64):
+        self.n_components = n_components
+        self.dtype = dtype
+        self.n_samples_seen = 0
+        self.mean = None
+        self.squared_deviations = None  # Per-pixel sum of squared deviations
+        self.components = None  # One principal component per row
+        self.singular_values = None
+
+    def partial_fit(self, X):
+        X = np.asarray(X, dtype=self.dtype)
+        n_new = len(X)
+        n_total = self.n_samples_seen + n_new
+        batch_mean = np.mean(X, axis=0)
+        X_centered = X - batch_mean
+        batch_squared_deviations = np.sum(X_centered**2, axis=0)
+
+        if self.n_samples_seen == 0:
+            self.mean = batch_mean
+            self.squared_deviations = batch_squared_deviations
+        else:
+            mean_difference = batch_mean - self.mean
+            # Combine the previous components, the new batch, and the mean shift
+            mean_correction = np.sqrt(self.n_samples_seen * n_new / n_total) * (
+                self.mean - batch_mean
+            )
+            X_centered = np.vstack(
+                [
+                    self.singular_values[:, None] * self.components,
+                    X_centered,
+                    mean_correction,
+                ]
+            )
+            self.squared_deviations = (
+                self.squared_deviations
+                + batch_squared_deviations
+                + mean_difference**2 * self.n_samples_seen * n_new / n_total
+            )
+            self.mean = self.mean + mean_difference * n_new / n_total
+
+        _, S, Vt = np.linalg.svd(X_centered, full_matrices=False)
+        self.components = Vt[: self.n_components]
+        self.singular_values = S[: self.n_components]
+        self.n_samples_seen = n_total
+        return self
+
+    @property
+    def explained_variance(self):
+        return self.singular_values**2 / max(self.n_samples_seen - 1, 1)
+
+    @property
+    def total_variance(self):
+        return np.sum(self.squared_deviations) / max(self.n_samples_seen - 1, 1)
+
+
+def fit_incremental_pca(
+    image_paths,
+    size=(60, 60),
+    threshold=0.95,
+    n_components=IPCA_N_COMPONENTS,
+    batch_size=IPCA_BATCH_SIZE,
+    dtype=np.float64,
+):
+    """
+    Fit PCA over the streamed database, then project it in a second streaming pass.
+
+    Returns:
+        tuple: (imageDB_projection, mean, principal_components, original_image_paths)
+    """
+    ipca = IncrementalPCA(n_components, dtype)
+    for batch, _ in iter_image_batches(image_paths, size, batch_size):
+        ipca.partial_fit(batch)
+    if ipca.n_samples_seen == 0:
+        return None, None, None, None
+    if np.sum(ipca.explained_variance) < threshold * ipca.total_variance:
+        # The other fit modes would keep more components to reach the threshold
+        logging.warning(
+            f"Incremental PCA capped at {n_components} components explains "
+            f"{np.sum(ipca.explained_variance) / ipca.total_variance:.1%} of the "
+            f"variance, below the {threshold:.0%} threshold; raise n_components "
+            f"(IPCA_N_COMPONENTS) to match the other fit modes."
+        )
+
+    principal_components = select_principal_components(
+        ipca.components.T, ipca.explained_variance, threshold, ipca.total_variance
+    )
+
+    projections, original_image_paths = [], []
+    for batch, batch_paths in iter_image_batches(image_paths, size, batch_size):
+        projections.append(
+            project_data(batch.astype(dtype) - ipca.mean, principal_components)
+        )
+        original_image_paths.extend(batch_paths)
+
+    return (
+        np.vstack(projections),
+        ipca.mean,
+        principal_components,
+        original_image_paths,
+    )
+
+
+def compute_total_variance(X_centered):
+    """
+    Sum of the per-pixel variances, i.e. the trace of the covariance matrix.
+    """
+    return np.sum(X_centered**2) / max(len(X_centered) - 1, 1)
+
+
+def perform_gram_pca(X_centered):
+    """
+    PCA through the N x N Gram matrix, cheaper than the D x D covariance when N < D.
+
+    Returns:
+        tuple: (principal components as columns, variance of each component)
+    """
+    gram_matrix = X_centered @ X_centered.T
+    eigen_values, eigen_vectors = np.linalg.eigh(gram_matrix)
+    order = np.argsort(eigen_values)[::-1]
+    eigen_values, eigen_vectors = eigen_values[order], eigen_vectors[:, order]
+
+    keep = eigen_values > eigen_values[0] * 1e-10
+    if not keep.any():
+        # Every image is the same (no variance): keep one axis so the projection and
+        # the search still have a dimension
+        components = np.zeros((X_centered.shape[1], 1), dtype=X_centered.dtype)
+        components[0] = 1
+        return components, np.zeros(1)
+    components = (X_centered.T @ eigen_vectors[:, keep]) / np.sqrt(eigen_values[keep])
+    variances = eigen_values[keep] / max(len(X_centered) - 1, 1)
+    return components, variances
+
+
+def randomized_svd(X, n_components, n_oversamples=10, n_iter=4, seed=0):
+    """
+    Approximate the leading singular vectors of X (Halko et al. range finder).
+
+    Returns:
+        tuple: (right singular vectors as columns, singular values)
+    """
+    rng = np.random.default_rng(seed)
+    n_random = min(n_components + n_oversamples, min(X.shape))
+    Q = X @ rng.standard_normal((X.shape[1], n_random)).astype(X.dtype)
+    Q, _ = np.linalg.qr(Q)
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(X.T @ Q)
+        Q, _ = np.linalg.qr(X @ Q)
+    _, S, Vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+    return Vt[:n_components].T, S[:n_components]
+
+
+def perform_randomized_pca(X_centered, threshold=0.95, n_components=64):
+    """
+    PCA with randomized SVD, computing only as many components as the variance
+    threshold needs (the guess is doubled until the threshold is reached).
+
+    Returns:
+        tuple: (principal components as columns, variance of each component)
+    """
+    total_variance = compute_total_variance(X_centered)
+    max_components = min(X_centered.shape)
+    while True:
+        n_components = min(n_components, max_components)
+        components, singular_values = randomized_svd(X_centered, n_components)
+        variances = singular_values**2 / max(len(X_centered) - 1, 1)
+        if (
+            np.sum(variances) >= threshold * total_variance
+            or n_components == max_components
+        ):
+            return components, variances
+        n_components *= 2
+
+
+def fit_principal_components(imageDB_centered, threshold=0.95, fit_mode=PCA_FIT_MODE):
+    """
+    fit_mode (str): "covariance" (full covariance + SVD), "gram" (Gram matrix, for N < D),
+    "randomized" (randomized SVD), or "auto" (gram when N < D, randomized otherwise).
+    The streaming "incremental" mode is handled by fit_incremental_pca instead.
+    """
+    if fit_mode == "auto":
+        n_samples, n_features = imageDB_centered.shape
+        fit_mode = "gram" if n_samples < n_features else "randomized"
+
+    if fit_mode == "covariance":
+        covariance_matrix = compute_covariance_matrix(imageDB_centered)
+        U, S, Vt = perform_svd(covariance_matrix)
+        return select_principal_components(U, S, threshold)
+    if fit_mode == "gram":
+        components, variances = perform_gram_pca(imageDB_centered)
+    elif fit_mode == "randomized":
+        components, variances = perform_randomized_pca(imageDB_centered, threshold)
+    else:
+        raise ValueError(f"Unknown PCA fit mode: {fit_mode}")
+    return select_principal_components(
+        components, variances, threshold, compute_total_variance(imageDB_centered)
+    )
+
+
 def project_data(X_centered, principal_components):
     return np.dot(X_centered, principal_components)
 
@@ -169,14 +511,50 @@ def project_data(X_centered, principal_components):
 # ====================================================================================
 
 
-def process_query_image(query_image_path, mean, size=(60, 60)):
+def open_query_image(query_image, size=(60, 60)):
+    """
+    Open a query image given as a path, as encoded bytes (bytes, BytesIO or any
+    binary file object), or already decoded (PIL image or H x W [x C] uint8 array).
+
+    Encoded JPEGs are draft-decoded: libjpeg scales the DCT blocks down by up to 8x
+    while decoding, so a large photo is never decoded at full resolution.
+
+    Returns:
+        PIL.Image.Image: The image in RGB (or RGBA) mode.
+    """
+    if isinstance(query_image, Image.Image):
+        image = query_image
+    elif isinstance(query_image, np.ndarray):
+        image = Image.fromarray(query_image.astype(np.uint8, copy=False))
+    else:
+        if isinstance(query_image, (bytes, bytearray, memoryview)):
+            query_image = io.BytesIO(query_image)
+        image = Image.open(query_image)
+        if QUERY_DRAFT_DECODE:
+            image.draft(
+                "RGB", (size[0] * QUERY_DRAFT_MARGIN, size[1] * QUERY_DRAFT_MARGIN)
+            )
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    return image
+
+
+def process_query_image(query_image, mean, size=(60, 60)):
+    """
+    Parameters:
+        query_image: The query image (see open_query_image for the accepted inputs).
+        mean (numpy.ndarray): The database mean image.
+        size (tuple): The size the images are compared at.
+
+    Returns:
+        numpy.ndarray: The flattened, mean-centered query image (None on failure).
+    """
     try:
-        query_image = Image.open(query_image_path)
-        query_image = preprocess_image(query_image, size)
+        query_image = preprocess_image(open_query_image(query_image, size), size)
         query_image_centered = np.array(query_image).flatten() - mean
         return query_image_centered
     except Exception as e:
-        print(f"Error processing query image {query_image_path}: {e}")
+        print(f"Error processing query image: {e}")
         return None
 
 
@@ -185,15 +563,103 @@ def project_query_image(query_image_centered, principal_components):
 
 
 def compute_euclidean_distances(query_projection, dataset_projections):
-    distances = np.linalg.norm(dataset_projections - query_projection, axis=1)
+    if dataset_projections.dtype != np.float16:
+        return np.linalg.norm(dataset_projections - query_projection, axis=1)
+
+    # float16 storage: convert and accumulate in float32, a block of rows at a time
+    distances = np.empty(len(dataset_projections), dtype=np.float32)
+    for start in range(0, len(dataset_projections), SCAN_CHUNK_ROWS):
+        block = dataset_projections[start : start + SCAN_CHUNK_ROWS].astype(np.float32)
+        distances[start : start + SCAN_CHUNK_ROWS] = np.linalg.norm(
+            block - query_projection, axis=1
+        )
     return distances
 
 
-def sort_by_similarity(distances, image_paths):
-    indices = np.argsort(distances)
-    sorted_image_paths = [image_paths[i] for i in indices]
-    sorted_distances = [distances[i] for i in indices]
-    return sorted_image_paths, sorted_distances
+def best_distance_per_image(distances, image_ids, num_images):
+    """
+    Reduce the distances of every augmented row to the best (minimum) distance of its
+    original image.
+    """
+    best_distances = np.full(num_images, np.inf)
+    np.minimum.at(best_distances, image_ids, distances)
+    return best_distances
+
+
+def compute_similarity_percentages(best_distances, max_distance=None):
+    """
+    Map each image's best distance to a percentage relative to the closest (100%) and
+    farthest (0%) image of the database.
+
+    max_distance gives the (estimated) farthest image's distance when only candidates
+    were scored.
+    """
+    finite_distances = best_distances[np.isfinite(best_distances)]
+    min_distance = finite_distances.min()
+    if max_distance is None:
+        max_distance = finite_distances.max()
+    distance_range = (
+        max_distance - min_distance if max_distance != min_distance else 1
+    )  # Prevent division by zero
+    return np.round(((max_distance - best_distances) / distance_range) * 100, 2)
+
+
+def search_top_k(query_projection, index, k=TOP_K_MATCHES):
+    """
+    Find the k closest albums to the query using partial selection.
+    Uses the index's IVF lists when it has one, otherwise scans every row.
+
+    Returns:
+        list: (image path, similarity percentage) for the k best images, best first.
+    """
+    num_images = len(index.image_paths)
+    if num_images == 0:
+        return []
+    query_projection = np.asarray(
+        query_projection,
+        dtype=np.result_type(index.imageDB_projection.dtype, np.float32),
+    )
+    if index.ann_index is not None:
+        # Only score the rows of the closest inverted lists
+        rows, distances = index.ann_index.search(
+            query_projection, index.imageDB_projection
+        )
+        best_distances = best_distance_per_image(
+            distances, index.image_ids[rows], num_images
+        )
+        # Score every augmented row of the candidate images, not only the probed ones,
+        # so each candidate gets the same best distance as in the exact scan
+        rows = np.flatnonzero(np.isfinite(best_distances)[index.image_ids])
+        best_distances = best_distance_per_image(
+            compute_euclidean_distances(query_projection, index.imageDB_projection[rows]),
+            index.image_ids[rows],
+            num_images,
+        )
+        # 0% reference: the farthest image of the database, estimated in O(n_lists)
+        # with the scale calibrated against the exact scan when the lists were built
+        max_distance = max(
+            index.ann_index.estimate_farthest_distance(query_projection),
+            best_distances[np.isfinite(best_distances)].max(initial=0),
+        )
+        num_images = np.count_nonzero(np.isfinite(best_distances))
+        if num_images == 0:
+            return []
+    else:
+        distances = compute_euclidean_distances(
+            query_projection, index.imageDB_projection
+        )
+        best_distances = best_distance_per_image(distances, index.image_ids, num_images)
+        max_distance = None
+    similarity_percentages = compute_similarity_percentages(
+        best_distances, max_distance
+    )
+
+    k = min(k, num_images)
+    top_ids = np.argpartition(best_distances, k - 1)[:k]
+    top_ids = top_ids[np.argsort(best_distances[top_ids], kind="stable")]
+    return [
+        (index.image_paths[i], float(similarity_percentages[i])) for i in top_ids
+    ]
 
 
 # ====================================================================================
@@ -201,52 +667,337 @@ def sort_by_similarity(distances, image_paths):
 # ====================================================================================
 
 
-def process_database(db_dir_path, process_db=True, size=(60, 60), threshold=0.95):
+def write_array(directory, name, array):
     """
-    threshold (float): Variance threshold for selecting principal components.
+    Write one .npy file of the index (through a temporary file, replaced in one step).
+    np.save pads the header so the data starts on an aligned offset for np.memmap.
     """
-    if not process_db and os.path.exists(IMAGE_DB_PROJECTION_FILE):
-        print("Loading existing database projections...")
-        data = np.load(IMAGE_DB_PROJECTION_FILE)
-        imageDB_projection = data["imageDB_projection"]
-        mean = np.load(MEAN_FILE)
-        principal_components = np.load(PRINCIPAL_COMPONENTS_FILE)
-        original_image_paths = np.load(ORIGINAL_IMAGE_PATHS_FILE, allow_pickle=True)
-        original_image_paths = original_image_paths.tolist()
+    temp_path = os.path.join(directory, f"{name}.npy.tmp")
+    with open(temp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(temp_path, os.path.join(directory, f"{name}.npy"))
+
+
+def save_processed_data(
+    index, threshold=0.95, directory=IMAGE_INDEX_DIR, precision=PRECISION_MODE
+):
+    """
+    Write the processed database as a memory-mappable image index, with the
+    approximate nearest neighbour index for large databases.
+
+    The header is written last (and removed first), so a partially written index is
+    never loaded.
+
+    Parameters:
+        index (ImageIndex): The processed database.
+        threshold (float): The variance threshold the principal components were selected with.
+        directory (str): The image index directory.
+        precision (str): The precision mode (see PRECISION_MODE).
+
+    Returns:
+        IVFIndex: The approximate nearest neighbour index (None for small databases).
+    """
+    os.makedirs(directory, exist_ok=True)
+    header_path = os.path.join(directory, "header.json")
+    if os.path.exists(header_path):
+        os.remove(header_path)
+
+    # String table: UTF-8 paths back to back, path i is table[offsets[i]:offsets[i+1]]
+    encoded_paths = [path.encode("utf-8") for path in index.image_paths]
+    path_offsets = np.zeros(len(encoded_paths) + 1, dtype=np.int64)
+    path_offsets[1:] = np.cumsum([len(path) for path in encoded_paths])
+    temp_path = os.path.join(directory, "path_table.bin.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(b"".join(encoded_paths))
+    os.replace(temp_path, os.path.join(directory, "path_table.bin"))
+
+    projection = np.asarray(index.imageDB_projection, dtype=storage_dtype(precision))
+    write_array(directory, "projection", projection)
+    write_array(directory, "image_ids", np.asarray(index.image_ids, dtype=np.int32))
+    write_array(directory, "mean", np.asarray(index.mean, dtype=compute_dtype(precision)))
+    write_array(
+        directory,
+        "principal_components",
+        np.asarray(index.principal_components, dtype=compute_dtype(precision)),
+    )
+    write_array(directory, "path_offsets", path_offsets)
+
+    # Build the approximate nearest neighbour index for large databases
+    ann_index = None
+    ann_path = os.path.join(directory, ANN_INDEX_FILE_NAME)
+    if len(projection) >= ANN_MIN_ROWS:
+        ann_index = IVFIndex.build(projection, n_probe=ANN_N_PROBE)
+        ann_index.calibrate_farthest(projection, index.image_ids, len(index.image_paths))
+        ann_index.save(ann_path)
+    elif os.path.exists(ann_path):
+        os.remove(ann_path)
+
+    header = {
+        "version": IMAGE_INDEX_VERSION,
+        "num_rows": int(projection.shape[0]),
+        "num_components": int(projection.shape[1]) if projection.ndim == 2 else 0,
+        "num_pixels": int(np.size(index.mean)),
+        "num_images": len(index.image_paths),
+        "projection_dtype": projection.dtype.name,
+        "precision": precision,
+        "pca_threshold": threshold,
+        # Rows the IVF lists were built over (None when there is no ANN index)
+        "ann_num_rows": int(projection.shape[0]) if ann_index is not None else None,
+    }
+    with open(header_path, "w") as f:
+        json.dump(header, f, indent=4)
+    return ann_index
+
+
+def build_image_index(
+    db_dir_path,
+    size=(60, 60),
+    threshold=0.95,
+    fit_mode=PCA_FIT_MODE,
+    precision=PRECISION_MODE,
+):
+    """
+    Fit the PCA on the database images and project them (in memory, nothing saved).
+
+    Parameters:
+        threshold (float): Variance threshold for selecting principal components.
+        fit_mode (str): How the principal components are computed (see fit_principal_components).
+        precision (str): The precision mode (see PRECISION_MODE).
+
+    Returns:
+        ImageIndex: The index, with its projections in the storage type, or None if no
+        image could be loaded.
+    """
+    dtype = compute_dtype(precision)
+    if fit_mode == "incremental":
+        print("Processing database images in mini-batches...")
+        # Stream the images twice: once to fit the PCA, once to project them
+        imageDB_projection, mean, principal_components, original_image_paths = (
+            fit_incremental_pca(
+                list_image_files(db_dir_path), size, threshold, dtype=dtype
+            )
+        )
+        if imageDB_projection is None:
+            return None
     else:
         print("Processing database images...")
         # Load and preprocess database images
         imageDB, original_image_paths = load_image_database(db_dir_path, size)
         if imageDB.size == 0:
+            return None
+
+        # Standardize the data
+        imageDB_centered, mean = standardize_data(imageDB, dtype)
+
+        # Compute only the principal components reaching the variance threshold
+        principal_components = fit_principal_components(
+            imageDB_centered, threshold, fit_mode
+        )
+
+        # Project imageDB_centered onto the principal components
+        imageDB_projection = project_data(imageDB_centered, principal_components)
+
+    return ImageIndex.from_original_paths(
+        imageDB_projection.astype(storage_dtype(precision)),
+        mean,
+        principal_components,
+        original_image_paths,
+    )
+
+
+def process_database(
+    db_dir_path,
+    process_db=True,
+    size=(60, 60),
+    threshold=0.95,
+    fit_mode=PCA_FIT_MODE,
+    precision=PRECISION_MODE,
+):
+    """
+    threshold (float): Variance threshold for selecting principal components.
+    fit_mode (str): How the principal components are computed (see fit_principal_components).
+    precision (str): The precision mode (see PRECISION_MODE).
+    """
+    index = ImageIndex.load() if not process_db else None
+    if index is not None:
+        print("Loading existing database projections...")
+    else:
+        built_index = build_image_index(db_dir_path, size, threshold, fit_mode, precision)
+        if built_index is None:
             print("No images loaded.")
             return None, None, None, None
 
-        # Standardize the data
-        imageDB_centered, mean = standardize_data(imageDB)
+        # Save the data, then serve it from the memory-mapped files
+        save_processed_data(built_index, threshold, precision=precision)
+        index = ImageIndex.load()
+        print("Database processing complete and data saved.")
 
-        # Compute the covariance matrix
-        covariance_matrix = compute_covariance_matrix(imageDB_centered)
+    # Swap the resident index so new queries use the rebuilt database
+    set_image_index(index)
 
-        # Perform SVD
-        U, S, Vt = perform_svd(covariance_matrix)
+    return (
+        index.imageDB_projection,
+        index.mean,
+        index.principal_components,
+        index.original_image_paths,
+    )
 
-        # Select the principal components
-        principal_components = select_principal_components(U, S, threshold)
 
-        # Project imageDB_centered onto the principal components
-        imageDB_projection = project_data(imageDB_centered, principal_components)
+# ====================================================================================
+# Step 5: Resident Image Index
+# ====================================================================================
 
-        # Save the data
-        os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
-        np.savez_compressed(
-            IMAGE_DB_PROJECTION_FILE, imageDB_projection=imageDB_projection
+
+class ImageIndex:
+    """
+    Resident copy of the processed database, so queries never re-read the files.
+    The projection matrix is memory-mapped, so every worker process shares the same
+    page-cache copy.
+    """
+
+    def __init__(
+        self,
+        imageDB_projection,
+        mean,
+        principal_components,
+        image_paths,
+        image_ids,
+        ann_index=None,
+    ):
+        self.imageDB_projection = imageDB_projection
+        self.mean = mean
+        self.principal_components = principal_components
+        self.image_paths = list(image_paths)  # One entry per original image
+        self.image_ids = image_ids  # Image id of every augmented row
+        self.ann_index = ann_index  # Optional IVFIndex over imageDB_projection
+
+    @classmethod
+    def from_original_paths(
+        cls,
+        imageDB_projection,
+        mean,
+        principal_components,
+        original_image_paths,
+        ann_index=None,
+    ):
+        """
+        Build the index from the path of every augmented row.
+        """
+        image_paths = list(dict.fromkeys(original_image_paths))
+        image_id_of = {path: i for i, path in enumerate(image_paths)}
+        image_ids = np.array(
+            [image_id_of[path] for path in original_image_paths], dtype=np.int32
         )
-        np.save(MEAN_FILE, mean)
-        np.save(PRINCIPAL_COMPONENTS_FILE, principal_components)
-        np.save(ORIGINAL_IMAGE_PATHS_FILE, original_image_paths)
-        print("Database processing complete and data saved.")
+        return cls(
+            imageDB_projection, mean, principal_components, image_paths, image_ids, ann_index
+        )
+
+    @property
+    def original_image_paths(self):
+        return [self.image_paths[i] for i in self.image_ids]
+
+    @classmethod
+    def load(cls, directory=IMAGE_INDEX_DIR):
+        """
+        Load the index from the image index directory, or return None if it was never
+        built. Databases processed before the memory-mapped layout are still read.
+        """
+        header_path = os.path.join(directory, "header.json")
+        if not os.path.exists(header_path):
+            return cls.load_legacy()
+        with open(header_path, "r") as f:
+            header = json.load(f)
+        if header.get("version") != IMAGE_INDEX_VERSION:
+            print(f"Unsupported image index version in {header_path}.")
+            return None
+
+        with open(os.path.join(directory, "path_table.bin"), "rb") as f:
+            path_table = f.read()
+        path_offsets = np.load(os.path.join(directory, "path_offsets.npy"))
+        image_paths = [
+            path_table[start:end].decode("utf-8")
+            for start, end in zip(path_offsets[:-1], path_offsets[1:])
+        ]
+        imageDB_projection = np.load(
+            os.path.join(directory, "projection.npy"), mmap_mode="r"
+        )
+        if (
+            len(imageDB_projection) != header["num_rows"]
+            or len(image_paths) != header["num_images"]
+        ):
+            print(f"Image index in {directory} does not match its header.")
+            return None
+        return cls(
+            imageDB_projection,
+            np.load(os.path.join(directory, "mean.npy")),
+            np.load(os.path.join(directory, "principal_components.npy")),
+            image_paths,
+            np.load(os.path.join(directory, "image_ids.npy"), mmap_mode="r"),
+            load_ann_index(directory, header),
+        )
+
+    @classmethod
+    def load_legacy(cls):
+        """
+        Load the compressed projection and pickled path list of older databases.
+        They have no ANN index and are always scanned exactly.
+        """
+        if not os.path.exists(IMAGE_DB_PROJECTION_FILE):
+            return None
+        with np.load(IMAGE_DB_PROJECTION_FILE) as data:
+            imageDB_projection = data["imageDB_projection"]
+        mean = np.load(MEAN_FILE)
+        principal_components = np.load(PRINCIPAL_COMPONENTS_FILE)
+        original_image_paths = np.load(ORIGINAL_IMAGE_PATHS_FILE, allow_pickle=True)
+        return cls.from_original_paths(
+            imageDB_projection,
+            mean,
+            principal_components,
+            original_image_paths.tolist(),
+        )
+
+
+def load_ann_index(directory, header):
+    """
+    Load the IVF lists of an image index if its header lists them and they cover
+    exactly the header's projection rows; otherwise queries fall back to the exact scan.
+    """
+    ann_path = os.path.join(directory, ANN_INDEX_FILE_NAME)
+    if header.get("ann_num_rows") is None or not os.path.exists(ann_path):
+        return None
+    ann_index = IVFIndex.load(ann_path)
+    if not (header["ann_num_rows"] == header["num_rows"] == len(ann_index.list_rows)):
+        print(f"ANN index in {directory} does not match its header, scanning exactly.")
+        return None
+    return ann_index
 
-    return imageDB_projection, mean, principal_components, original_image_paths
+
+_image_index = None
+
+
+def set_image_index(index):
+    """
+    Atomically replace the resident index (in-flight queries keep their reference).
+    """
+    global _image_index
+    _image_index = index
+
+
+def load_image_index():
+    """
+    (Re)load the resident index from disk, e.g. at server startup.
+    """
+    set_image_index(ImageIndex.load())
+    return _image_index
+
+
+def get_image_index():
+    """
+    Return the resident index, loading it from disk on first use.
+    """
+    if _image_index is None:
+        return load_image_index()
+    return _image_index
 
 
 # ====================================================================================
@@ -254,13 +1005,45 @@ def process_database(db_dir_path, process_db=True, size=(60, 60), threshold=0.95
 # ====================================================================================
 
 
-def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory):
-    # Prepare result directories
+def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory=None):
+    # Map to hold the best (minimum) distance for each original image
+    original_image_best_distance = {}
+
+    for path, distance in zip(sorted_image_paths, sorted_distances):
+        if path not in original_image_best_distance:
+            original_image_best_distance[path] = distance
+        else:
+            if distance < original_image_best_distance[path]:
+                original_image_best_distance[path] = distance
+
+    # Calculate similarity percentages based on best distances
+    if not original_image_best_distance:
+        logging.warning("No images to process.")
+        return
+
+    similarity_percentages = compute_similarity_percentages(
+        np.array(list(original_image_best_distance.values()))
+    )
+    ranked_matches = sorted(
+        zip(original_image_best_distance.keys(), similarity_percentages.tolist()),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+
+    return save_ranked_matches(ranked_matches, mapper, result_directory)
+
+
+def clear_result_directory(result_directory, result_json_name):
+    """
+    Create the audio/ and picture/ export directories, removing their previous
+    contents and the previous result JSON file.
+
+    Returns:
+        tuple: (audio directory, picture directory, result JSON path)
+    """
     result_audio_dir = os.path.join(result_directory, "audio")
     result_picture_dir = os.path.join(result_directory, "picture")
-    apf_result_path = os.path.join(
-        result_directory, "json/APF_result.json"
-    )  # Define the JSON path
+    result_json_path = os.path.join(result_directory, "json", result_json_name)
     os.makedirs(result_audio_dir, exist_ok=True)
     os.makedirs(result_picture_dir, exist_ok=True)
 
@@ -275,50 +1058,44 @@ def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory)
             except Exception as e:
                 logging.error(f"Error deleting file {file_path}: {e}")
 
-    # Remove existing APF_result.json if it exists
-    if os.path.exists(apf_result_path):
+    # Remove the existing result JSON file if it exists
+    if os.path.exists(result_json_path):
         try:
-            os.remove(apf_result_path)
-            logging.info(f"Removed existing JSON file: {apf_result_path}")
+            os.remove(result_json_path)
+            logging.info(f"Removed existing JSON file: {result_json_path}")
         except Exception as e:
-            logging.error(f"Error deleting JSON file {apf_result_path}: {e}")
-
-    # Map to hold the best (minimum) distance for each original image
-    original_image_best_distance = {}
-
-    for path, distance in zip(sorted_image_paths, sorted_distances):
-        if path not in original_image_best_distance:
-            original_image_best_distance[path] = distance
-        else:
-            if distance < original_image_best_distance[path]:
-                original_image_best_distance[path] = distance
+            logging.error(f"Error deleting JSON file {result_json_path}: {e}")
 
-    # Calculate similarity percentages based on best distances
-    distances = list(original_image_best_distance.values())
-    if not distances:
-        logging.warning("No images to process.")
-        return
+    return result_audio_dir, result_picture_dir, result_json_path
 
-    min_distance = min(distances)
-    max_distance = max(distances)
-    distance_range = (
-        max_distance - min_distance if max_distance != min_distance else 1
-    )  # Prevent division by zero
 
-    similarity_percentages = {}
-    for path, distance in original_image_best_distance.items():
-        if distance_range == 0:
-            similarity_percentage = 100.0
-        else:
-            similarity_percentage = round(
-                ((max_distance - distance) / distance_range) * 100, 2
-            )
-        similarity_percentages[path] = similarity_percentage
+def save_ranked_matches(ranked_matches, mapper, result_directory=None):
+    """
+    Build the result entries of the matches above the similarity threshold. The
+    entries point at the canonical database files (imageUrl and each song's
+    audioUrl), so nothing is copied unless an export directory is given.
+
+    Parameters:
+        ranked_matches (list): (image path, similarity percentage) pairs, best first.
+        mapper (MapperCatalogue or list): The album catalogue (or the raw mapper albums).
+        result_directory (str): Optional export directory. The matched images and
+            songs are copied into it and the entries saved to json/APF_result.json,
+            replacing the previous export.
+
+    Returns:
+        list: The result entries, best first (None if no match reaches the threshold).
+    """
+    catalogue = as_catalogue(mapper)
+    export = result_directory is not None
+    if export:
+        result_audio_dir, result_picture_dir, apf_result_path = clear_result_directory(
+            result_directory, "APF_result.json"
+        )
 
     # Filter images based on similarity threshold
     filtered_images = [
         (path, sim_percent)
-        for path, sim_percent in similarity_percentages.items()
+        for path, sim_percent in ranked_matches
         if sim_percent >= SIMILARITY_THRESHOLD
     ]
 
@@ -328,29 +1105,30 @@ def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory)
         )
         return
 
-    # Sort the filtered images by similarity percentage descending
-    filtered_images.sort(key=lambda x: x[1], reverse=True)
-
     # Prepare list for APF_result.json
     apf_results = []
     similarity_rank = 1
 
     for path, similarity_percentage in filtered_images:
-        # Copy the image to the result directory
-        destination_image_path = os.path.join(
-            result_picture_dir, f"{similarity_rank}.jpg"
-        )
-        try:
-            shutil.copy(path, destination_image_path)
-            logging.info(f"Copied {path} to {destination_image_path}")
-        except Exception as e:
-            logging.error(f"Error copying image {path}: {e}")
-            continue  # Skip to next if copying fails
+        if export:
+            # Copy the image to the result directory
+            destination_image_path = os.path.join(
+                result_picture_dir, f"{similarity_rank}.jpg"
+            )
+            try:
+                shutil.copy(path, destination_image_path)
+                logging.info(f"Copied {path} to {destination_image_path}")
+            except Exception as e:
+                logging.error(f"Error copying image {path}: {e}")
+                continue  # Skip to next if copying fails
 
         # Find the corresponding album for the image
-        album_found = False
-        for album in mapper:
-            if album["imageSrc"].endswith(os.path.basename(path)):
+        album = catalogue.album_for_image(path)
+        if album is not None:
+            songs = [
+                dict(song, audioUrl=audio_url(song["file"])) for song in album["songs"]
+            ]
+            if export:
                 # Copy corresponding audio files
                 for song in album["songs"]:
                     audio_file_path = os.path.join(AUDIO_DIR, song["file"])
@@ -368,32 +1146,31 @@ def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory)
                             f"Error copying audio file {audio_file_path}: {e}"
                         )
 
-                # Prepare APF_result.json entry
-                apf_entry = {
-                    "similarity_rank": similarity_rank,
-                    "similarity_percentage": similarity_percentage,
-                    "id": album["id"],
-                    "title": album["title"],
-                    "imageSrc": album["imageSrc"],
-                    "songs": album["songs"],
-                }
-                apf_results.append(apf_entry)
-                album_found = True
-                break  # Assuming one album per image
-
-        if not album_found:
+            # Prepare APF_result.json entry
+            apf_entry = {
+                "similarity_rank": similarity_rank,
+                "similarity_percentage": similarity_percentage,
+                "id": album["id"],
+                "title": album["title"],
+                "imageSrc": album["imageSrc"],
+                "imageUrl": image_url(path),
+                "songs": songs,
+            }
+            apf_results.append(apf_entry)
+        else:
             logging.warning(f"No matching album found for image {path}")
 
         similarity_rank += 1
 
     # Save APF_result.json
-    try:
-        os.makedirs(os.path.dirname(apf_result_path), exist_ok=True)
-        with open(apf_result_path, "w") as f:
-            json.dump(apf_results, f, indent=4)
-        logging.info(f"Saved APF_result.json to {apf_result_path}")
-    except Exception as e:
-        logging.error(f"Error saving APF_result.json: {e}")
+    if export:
+        try:
+            os.makedirs(os.path.dirname(apf_result_path), exist_ok=True)
+            with open(apf_result_path, "w") as f:
+                json.dump(apf_results, f, indent=4)
+            logging.info(f"Saved APF_result.json to {apf_result_path}")
+        except Exception as e:
+            logging.error(f"Error saving APF_result.json: {e}")
 
     return apf_results  # Return the list of matched results
 
@@ -403,44 +1180,62 @@ def save_matches(sorted_image_paths, sorted_distances, mapper, result_directory)
 # ====================================================================================
 
 
+def rank_query_image(query_image, index, size=(60, 60), top_k=TOP_K_MATCHES):
+    """
+    Parameters:
+        query_image: The query image (path, encoded bytes or decoded array).
+
+    Returns:
+        list: (image path, similarity percentage) for the top_k closest images, best
+        first, or None if the query image cannot be processed.
+    """
+    # Process the query image
+    query_image_centered = process_query_image(query_image, index.mean, size)
+    if query_image_centered is None:
+        return None
+
+    query_projection = project_query_image(
+        query_image_centered, index.principal_components
+    )
+
+    # Find the top-k closest albums to the query image
+    return search_top_k(query_projection, index, top_k)
+
+
 def process_query(
-    query_image_path,
-    result_directory,
-    mapper,
+    query_image,
+    result_directory=None,
+    mapper=None,
     size=(60, 60),
+    index=None,
+    top_k=TOP_K_MATCHES,
 ):
-    # Load the saved database projections and related data
-    if not os.path.exists(IMAGE_DB_PROJECTION_FILE):
+    """
+    Parameters:
+        query_image: The query image: a path, encoded bytes (bytes or BytesIO, e.g.
+            the request body) or an already decoded array.
+        result_directory (str): Optional export directory (see save_ranked_matches);
+            by default the results only reference the database files.
+        mapper (MapperCatalogue or list): The album catalogue (defaults to the
+            resident catalogue).
+    """
+    if mapper is None:
+        mapper = get_catalogue()
+
+    # Use the resident database projections and related data
+    if index is None:
+        index = get_image_index()
+    if index is None:
         print("Database projections not found. Please process the database first.")
         return []
 
-    data = np.load(IMAGE_DB_PROJECTION_FILE)
-    imageDB_projection = data["imageDB_projection"]
-    mean = np.load(MEAN_FILE)
-    principal_components = np.load(PRINCIPAL_COMPONENTS_FILE)
-    original_image_paths = np.load(ORIGINAL_IMAGE_PATHS_FILE, allow_pickle=True)
-    original_image_paths = original_image_paths.tolist()
-
-    # Process the query image
-    query_image_centered = process_query_image(query_image_path, mean, size)
-    if query_image_centered is None:
+    ranked_matches = rank_query_image(query_image, index, size, top_k)
+    if ranked_matches is None:
         print("Failed to process the query image.")
         return []
 
-    query_projection = project_query_image(query_image_centered, principal_components)
-
-    # Compute Euclidean distances between the query image and dataset images
-    distances = compute_euclidean_distances(query_projection, imageDB_projection)
-
-    # Sort the dataset images by similarity to the query image
-    sorted_image_paths, sorted_distances = sort_by_similarity(
-        distances, original_image_paths
-    )
-
-    # Save the matches to the result directories and APF_result.json with similarity >= threshold
-    apf_results = save_matches(
-        sorted_image_paths, sorted_distances, mapper, result_directory
-    )
+    # Result entries with similarity >= threshold (exported only if a directory is given)
+    apf_results = save_ranked_matches(ranked_matches, mapper, result_directory)
 
     return apf_results
 
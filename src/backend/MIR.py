@@ -1,8 +1,31 @@
 import os
+import time
+import hashlib
+import tempfile
+import threading
 import numpy as np
 import shutil
-from music21 import converter
-from backend.utils.convert_audio_to_midi import convert_audio_to_midi
+from backend.utils.convert_audio_to_midi import (
+    convert_audio_to_midi,
+    convert_audio_files_to_midi,
+    transcribe_audio_file,
+)
+from backend.utils.midi_reader import (
+    read_midi_notes_or_empty,
+    pair_note_events,
+    pitch_sequence,
+)
+from backend.utils.note_features import (
+    ragged_notes,
+    normalize_notes_batch,
+    extract_features_batch,
+    normalize_rows,
+)
+from backend.utils.ngram_index import NGramIndex, NGRAM_LENGTH, DEFAULT_MAX_CANDIDATES
+from backend.utils.segment_index import SegmentIndex, SEGMENT_WINDOW, SEGMENT_HOP
+from backend.utils.dtw import rerank_candidates
+from backend.utils.executors import get_parse_executor
+from backend.utils.catalogue import as_catalogue, image_url, audio_url
 import json
 import logging
 from pathlib import Path
@@ -14,8 +37,24 @@ ROOT_DIR = BASE_DIR = Path(__file__).resolve().parent.parent.parent
 BASE_DIR = Path(__file__).resolve().parent  # Points to 'backend/'
 MIDI_DATASET_PATH = BASE_DIR / "database" / "midi_audio"
 AUDIO_DIR = os.path.join(BASE_DIR, "database", "audio")
+PROCESSED_DATA_DIR = BASE_DIR / "database" / "processed_data"
+MIDI_FEATURE_STORE_FILE = PROCESSED_DATA_DIR / "midi_feature_store.npz"
+MIDI_SEGMENT_DIR = PROCESSED_DATA_DIR / "midi_segments"
+MIDI_NGRAM_INDEX_FILE = PROCESSED_DATA_DIR / "midi_ngram_index.npz"
 SIMILARITY_THRESHOLD = 0.75  # Minimum similarity score to consider a match
+SIMILARITY_WEIGHTS = (0.4, 0.4, 0.2)  # Weights for ATB, RTB, and FTB respectively
 MIR_RESULT_JSON = "src/backend/query_result/MIR_result.json"
+NOTE_EVENT_TEMPO = 120  # Tempo basic_pitch writes its transcriptions at (bpm)
+NOTE_EVENT_RESOLUTION = 220  # Ticks per quarter note of the basic_pitch MIDI files
+NGRAM_MIN_SONGS = 1000  # Minimum catalogue size before queries are pruned by n-grams
+# Score a song by its best note window instead of the whole song. Off by default: on
+# the bundled queries the max over windows ranks the source song 7th-17th instead of
+# 1st and lifts every song above SIMILARITY_THRESHOLD. The segment index is only built
+# when a query asks for it (or at ingest when this is on).
+SEGMENT_SCORING = False
+RERANK_TOP_K = 0  # Histogram matches re-ranked with DTW (0 disables the second stage)
+MAX_RERANK_TOP_K = 100  # Upper bound on the DTW re-rank, bounding its latency
+PARALLEL_PARSE_MIN_FILES = 32  # New MIDI files before parsing moves to the parsing pool
 
 
 # Step 1: Audio Processing
@@ -27,27 +66,41 @@ def process_midi_file(midi_file_path):
         midi_file_path (str): The path to the MIDI file.
 
     Returns:
-        list: A list of MIDI note pitches extracted from the main melody track.
+        numpy.ndarray: The MIDI note pitches extracted from the main melody track.
     """
-    try:
-        audio = converter.parse(midi_file_path)
-        notes = []
+    # Pitches of the first note-bearing track (channel 1, main melody)
+    return read_midi_notes_or_empty(midi_file_path)
 
-        # Try to select the first "Part" (channel 1, main melody)
-        parts = audio.getElementsByClass("Part")
-        melody_part = parts[0] if parts else audio
 
-        for element in melody_part.flatten().notes:
-            if element.isNote:
-                notes.append(element.pitch.midi)
-            elif element.isChord:
-                # If the element is a chord, extend the list with MIDI pitches of all notes in the chord
-                notes.extend(p.midi for p in element.pitches)
+def notes_from_note_events(note_events):
+    """
+    Build the pitch sequence of a transcription straight from its note events,
+    without writing and re-parsing a MIDI file.
 
-        return notes
-    except Exception as e:
-        print(f"Error processing MIDI file {midi_file_path}: {e}")
-        return []
+    The events are placed on the tick grid basic_pitch writes its MIDI with, so the
+    result matches what process_midi_file() would read back from that file.
+
+    Parameters:
+        note_events (list): (start_s, end_s, pitch_midi, amplitude, pitch_bends) tuples.
+
+    Returns:
+        list: A list of MIDI note pitches in playback order.
+    """
+    ticks_per_second = NOTE_EVENT_TEMPO / 60 * NOTE_EVENT_RESOLUTION
+    events = []
+    for start, end, pitch, *_ in note_events:
+        events.append((int(round(start * ticks_per_second)), True, int(pitch), 0))
+        events.append((int(round(end * ticks_per_second)), False, int(pitch), 0))
+    # (tick, is_note_on, pitch) reproduces the order read_track_events reads the events
+    # back from the written file, so pair_note_events pairs them as process_midi_file
+    # would: by tick, note-offs before note-ons within a tick, then by pitch
+    events.sort(key=lambda event: event[:3])
+
+    notes = [
+        (on_tick / NOTE_EVENT_RESOLUTION, off_tick / NOTE_EVENT_RESOLUTION, pitch)
+        for on_tick, off_tick, pitch in pair_note_events(events)
+    ]
+    return pitch_sequence(notes)
 
 
 def normalize_notes(notes):
@@ -60,14 +113,14 @@ def normalize_notes(notes):
     Returns:
         list: The list of normalized note pitches.
     """
-    if not notes:
+    if len(notes) == 0:
         return []
     mean_pitch = np.mean(notes)
     std_pitch = np.std(notes)
     if std_pitch == 0:
         std_pitch = 1  # Prevent division by zero
-    normalized_notes = [(note - mean_pitch) / std_pitch for note in notes]
-    return normalized_notes
+    normalized_notes = (np.asarray(notes) - mean_pitch) / std_pitch
+    return normalized_notes.tolist()
 
 
 # ====================================================================================
@@ -85,7 +138,7 @@ def extract_features(notes):
     Returns:
         tuple: Three np arrays representing normalized ATB, RTB, FTB features.
     """
-    if not notes:
+    if len(notes) == 0:
         # Return zero arrays if notes are empty
         return np.zeros(128), np.zeros(255), np.zeros(255)
 
@@ -99,12 +152,331 @@ def extract_features(notes):
     rtb = np.histogram(intervals, bins=range(-127, 128 + 1), density=True)[0]
 
     # FTB
-    first_note = notes[0]
-    ftb_intervals = [note - first_note for note in notes]
+    ftb_intervals = np.asarray(notes) - notes[0]
     ftb = np.histogram(ftb_intervals, bins=range(-127, 128 + 1), density=True)[0]
     return atb, rtb, ftb
 
 
+# ====================================================================================
+# Step 2.1: Database Feature Store
+# ====================================================================================
+
+_feature_store = None
+_feature_store_lock = threading.Lock()  # Serializes builds of the resident store
+_segment_index_lock = threading.Lock()  # Serializes on-demand segment index builds
+
+
+def file_content_hash(file_path):
+    """
+    Parameters:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The SHA-1 hex digest of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_fingerprint(feature_store):
+    """
+    Parameters:
+        feature_store (dict): The MIDI feature store.
+
+    Returns:
+        str: A SHA-1 digest of the store's file names and content hashes.
+    """
+    digest = hashlib.sha1()
+    for name, content_hash in zip(feature_store["file_names"], feature_store["hashes"]):
+        digest.update(f"{name}:{content_hash};".encode())
+    return digest.hexdigest()
+
+
+def load_feature_store(
+    store_file=MIDI_FEATURE_STORE_FILE, midi_dataset_path=MIDI_DATASET_PATH
+):
+    """
+    Load the precomputed database features from disk.
+
+    Parameters:
+        store_file (str): The path to the feature store (.npz).
+        midi_dataset_path (str): The directory the stored file names are relative to.
+
+    Returns:
+        dict: The feature store, or None if it does not exist or cannot be read.
+    """
+    if not os.path.exists(store_file):
+        return None
+    try:
+        with np.load(store_file) as data:
+            store = {key: data[key] for key in data.files}
+    except Exception as e:
+        logging.error(f"Error loading feature store {store_file}: {e}")
+        return None
+
+    store["file_names"] = store["file_names"].tolist()
+    store["hashes"] = store["hashes"].tolist()
+    store["files"] = [
+        os.path.join(midi_dataset_path, name) for name in store["file_names"]
+    ]
+    store["similarity_matrices"] = build_similarity_matrices(
+        store["atb"], store["rtb"], store["ftb"]
+    )
+    return store
+
+
+def save_feature_store(store, store_file=MIDI_FEATURE_STORE_FILE):
+    """
+    Atomically write the feature store to disk (write to a temp file, then rename).
+    """
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(store_file), suffix=".npz.tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                file_names=np.array(store["file_names"], dtype=str),
+                hashes=np.array(store["hashes"], dtype=str),
+                mtimes=store["mtimes"],
+                sizes=store["sizes"],
+                atb=store["atb"],
+                rtb=store["rtb"],
+                ftb=store["ftb"],
+                notes=store["notes"],
+                note_offsets=store["note_offsets"],
+            )
+        os.replace(temp_path, store_file)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_segment_index(feature_store, segment_dir=MIDI_SEGMENT_DIR):
+    """
+    Memory-map the segment index of the feature store, building it first when it is
+    missing or was built for other files or window settings.
+
+    Parameters:
+        feature_store (dict): The MIDI feature store.
+        segment_dir (str): The directory of the segment index.
+
+    Returns:
+        SegmentIndex: The memory-mapped segment index.
+    """
+    fingerprint = store_fingerprint(feature_store)
+    segment_index = SegmentIndex.load(segment_dir, fingerprint)
+    if segment_index is not None and (segment_index.window, segment_index.hop) == (
+        SEGMENT_WINDOW,
+        SEGMENT_HOP,
+    ):
+        return segment_index
+
+    logging.info("Building the MIDI segment index...")
+    segment_index = SegmentIndex.build(
+        feature_store["notes"], feature_store["note_offsets"]
+    )
+    try:
+        segment_index.save(segment_dir, fingerprint)
+    except Exception as e:
+        logging.error(f"Error saving segment index {segment_dir}: {e}")
+        return segment_index
+    return SegmentIndex.load(segment_dir, fingerprint) or segment_index
+
+
+def load_ngram_index(feature_store, ngram_file=MIDI_NGRAM_INDEX_FILE):
+    """
+    Load the n-gram index of the feature store, building (and saving) it first when
+    it is missing or was built for other files or another n-gram length.
+
+    Parameters:
+        feature_store (dict): The MIDI feature store.
+        ngram_file (str): The path to the n-gram index (.npz).
+
+    Returns:
+        NGramIndex: The n-gram index.
+    """
+    fingerprint = store_fingerprint(feature_store)
+    ngram_index = NGramIndex.load(ngram_file, fingerprint)
+    if ngram_index is not None and ngram_index.n == NGRAM_LENGTH:
+        return ngram_index
+
+    logging.info("Building the MIDI n-gram index...")
+    ngram_index = NGramIndex.build(feature_store["notes"], feature_store["note_offsets"])
+    try:
+        os.makedirs(os.path.dirname(ngram_file), exist_ok=True)
+        ngram_index.save(ngram_file, fingerprint)
+    except Exception as e:
+        logging.error(f"Error saving n-gram index {ngram_file}: {e}")
+    return ngram_index
+
+
+def build_feature_store(
+    midi_dataset_path=MIDI_DATASET_PATH,
+    store_file=MIDI_FEATURE_STORE_FILE,
+    segment_dir=MIDI_SEGMENT_DIR,
+    ngram_file=MIDI_NGRAM_INDEX_FILE,
+):
+    """
+    Build or refresh the feature store for every MIDI file in the dataset.
+
+    A file keeps its cached notes when its mtime and size are unchanged, or when
+    its content hash matches a stored entry (e.g. a renamed or re-copied file).
+    Only new or modified files are parsed; the features of every file are then
+    extracted in a single batch.
+
+    Parameters:
+        midi_dataset_path (str): The directory containing the database MIDI files.
+        store_file (str): The path to the feature store (.npz).
+        segment_dir (str): The directory of the segment index (built with the store
+            only when SEGMENT_SCORING is on, otherwise on first use).
+        ngram_file (str): The path to the n-gram index (.npz).
+
+    Returns:
+        dict: The up-to-date feature store.
+    """
+    previous = load_feature_store(store_file, midi_dataset_path)
+    previous_by_name = {}
+    previous_by_hash = {}
+    if previous is not None:
+        for i, (name, digest) in enumerate(
+            zip(previous["file_names"], previous["hashes"])
+        ):
+            previous_by_name[name] = i
+            previous_by_hash.setdefault(digest, i)
+
+    file_names = sorted(
+        f for f in os.listdir(midi_dataset_path) if f.endswith(".mid")
+    )
+
+    hashes, mtimes, sizes = [], [], []
+    note_rows = []
+    to_parse = []  # (position, file path) of the new or modified files
+    stale = 0
+    for name in file_names:
+        file_path = os.path.join(midi_dataset_path, name)
+        stat = os.stat(file_path)
+
+        cached = previous_by_name.get(name)
+        if cached is not None and (
+            previous["mtimes"][cached] != stat.st_mtime_ns
+            or previous["sizes"][cached] != stat.st_size
+        ):
+            cached = None
+        if cached is not None:
+            digest = previous["hashes"][cached]
+        else:
+            stale += 1
+            digest = file_content_hash(file_path)
+            cached = previous_by_hash.get(digest)
+
+        if cached is not None:
+            start, end = previous["note_offsets"][cached : cached + 2]
+            notes = previous["notes"][start:end]
+        else:
+            notes = None
+            to_parse.append((len(note_rows), file_path))
+
+        hashes.append(digest)
+        mtimes.append(stat.st_mtime_ns)
+        sizes.append(stat.st_size)
+        note_rows.append(notes)
+
+    # Parse the new files, on the parsing pool when there are many of them
+    parse_paths = [file_path for _, file_path in to_parse]
+    if len(parse_paths) >= PARALLEL_PARSE_MIN_FILES:
+        parsed_notes = get_parse_executor().map(
+            read_midi_notes_or_empty, parse_paths, chunksize=8
+        )
+    else:
+        parsed_notes = map(process_midi_file, parse_paths)
+    for (position, _), notes in zip(to_parse, parsed_notes):
+        note_rows[position] = notes
+    parsed = len(to_parse)
+
+    # Features of the whole catalogue in one vectorized pass
+    values, note_offsets = ragged_notes(note_rows)
+    atb, rtb, ftb = extract_features_batch(
+        normalize_notes_batch(values, note_offsets), note_offsets
+    )
+
+    store = {
+        "file_names": file_names,
+        "hashes": hashes,
+        "mtimes": np.array(mtimes, dtype=np.int64),
+        "sizes": np.array(sizes, dtype=np.int64),
+        "atb": atb,
+        "rtb": rtb,
+        "ftb": ftb,
+        "notes": values.astype(np.int64),
+        "note_offsets": note_offsets,
+    }
+
+    if previous is None or stale > 0 or previous["file_names"] != file_names:
+        save_feature_store(store, store_file)
+    logging.info(
+        f"Feature store ready: {len(file_names)} MIDI files ({parsed} parsed)."
+    )
+
+    store["files"] = [os.path.join(midi_dataset_path, name) for name in file_names]
+    store["similarity_matrices"] = build_similarity_matrices(
+        store["atb"], store["rtb"], store["ftb"]
+    )
+    store["ngram_index"] = load_ngram_index(store, ngram_file)
+    store["segment_dir"] = segment_dir
+    store["segment_index"] = (
+        load_segment_index(store, segment_dir) if SEGMENT_SCORING else None
+    )
+    return store
+
+
+def get_segment_index(feature_store):
+    """
+    Return the segment index of the feature store, loading (or building) it on first
+    use when the store was built without segment scoring.
+    """
+    segment_index = feature_store.get("segment_index")
+    if segment_index is not None:
+        return segment_index
+    with _segment_index_lock:
+        if feature_store.get("segment_index") is None:
+            feature_store["segment_index"] = load_segment_index(
+                feature_store, feature_store.get("segment_dir", MIDI_SEGMENT_DIR)
+            )
+        return feature_store["segment_index"]
+
+
+def get_feature_store():
+    """
+    Return the resident feature store, building it on first use (concurrent callers
+    wait for a single build).
+    """
+    global _feature_store
+    feature_store = _feature_store
+    if feature_store is not None:
+        return feature_store
+    with _feature_store_lock:
+        if _feature_store is None:
+            _feature_store = build_feature_store()
+        return _feature_store
+
+
+def refresh_feature_store():
+    """
+    Rebuild the feature store from the MIDI dataset and swap it in for new queries.
+    Queries keep using the previous store until the new one is ready.
+    """
+    global _feature_store
+    with _feature_store_lock:
+        _feature_store = build_feature_store()
+        return _feature_store
+
+
 # ====================================================================================
 # Step 3: Similarity Calculation
 # ====================================================================================
@@ -127,6 +499,57 @@ def cosine_similarity(vector1, vector2):
     return dot_product / (norm1 * norm2)
 
 
+def build_similarity_matrices(atb, rtb, ftb):
+    """
+    Pre-normalize the database feature matrices for matrix-based cosine scoring.
+
+    Parameters:
+        atb (numpy.ndarray): N x 128 ATB features.
+        rtb (numpy.ndarray): N x 255 RTB features.
+        ftb (numpy.ndarray): N x 255 FTB features.
+
+    Returns:
+        tuple: The row-normalized ATB, RTB and FTB matrices.
+    """
+    return normalize_rows(atb), normalize_rows(rtb), normalize_rows(ftb)
+
+
+def calculate_similarity_batch(query_features_batch, similarity_matrices):
+    """
+    Score many query clips against every database entry at once.
+
+    Parameters:
+        query_features_batch (tuple): Q x 128 ATB, Q x 255 RTB and Q x 255 FTB query features.
+        similarity_matrices (tuple): Pre-normalized database matrices (see build_similarity_matrices).
+
+    Returns:
+        numpy.ndarray: A Q x N matrix of weighted similarities.
+    """
+    similarities = 0.0
+    for query_matrix, db_matrix, weight in zip(
+        query_features_batch, similarity_matrices, SIMILARITY_WEIGHTS
+    ):
+        similarities = similarities + weight * (normalize_rows(query_matrix) @ db_matrix.T)
+    return similarities
+
+
+def calculate_similarity_matrix(query_features, similarity_matrices):
+    """
+    Score one query clip against every database entry with three matrix-vector products.
+
+    Parameters:
+        query_features (tuple): ATB, RTB, and FTB features of the query.
+        similarity_matrices (tuple): Pre-normalized database matrices (see build_similarity_matrices).
+
+    Returns:
+        numpy.ndarray: The weighted similarity of each database entry.
+    """
+    return calculate_similarity_batch(
+        tuple(np.atleast_2d(feature) for feature in query_features),
+        similarity_matrices,
+    )[0]
+
+
 def calculate_similarity(query_features, database_features):
     """
     Compare query features with database features using cosine similarity.
@@ -138,18 +561,11 @@ def calculate_similarity(query_features, database_features):
     Returns:
         list: A list of weighted similarity audios.
     """
-    similarities = []
-    # Weights for ATB, RTB, and FTB respectively
-    weights = [0.4, 0.4, 0.2]
-    for db_features in database_features:
-        weighted_similarity = sum(
-            cosine_similarity(query_feature, db_feature) * weight
-            for query_feature, db_feature, weight in zip(
-                query_features, db_features, weights
-            )
-        )
-        similarities.append(weighted_similarity)
-    return similarities
+    if not database_features:
+        return []
+    atb, rtb, ftb = (np.array(feature) for feature in zip(*database_features))
+    similarity_matrices = build_similarity_matrices(atb, rtb, ftb)
+    return calculate_similarity_matrix(query_features, similarity_matrices).tolist()
 
 
 # ====================================================================================
@@ -157,47 +573,194 @@ def calculate_similarity(query_features, database_features):
 # ====================================================================================
 
 
-def query_by_humming(query_audio_file, database_files, threshold=SIMILARITY_THRESHOLD):
+def query_notes_from_audio(query_audio_file, debug_midi_file=None):
     """
     Parameters:
         query_audio_file (str): The path to the query audio file.
-        database_files (list): A list of database MIDI file paths.
-        threshold (float): The similarity threshold for matches.
+        debug_midi_file (str): Optional path to also write the query transcription to.
 
     Returns:
-        list: A list of tuples containing matched file paths and their similarity audios.
+        numpy.ndarray: The query's MIDI note pitches.
     """
-    # Convert query audio file to MIDI
-    query_midi_file = query_audio_file.rsplit(".", 1)[0] + ".mid"
-    convert_audio_to_midi(query_audio_file, query_midi_file)
+    # Transcribe the query audio in memory
+    note_events, midi_data = transcribe_audio_file(query_audio_file)
+    if debug_midi_file:
+        midi_data.write(str(debug_midi_file))
 
-    # Process the query MIDI file
-    query_notes = process_midi_file(query_midi_file)
-    normalized_query_notes = normalize_notes(query_notes)
-    query_features = extract_features(normalized_query_notes)
+    # Turn the note events into the query pitch sequence
+    return notes_from_note_events(note_events)
 
-    # Process the database MIDI files
-    database_features = []
-    for db_file in database_files:
-        db_notes = process_midi_file(db_file)
-        normalized_db_notes = normalize_notes(db_notes)
-        db_features = extract_features(normalized_db_notes)
-        database_features.append(db_features)
 
-    # Calculate query w/ database entries similarity
-    similarities = calculate_similarity(query_features, database_features)
+def query_features_from_audio(query_audio_file, debug_midi_file=None):
+    """
+    Parameters:
+        query_audio_file (str): The path to the query audio file.
+        debug_midi_file (str): Optional path to also write the query transcription to.
+
+    Returns:
+        tuple: The query's ATB, RTB and FTB features.
+    """
+    query_notes = query_notes_from_audio(query_audio_file, debug_midi_file)
+    return query_features_from_notes(query_notes)
+
+
+def query_features_from_notes(query_notes):
+    """
+    Returns:
+        tuple: The ATB, RTB and FTB features of a query pitch sequence.
+    """
+    return extract_features(normalize_notes(query_notes))
+
+
+def candidate_rows(query_notes, feature_store, max_candidates=DEFAULT_MAX_CANDIDATES):
+    """
+    Rows of the feature store worth scoring for a query.
+
+    Large catalogues are pruned to the songs sharing the most melody contour n-grams
+    with the query; small catalogues (or queries without any shared n-gram) are
+    scored in full.
+
+    Returns:
+        numpy.ndarray: The sorted candidate rows, or None to score every row.
+    """
+    index = feature_store.get("ngram_index")
+    if index is None or len(feature_store["file_names"]) < NGRAM_MIN_SONGS:
+        return None
+    rows, _ = index.search(query_notes, max_candidates)
+    if len(rows) == 0:
+        return None
+    return np.sort(rows)
+
+
+def rerank_matches(query_notes, matches, feature_store, top_k=RERANK_TOP_K):
+    """
+    Second stage: re-rank the top histogram matches by the DTW distance between
+    the normalized query contour and the best matching window of each song.
+
+    Parameters:
+        query_notes (numpy.ndarray): The query pitch sequence.
+        matches (list): (row, histogram similarity) pairs, best first.
+        feature_store (dict): The MIDI feature store.
+        top_k (int): Number of matches to re-rank.
+
+    Returns:
+        tuple: (the re-ranked top_k as (row, similarity, DTW similarity) triples followed
+        by the remaining matches with a DTW similarity of None, DTW statistics)
+    """
+    top_k = min(top_k, MAX_RERANK_TOP_K, len(matches))
+    offsets = feature_store["note_offsets"]
+    candidate_notes = [
+        feature_store["notes"][offsets[row] : offsets[row + 1]]
+        for row, _ in matches[:top_k]
+    ]
+    dtw_similarities, n_windows, computed = rerank_candidates(
+        normalize_notes(query_notes), candidate_notes
+    )
+
+    reranked = [
+        (row, similarity, float(dtw_similarity))
+        for (row, similarity), dtw_similarity in zip(matches[:top_k], dtw_similarities)
+    ]
+    reranked.sort(key=lambda x: x[2], reverse=True)
+    reranked += [(row, similarity, None) for row, similarity in matches[top_k:]]
+    return reranked, {"windows": n_windows, "dtw_computations": computed}
+
+
+def query_by_humming(
+    query_audio_file,
+    database_files=None,
+    threshold=SIMILARITY_THRESHOLD,
+    feature_store=None,
+    debug_midi_file=None,
+    use_ngram_index=True,
+    use_segments=SEGMENT_SCORING,
+    rerank_top_k=RERANK_TOP_K,
+    timings=None,
+    query_notes=None,
+):
+    """
+    Parameters:
+        query_audio_file (str): The path to the query audio file.
+        database_files (list): Optional database MIDI file paths to restrict the search to.
+        threshold (float): The similarity threshold for matches.
+        feature_store (dict): Precomputed database features (defaults to the resident store).
+        debug_midi_file (str): Optional path to also write the query transcription to.
+        use_ngram_index (bool): Only re-rank the n-gram candidates of large catalogues.
+        use_segments (bool): Score each song by its best matching note window.
+        rerank_top_k (int): Number of top matches re-ranked with DTW (0 disables it).
+        timings (dict): Optional dict filled with the seconds spent in each stage.
+        query_notes (numpy.ndarray): The query pitch sequence, when it was already
+            transcribed (e.g. on the process pool); query_audio_file is then not read.
+
+    Returns:
+        list: A list of tuples containing matched file paths and their similarity audios.
+        With the DTW re-rank, each tuple also holds the DTW similarity (None past the
+        re-ranked top matches).
+    """
+    if feature_store is None:
+        feature_store = get_feature_store()
+    if timings is None:
+        timings = {}
+
+    if query_notes is None:
+        start = time.perf_counter()
+        query_notes = query_notes_from_audio(query_audio_file, debug_midi_file)
+        timings["transcription"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    query_features = query_features_from_notes(query_notes)
+
+    # Candidate rows: n-gram pruning and/or an explicit file restriction
+    rows = candidate_rows(query_notes, feature_store) if use_ngram_index else None
+    if database_files is not None:
+        wanted = {os.path.basename(f) for f in database_files}
+        rows = [
+            i
+            for i in (range(len(feature_store["file_names"])) if rows is None else rows)
+            if feature_store["file_names"][i] in wanted
+        ]
 
-    # Find matches > threshold
+    # Calculate query w/ database entries similarity
+    if use_segments:
+        # Best matching note window of every song
+        query_matrices = tuple(normalize_rows(feature)[0] for feature in query_features)
+        similarities = get_segment_index(feature_store).score(
+            query_matrices, SIMILARITY_WEIGHTS, rows
+        )
+    else:
+        # Use the precomputed (pre-normalized) whole-song features
+        similarity_matrices = feature_store["similarity_matrices"]
+        if rows is not None:
+            similarity_matrices = tuple(matrix[rows] for matrix in similarity_matrices)
+        similarities = calculate_similarity_matrix(query_features, similarity_matrices)
+
+    # Find matches > threshold, sorted by similarity in descending order
+    if rows is None:
+        rows = range(len(similarities))
     matches = [
-        (db_file, similarity)
-        for db_file, similarity in zip(database_files, similarities)
+        (row, similarity)
+        for row, similarity in zip(rows, similarities)
         if similarity >= threshold
     ]
-
-    # Sort matches by similarity in descending order
     matches.sort(key=lambda x: x[1], reverse=True)
-
-    return matches
+    timings["histogram"] = time.perf_counter() - start
+
+    files = feature_store["files"]
+    if rerank_top_k <= 0:
+        return [(files[row], similarity) for row, similarity in matches]
+
+    # Re-rank the top matches by melody contour (DTW)
+    start = time.perf_counter()
+    reranked, dtw_stats = rerank_matches(query_notes, matches, feature_store, rerank_top_k)
+    timings["rerank"] = time.perf_counter() - start
+    logging.info(
+        f"DTW re-rank: {dtw_stats['dtw_computations']} of {dtw_stats['windows']} "
+        f"windows computed in {timings['rerank'] * 1000:.1f} ms."
+    )
+    return [
+        (files[row], similarity, dtw_similarity)
+        for row, similarity, dtw_similarity in reranked
+    ]
 
 
 # ====================================================================================
@@ -205,115 +768,125 @@ def query_by_humming(query_audio_file, database_files, threshold=SIMILARITY_THRE
 # ====================================================================================
 
 
-def save_matches(matches, mapper, result_dir):
+def save_matches(matches, mapper, result_dir=None):
+    """
+    Build the result entries of the matches. The entries point at the canonical
+    database files (imageUrl and the song's audioUrl), so nothing is copied unless
+    an export directory is given.
+
+    Parameters:
+        matches (list): (MIDI file, similarity[, DTW similarity]) tuples, best first.
+        mapper (MapperCatalogue or list): The album catalogue (or the raw mapper albums).
+        result_dir (str): Optional export directory. The matched audio files and
+            album images are copied into it and the entries saved to
+            json/MIR_result.json, replacing the previous export.
+
+    Returns:
+        list: The result entries, best first (None if there are no matches).
+    """
     if not matches:
         logging.info("No matches to save.")
         return
 
-    # Prepare result directories
-    result_audio_dir = os.path.join(result_dir, "audio")
-    result_picture_dir = os.path.join(result_dir, "picture")
-    mir_result_path = os.path.join(
-        result_dir, "json/MIR_result.json"
-    )  # Define the JSON path
-    os.makedirs(result_audio_dir, exist_ok=True)
-    os.makedirs(result_picture_dir, exist_ok=True)
-
-    # Clear previous results
-    for folder in [result_audio_dir, result_picture_dir]:
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
+    export = result_dir is not None
+    if export:
+        # Prepare result directories
+        result_audio_dir = os.path.join(result_dir, "audio")
+        result_picture_dir = os.path.join(result_dir, "picture")
+        mir_result_path = os.path.join(
+            result_dir, "json/MIR_result.json"
+        )  # Define the JSON path
+        os.makedirs(result_audio_dir, exist_ok=True)
+        os.makedirs(result_picture_dir, exist_ok=True)
+
+        # Clear previous results
+        for folder in [result_audio_dir, result_picture_dir]:
+            for filename in os.listdir(folder):
+                file_path = os.path.join(folder, filename)
+                try:
+                    if os.path.isfile(file_path) or os.path.islink(file_path):
+                        os.unlink(file_path)
+                    elif os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                    logging.info(f"Deleted file: {file_path}")
+                except Exception as e:
+                    logging.error(f"Error deleting file {file_path}: {e}")
+
+        # Remove existing MIR_result.json if it exists
+        if os.path.exists(mir_result_path):
             try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-                logging.info(f"Deleted file: {file_path}")
+                os.remove(mir_result_path)
+                logging.info(f"Removed existing JSON file: {mir_result_path}")
             except Exception as e:
-                logging.error(f"Error deleting file {file_path}: {e}")
-
-    # Remove existing MIR_result.json if it exists
-    if os.path.exists(mir_result_path):
-        try:
-            os.remove(mir_result_path)
-            logging.info(f"Removed existing JSON file: {mir_result_path}")
-        except Exception as e:
-            logging.error(f"Error deleting JSON file {mir_result_path}: {e}")
+                logging.error(f"Error deleting JSON file {mir_result_path}: {e}")
 
     # Prepare list for MIR_result.json
+    catalogue = as_catalogue(mapper)
     mir_results = []
     similarity_rank = 1
 
-    for match, similarity in matches:
+    for match, similarity, *dtw_similarity in matches:
         # Find the corresponding album and song from the mapper
-        match_found = False
-        for album in mapper:
-            for song in album["songs"]:
-                song_basename = os.path.splitext(os.path.basename(song["file"]))[0]
-                match_basename = os.path.splitext(os.path.basename(match))[0]
-                if song_basename == match_basename:
-                    # Copy the audio file
-                    audio_file_path = os.path.join(AUDIO_DIR, song["file"])
-                    destination_audio_path = os.path.join(
-                        result_audio_dir,
-                        f"{similarity_rank}_{os.path.basename(song['file'])}",
-                    )
-                    if not os.path.exists(audio_file_path):
-                        logging.error(f"Audio file does not exist: {audio_file_path}")
-                        continue
-                    try:
-                        shutil.copy(audio_file_path, destination_audio_path)
-                        logging.info(
-                            f"Copied {audio_file_path} to {destination_audio_path}"
-                        )
-                    except Exception as e:
-                        logging.error(
-                            f"Error copying audio file {audio_file_path}: {e}"
-                        )
-                        continue  # Skip to next if copying fails
-
-                    # Copy the album image
-                    image_src = os.path.join(ROOT_DIR, album["imageSrc"])
-                    destination_image_path = os.path.join(
-                        result_picture_dir, f"{similarity_rank}.jpg"
-                    )
-
-                    try:
-                        shutil.copy(image_src, destination_image_path)
-                        logging.info(f"Copied {image_src} to {destination_image_path}")
-                    except Exception as e:
-                        logging.error(f"Error copying image {image_src}: {e}")
-                        continue  # Skip to next if copying fails
-
-                    # Prepare MIR_result.json entry
-                    mir_entry = {
-                        "similarity_rank": similarity_rank,
-                        "similarity_percentage": round(similarity, 4),
-                        "id": album["id"],
-                        "title": album["title"],
-                        "imageSrc": album["imageSrc"],
-                        "song": song,
-                    }
-                    mir_results.append(mir_entry)
-                    match_found = True
-                    break  # Assuming one song per MIDI file
-            if match_found:
-                break  # Move to next match
-
-        if not match_found:
+        album, song = catalogue.song_for_file(match)
+        if song is None:
             logging.warning(f"No matching album/song found for MIDI file {match}")
             continue
 
+        audio_file_path = os.path.join(AUDIO_DIR, song["file"])
+        if not os.path.exists(audio_file_path):
+            logging.error(f"Audio file does not exist: {audio_file_path}")
+            continue
+
+        if export:
+            # Copy the audio file
+            destination_audio_path = os.path.join(
+                result_audio_dir,
+                f"{similarity_rank}_{os.path.basename(song['file'])}",
+            )
+            try:
+                shutil.copy(audio_file_path, destination_audio_path)
+                logging.info(f"Copied {audio_file_path} to {destination_audio_path}")
+            except Exception as e:
+                logging.error(f"Error copying audio file {audio_file_path}: {e}")
+                continue  # Skip to next if copying fails
+
+            # Copy the album image
+            image_src = os.path.join(ROOT_DIR, album["imageSrc"])
+            destination_image_path = os.path.join(
+                result_picture_dir, f"{similarity_rank}.jpg"
+            )
+            try:
+                shutil.copy(image_src, destination_image_path)
+                logging.info(f"Copied {image_src} to {destination_image_path}")
+            except Exception as e:
+                logging.error(f"Error copying image {image_src}: {e}")
+                continue  # Skip to next if copying fails
+
+        # Prepare MIR_result.json entry
+        mir_entry = {
+            "similarity_rank": similarity_rank,
+            "similarity_percentage": round(similarity, 4),
+            "id": album["id"],
+            "title": album["title"],
+            "imageSrc": album["imageSrc"],
+            "imageUrl": image_url(album["imageSrc"]),
+            "song": dict(song, audioUrl=audio_url(song["file"])),
+        }
+        if dtw_similarity and dtw_similarity[0] is not None:
+            mir_entry["dtw_similarity"] = round(dtw_similarity[0], 4)
+        mir_results.append(mir_entry)
+
         similarity_rank += 1
 
     # Save MIR_result.json
-    try:
-        os.makedirs(os.path.dirname(mir_result_path), exist_ok=True)
-        with open(mir_result_path, "w") as f:
-            json.dump(mir_results, f, indent=4)
-        logging.info(f"Saved MIR_result.json to {mir_result_path}")
-    except Exception as e:
-        logging.error(f"Error saving MIR_result.json: {e}")
+    if export:
+        try:
+            os.makedirs(os.path.dirname(mir_result_path), exist_ok=True)
+            with open(mir_result_path, "w") as f:
+                json.dump(mir_results, f, indent=4)
+            logging.info(f"Saved MIR_result.json to {mir_result_path}")
+        except Exception as e:
+            logging.error(f"Error saving MIR_result.json: {e}")
 
     return mir_results  # Return the list of matched results
 
@@ -323,28 +896,27 @@ def save_matches(matches, mapper, result_dir):
 # ====================================================================================
 
 
-def convert_dataset_to_midi(dataset_path, midi_dataset_path):
+def convert_dataset_to_midi(dataset_path, midi_dataset_path, workers=None):
     """
     Parameters:
         dataset_path (str): The path to the directory containing the audio files.
         midi_dataset_path (str): The path to the directory where MIDI files will be stored.
+        workers (int): Number of conversion processes (defaults to the number of CPU cores).
+
+    Returns:
+        list: The (audio file, MIDI file) pairs that failed to convert.
     """
     os.makedirs(midi_dataset_path, exist_ok=True)
-    for audio_file in os.listdir(dataset_path):
+    jobs = []
+    for audio_file in sorted(os.listdir(dataset_path)):
         if audio_file.endswith((".wav", ".mp3", ".flac", ".ogg")):
             audio_file_path = os.path.join(dataset_path, audio_file)
             midi_file_name = audio_file.rsplit(".", 1)[0] + ".mid"
             midi_file_path = os.path.join(midi_dataset_path, midi_file_name)
-            if not os.path.exists(midi_file_path):
-                try:
-                    convert_audio_to_midi(audio_file_path, midi_file_path)
-                    print(f"Converted {audio_file_path} to {midi_file_path}")
-                except Exception as e:
-                    print(f"Error converting {audio_file_path} to MIDI: {e}")
-            else:
-                print(
-                    f"MIDI file {midi_file_path} already exists. Skipping conversion."
-                )
+            jobs.append((audio_file_path, midi_file_path))
+
+    # Already converted (valid) MIDI files are skipped, so this resumes after a crash
+    return convert_audio_files_to_midi(jobs, workers=workers)
 
 
 # ====================================================================================
@@ -371,26 +943,22 @@ def main():
     print("Converting dataset audio files to MIDI...")
     convert_dataset_to_midi(dataset_path, midi_dataset_path)
 
-    # Get the list of MIDI files for querying
-    database_files = [
-        os.path.join(midi_dataset_path, f)
-        for f in os.listdir(midi_dataset_path)
-        if f.endswith(".mid")
-    ]
+    # Build (or refresh) the precomputed features of the MIDI files
+    feature_store = build_feature_store(midi_dataset_path)
 
-    if not database_files:
+    if not feature_store["files"]:
         print(
             f"No MIDI files found in {midi_dataset_path}. Please convert the dataset first."
         )
         return
 
     # Debugging statement
-    print(f"Loaded {len(database_files)} MIDI files for querying.")
+    print(f"Loaded {len(feature_store['files'])} MIDI files for querying.")
 
     # Query by humming
     print("Processing query audio and retrieving similar MIDI files...\n")
     matches = query_by_humming(
-        query_audio_file, database_files, threshold=SIMILARITY_THRESHOLD
+        query_audio_file, threshold=SIMILARITY_THRESHOLD, feature_store=feature_store
     )
 
     # Save the matches to the result directories and MIR_result.json
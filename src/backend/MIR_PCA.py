@@ -1,8 +1,19 @@
 import os
+import tempfile
+import threading
 import numpy as np
 import shutil
-from music21 import converter
-from utils.convert_audio_to_midi import convert_audio_to_midi
+from backend.utils.convert_audio_to_midi import convert_audio_to_midi
+from backend.MIR import (
+    ROOT_DIR,
+    AUDIO_DIR,
+    build_feature_store,
+    get_feature_store,
+    query_features_from_audio,
+    query_features_from_notes,
+    store_fingerprint,
+)
+from backend.utils.catalogue import as_catalogue, image_url, audio_url
 import json
 
 # ====================================================================================
@@ -10,119 +21,14 @@ import json
 # ====================================================================================
 
 SIMILARITY_THRESHOLD = 0.75  # Minimum similarity score to consider a match
-MIR_RESULT_JSON = "src/backend/query_result/MIR_result.json"
+PROCESSED_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "database", "processed_data"
+)
+PCA_MODEL_FILE = os.path.join(PROCESSED_DATA_DIR, "mir_pca_model.npz")
+PCA_MODEL_VERSION = 2  # Bump when the features or the stored layout change
 
-MIDI_MIN = 0
-MIDI_MAX = 127
 N_COMPONENTS = 20  # Number of principal components for PCA
 
-# ====================================================================================
-# Step 1: Audio Processing
-# ====================================================================================
-
-
-def process_midi_file(midi_file_path):
-    """
-    Process a MIDI file: Extract note pitches.
-    Focus on the main melody track, usually on Channel 1.
-    """
-    try:
-        score = converter.parse(midi_file_path)
-        notes = []
-
-        # Focus on Channel 1 (melody track)
-        parts = score.getElementsByClass("Part")
-        melody_part = (
-            parts[0] if parts else score
-        )  # Default to first part if no parts found
-
-        for element in melody_part.flatten().notes:
-            if element.isNote:
-                notes.append(element.pitch.midi)
-            elif element.isChord:
-                notes.extend(p.midi for p in element.pitches)
-
-        return notes
-    except Exception as e:
-        print(f"Error processing MIDI file {midi_file_path}: {e}")
-        return []
-
-
-def normalize_notes(notes):
-    """
-    Normalize pitch values using mean and standard deviation.
-
-    Formula:
-    NP(note) = (note - μ) / σ
-    Where μ is the mean pitch and σ is the standard deviation of the pitch.
-    """
-    if not notes:
-        return []
-    mean_pitch = np.mean(notes)
-    std_pitch = np.std(notes)
-    if std_pitch == 0:
-        std_pitch = 1  # Prevent division by zero
-    normalized_notes = [(note - mean_pitch) / std_pitch for note in notes]
-    return normalized_notes
-
-
-# ====================================================================================
-# Step 2: Feature Extraction
-# ====================================================================================
-
-
-def extract_features(notes):
-    """
-    Extract features: ATB (Absolute Tone Based), RTB (Relative Tone Based), FTB (First Tone Based).
-    This function computes the tone distribution based on three viewpoints.
-
-    2.1. Absolute Tone Based (ATB):
-        - Counts the frequency of occurrence of each MIDI note (0-127).
-        - Creates a histogram with 128 bins.
-        - Normalizes the histogram to get a standardized distribution.
-
-    2.2. Relative Tone Based (RTB):
-        - Analyzes changes between sequential notes.
-        - Calculates differences between consecutive notes (intervals).
-        - Creates a histogram with 255 bins ranging from -127 to +127.
-        - Normalizes the histogram.
-
-    2.3. First Tone Based (FTB):
-        - Focuses on the difference between each note and the first note.
-        - Calculates differences between each note and the first note.
-        - Creates a histogram with 255 bins ranging from -127 to +127.
-        - Normalizes the histogram.
-
-    All histograms are normalized to ensure all values are on a probability scale.
-    """
-    if not notes:
-        # Return zero arrays if notes are empty
-        return np.zeros(128), np.zeros(255), np.zeros(255)
-
-    # Absolute Tone Based (ATB)
-    atb_histogram, _ = np.histogram(
-        notes, bins=range(MIDI_MIN, MIDI_MAX + 2)
-    )  # 128 bins
-    atb = atb_histogram / np.sum(atb_histogram)  # Normalize histogram
-
-    # Relative Tone Based (RTB)
-    intervals = np.diff(notes)  # Differences between consecutive notes
-    rtb_histogram, _ = np.histogram(
-        intervals, bins=range(-MIDI_MAX, MIDI_MAX + 2)
-    )  # 255 bins
-    rtb = rtb_histogram / np.sum(rtb_histogram)  # Normalize histogram
-
-    # First Tone Based (FTB)
-    first_note = notes[0]
-    ftb_intervals = [note - first_note for note in notes]
-    ftb_histogram, _ = np.histogram(
-        ftb_intervals, bins=range(-MIDI_MAX, MIDI_MAX + 2)
-    )  # 255 bins
-    ftb = ftb_histogram / np.sum(ftb_histogram)  # Normalize histogram
-
-    return atb, rtb, ftb  # Total features: 128 + 255 + 255 = 638
-
-
 # ====================================================================================
 # Additional: Feature Processing (Dimensionality Reduction using PCA)
 # ====================================================================================
@@ -161,30 +67,16 @@ def apply_pca(features, pca_model):
 # ====================================================================================
 
 
-def cosine_similarity_metric(vector1, vector2):
-    """
-    Calculate cosine similarity between two vectors.
-
-    Formula:
-    cos(θ) = (A ⋅ B) / (||A|| * ||B||)
-    Where A and B are the vectors.
-    """
-    dot_product = np.dot(vector1, vector2)
-    norm1 = np.linalg.norm(vector1)
-    norm2 = np.linalg.norm(vector2)
-    if norm1 == 0 or norm2 == 0:
-        return 0
-    return dot_product / (norm1 * norm2)
-
-
-def calculate_similarity(query_features, database_features):
+def calculate_similarity_matrix(query_features, database_features):
     """
-    Compare query features with database features using cosine similarity.
+    Cosine similarity between the query and every database row in one step
+    (rows with a zero norm score 0).
     """
-    similarities = []
-    for db_feature in database_features:
-        similarity = cosine_similarity_metric(query_features, db_feature)
-        similarities.append(similarity)
+    database_features = np.asarray(database_features)
+    norms = np.linalg.norm(database_features, axis=1) * np.linalg.norm(query_features)
+    dot_products = database_features @ query_features
+    with np.errstate(invalid="ignore", divide="ignore"):
+        similarities = np.where(norms > 0, dot_products / norms, 0.0)
     return similarities
 
 
@@ -195,74 +87,67 @@ def calculate_similarity(query_features, database_features):
 
 def query_by_humming(
     query_audio_file,
-    database_files,
-    mapper,
-    pca_model,
+    database_files=None,
     threshold=SIMILARITY_THRESHOLD,
-    result_dir="test/result",
+    pca_model=None,
+    query_notes=None,
 ):
     """
     Perform the query by humming process:
-    - Convert the query audio file to MIDI.
-    - Process the query MIDI file to extract notes (Step 1).
-    - Normalize the notes (Step 1).
-    - Extract features from the query (Step 2).
+    - Transcribe the query audio and extract its ATB/RTB/FTB features (Steps 1-2).
     - Apply PCA to the query features (Feature Processing).
-    - Process the database MIDI files similarly.
-    - Calculate similarities between the query and database features (Step 3).
-    - Save the matches that exceed the similarity threshold.
+    - Score it against the projected database stored with the PCA model (Step 3).
+    - Return the matches that exceed the similarity threshold.
+
+    Parameters:
+        query_audio_file (str): The path to the query audio file.
+        database_files (list): Optional database MIDI file paths to restrict the search to.
+        threshold (float): The similarity threshold for matches.
+        pca_model (dict): The fitted PCA model (defaults to the resident model).
+        query_notes (numpy.ndarray): The query pitch sequence, when it was already
+            transcribed; query_audio_file is then not read.
+
+    Returns:
+        list: A list of tuples containing matched file paths and their similarities.
     """
-    # Convert query audio file to MIDI
-    try:
-        query_midi_file = query_audio_file.rsplit(".", 1)[0] + ".mid"
-        convert_audio_to_midi(query_audio_file, query_midi_file)
-    except Exception as e:
-        print(f"Error converting {query_audio_file} to MIDI: {e}")
+    if pca_model is None:
+        pca_model = get_pca_model()
+    if pca_model is None:
+        print("PCA model is not available.")
         return []
 
-    # Process the query MIDI file (Step 1)
-    query_notes = process_midi_file(query_midi_file)
-    normalized_query_notes = normalize_notes(query_notes)
-
-    # Extract features from the query (Step 2)
-    query_atb, query_rtb, query_ftb = extract_features(normalized_query_notes)
+    # Extract features from the query (Steps 1-2)
+    if query_notes is not None:
+        query_atb, query_rtb, query_ftb = query_features_from_notes(query_notes)
+    else:
+        try:
+            query_atb, query_rtb, query_ftb = query_features_from_audio(query_audio_file)
+        except Exception as e:
+            print(f"Error transcribing {query_audio_file}: {e}")
+            return []
     query_combined_features = np.concatenate(
         [query_atb, query_rtb, query_ftb]
-    )  # Total 638 features
-
-    if query_combined_features.size == 0:
-        print("No features extracted from the query MIDI file.")
-        return []
-
-    # Ensure query_combined_features is 2D
-    query_combined_features = query_combined_features.reshape(1, -1)
+    ).reshape(1, -1)  # Total 638 features
 
     # Apply PCA to the query features (Feature Processing)
     query_features_pca = apply_pca(query_combined_features, pca_model)
 
-    # Process the database MIDI files
-    database_features_pca = []
-    for db_file in database_files:
-        # Process database MIDI file (Step 1)
-        db_notes = process_midi_file(db_file)
-        db_normalized_notes = normalize_notes(db_notes)
-
-        # Extract features from the database MIDI file (Step 2)
-        db_atb, db_rtb, db_ftb = extract_features(db_normalized_notes)
-        db_combined_features = np.concatenate(
-            [db_atb, db_rtb, db_ftb]
-        )  # Total 638 features
-
-        if db_combined_features.size != 0:
-            db_combined_features = db_combined_features.reshape(1, -1)
-            # Apply PCA to the database features (Feature Processing)
-            db_features_pca = apply_pca(db_combined_features, pca_model)
-            database_features_pca.append(db_features_pca[0])
-        else:
-            database_features_pca.append(np.zeros(N_COMPONENTS))
+    # Use the projected database stored with the PCA model
+    database_features_pca = pca_model["projection"]
+    if database_files is None:
+        database_files = pca_model["files"]
+    else:
+        rows_by_name = {name: i for i, name in enumerate(pca_model["file_names"])}
+        rows = [rows_by_name.get(os.path.basename(f)) for f in database_files]
+        database_files = [f for f, row in zip(database_files, rows) if row is not None]
+        database_features_pca = database_features_pca[
+            [row for row in rows if row is not None]
+        ]
 
     # Calculate similarities (Step 3)
-    similarities = calculate_similarity(query_features_pca[0], database_features_pca)
+    similarities = calculate_similarity_matrix(
+        query_features_pca[0], database_features_pca
+    )
 
     # Combine database files with their similarities
     matches = [
@@ -271,11 +156,7 @@ def query_by_humming(
         if similarity >= threshold
     ]
     matches.sort(key=lambda x: x[1], reverse=True)
-
-    # Save matches to result directories and JSON
-    mir_results = save_matches(matches, mapper, result_dir)
-
-    return mir_results
+    return matches
 
 
 # ====================================================================================
@@ -283,101 +164,112 @@ def query_by_humming(
 # ====================================================================================
 
 
-def save_matches(matches, mapper, result_dir):
+def save_matches(matches, mapper, result_dir=None):
     """
-    Save the matched audio files and album images to the result directory,
-    and save the matched information with similarity scores to MIR_result.json.
+    Build the result entries of the matches. The entries point at the canonical
+    database files (imageUrl and the song's audioUrl), so nothing is copied unless
+    an export directory is given.
+
+    Parameters:
+        matches (list): (MIDI file, similarity) tuples, best first.
+        mapper (MapperCatalogue or list): The album catalogue (or the raw mapper albums).
+        result_dir (str): Optional export directory. The matched audio files and
+            album images are copied into it and the entries saved to
+            json/MIR_result.json, replacing the previous export.
+
+    Returns:
+        list: The result entries, best first.
     """
     if not matches:
         print("No matches to save.")
         return []
 
-    # Prepare result directories
-    result_audio_dir = os.path.join(result_dir, "audio")
-    result_picture_dir = os.path.join(result_dir, "picture")
-    os.makedirs(result_audio_dir, exist_ok=True)
-    os.makedirs(result_picture_dir, exist_ok=True)
-
-    # Remove existing contents to ensure purity
-    for folder in [result_audio_dir, result_picture_dir]:
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f"Error deleting file {file_path}: {e}")
+    export = result_dir is not None
+    if export:
+        # Prepare result directories
+        result_audio_dir = os.path.join(result_dir, "audio")
+        result_picture_dir = os.path.join(result_dir, "picture")
+        mir_result_path = os.path.join(result_dir, "json", "MIR_result.json")
+        os.makedirs(result_audio_dir, exist_ok=True)
+        os.makedirs(result_picture_dir, exist_ok=True)
+
+        # Remove existing contents to ensure purity
+        for folder in [result_audio_dir, result_picture_dir]:
+            for filename in os.listdir(folder):
+                file_path = os.path.join(folder, filename)
+                try:
+                    if os.path.isfile(file_path) or os.path.islink(file_path):
+                        os.unlink(file_path)
+                    elif os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                except Exception as e:
+                    print(f"Error deleting file {file_path}: {e}")
 
     # Prepare list for MIR_result.json
+    catalogue = as_catalogue(mapper)
     mir_results = []
     similarity_rank = 1
 
     for match, similarity in matches:
         # Find the corresponding album and song from the mapper
-        match_found = False
-        for album in mapper:
-            for song in album["songs"]:
-                song_basename = os.path.basename(song["file"]).rsplit(".", 1)[0]
-                match_basename = os.path.basename(match).rsplit(".", 1)[0]
-                if song_basename == match_basename:
-                    # Copy the audio file
-                    audio_file_path = os.path.join(
-                        "src/backend/database/audio", song["file"]
-                    )
-                    destination_audio_path = os.path.join(
-                        result_audio_dir,
-                        f"{similarity_rank}_{os.path.basename(song['file'])}",
-                    )
-                    try:
-                        shutil.copy(audio_file_path, destination_audio_path)
-                        print(f"Copied {audio_file_path} to {destination_audio_path}")
-                    except Exception as e:
-                        print(f"Error copying audio file {audio_file_path}: {e}")
-                        continue  # Skip to next if copying fails
-
-                    # Copy the album image
-                    image_src = album["imageSrc"]
-                    destination_image_path = os.path.join(
-                        result_picture_dir, f"{similarity_rank}.jpg"
-                    )
-                    try:
-                        shutil.copy(image_src, destination_image_path)
-                        print(f"Copied {image_src} to {destination_image_path}")
-                    except Exception as e:
-                        print(f"Error copying image {image_src}: {e}")
-                        continue  # Skip to next if copying fails
-
-                    # Prepare MIR_result.json entry
-                    mir_entry = {
-                        "similarity_rank": similarity_rank,
-                        "similarity_score": round(similarity, 4),
-                        "id": album["id"],
-                        "title": album["title"],
-                        "imageSrc": image_src,
-                        "song": song,
-                    }
-                    mir_results.append(mir_entry)
-                    match_found = True
-                    break  # Exit the inner loop if match is found
-            if match_found:
-                break  # Exit the outer loop if match is found
-
-        if not match_found:
+        album, song = catalogue.song_for_file(match)
+        if song is None:
             print(f"No matching album/song found for MIDI file {match}")
             continue
 
+        audio_file_path = os.path.join(AUDIO_DIR, song["file"])
+        if not os.path.exists(audio_file_path):
+            print(f"Audio file does not exist: {audio_file_path}")
+            continue
+
+        if export:
+            # Copy the audio file
+            destination_audio_path = os.path.join(
+                result_audio_dir,
+                f"{similarity_rank}_{os.path.basename(song['file'])}",
+            )
+            try:
+                shutil.copy(audio_file_path, destination_audio_path)
+                print(f"Copied {audio_file_path} to {destination_audio_path}")
+            except Exception as e:
+                print(f"Error copying audio file {audio_file_path}: {e}")
+                continue  # Skip to next if copying fails
+
+            # Copy the album image
+            image_src = os.path.join(ROOT_DIR, album["imageSrc"])
+            destination_image_path = os.path.join(
+                result_picture_dir, f"{similarity_rank}.jpg"
+            )
+            try:
+                shutil.copy(image_src, destination_image_path)
+                print(f"Copied {image_src} to {destination_image_path}")
+            except Exception as e:
+                print(f"Error copying image {image_src}: {e}")
+                continue  # Skip to next if copying fails
+
+        # Prepare MIR_result.json entry
+        mir_entry = {
+            "similarity_rank": similarity_rank,
+            "similarity_score": round(similarity, 4),
+            "id": album["id"],
+            "title": album["title"],
+            "imageSrc": album["imageSrc"],
+            "imageUrl": image_url(album["imageSrc"]),
+            "song": dict(song, audioUrl=audio_url(song["file"])),
+        }
+        mir_results.append(mir_entry)
+
         similarity_rank += 1
 
     # Save MIR_result.json
-    try:
-        os.makedirs(os.path.dirname(MIR_RESULT_JSON), exist_ok=True)
-        with open(MIR_RESULT_JSON, "w") as f:
-            json.dump(mir_results, f, indent=4)
-        print(f"Saved MIR_result.json to {MIR_RESULT_JSON}")
-    except Exception as e:
-        print(f"Error saving MIR_result.json: {e}")
+    if export:
+        try:
+            os.makedirs(os.path.dirname(mir_result_path), exist_ok=True)
+            with open(mir_result_path, "w") as f:
+                json.dump(mir_results, f, indent=4)
+            print(f"Saved MIR_result.json to {mir_result_path}")
+        except Exception as e:
+            print(f"Error saving MIR_result.json: {e}")
 
     return mir_results  # Return the list of matched results
 
@@ -414,32 +306,132 @@ def convert_dataset_to_midi(dataset_path, midi_dataset_path):
 # Step 7: Load and Fit PCA Model
 # ====================================================================================
 
+_resident_pca = (None, None)  # (feature store, PCA model loaded for it), swapped as a pair
+_pca_model_lock = threading.Lock()  # Serializes loads and refits of the resident model
 
-def load_pca_model(midi_dataset_path):
+
+def fit_database_pca(feature_store):
+    """
+    Fit the PCA on the feature store's ATB/RTB/FTB matrices and project the database.
+
+    Returns:
+        dict: The PCA model with the projected database ("projection").
+    """
+    all_features = np.hstack(
+        [feature_store["atb"], feature_store["rtb"], feature_store["ftb"]]
+    )  # Total 638 features per file
+    # Files whose histograms are undefined (no notes in range) contribute zeros
+    all_features = np.nan_to_num(all_features, nan=0.0, posinf=0.0, neginf=0.0)
+
+    pca_model = fit_pca_model(all_features)
+    pca_model["projection"] = apply_pca(all_features, pca_model)
+    return pca_model
+
+
+def save_pca_model(pca_model, model_file=PCA_MODEL_FILE):
     """
-    Load and fit PCA model based on the database MIDI files.
-    Returns the fitted PCA model.
+    Write the PCA model atomically (a temporary file replaced in one step).
     """
-    all_features = []
-    for midi_file in os.listdir(midi_dataset_path):
-        if midi_file.endswith(".mid"):
-            midi_file_path = os.path.join(midi_dataset_path, midi_file)
-            notes = process_midi_file(midi_file_path)
-            normalized_notes = normalize_notes(notes)
-            atb, rtb, ftb = extract_features(normalized_notes)
-            combined_features = np.concatenate([atb, rtb, ftb])  # Total 638 features
-            if combined_features.size != 0:
-                all_features.append(combined_features)
-
-    if not all_features:
+    os.makedirs(os.path.dirname(model_file), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(model_file), suffix=".npz.tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                version=PCA_MODEL_VERSION,
+                fingerprint=pca_model["fingerprint"],
+                file_names=np.array(pca_model["file_names"]),
+                mean=pca_model["mean"],
+                eigenvectors=pca_model["eigenvectors"],
+                projection=pca_model["projection"],
+            )
+        os.replace(temp_path, model_file)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_pca_model(model_file=PCA_MODEL_FILE):
+    """
+    Returns:
+        dict: The stored PCA model, or None if it is missing, unreadable or was written
+        by another version.
+    """
+    if not os.path.exists(model_file):
+        return None
+    try:
+        with np.load(model_file) as data:
+            if int(data["version"]) != PCA_MODEL_VERSION:
+                return None
+            return {
+                "fingerprint": str(data["fingerprint"]),
+                "file_names": data["file_names"].tolist(),
+                "mean": data["mean"],
+                "eigenvectors": data["eigenvectors"],
+                "projection": data["projection"],
+            }
+    except Exception as e:
+        print(f"Error loading PCA model {model_file}: {e}")
+        return None
+
+
+def load_pca_model(feature_store, model_file=PCA_MODEL_FILE):
+    """
+    Load the persisted PCA model, refitting it only when the files of the feature
+    store changed (or the stored model is missing or outdated).
+
+    Parameters:
+        feature_store (dict): The MIDI feature store (see MIR.get_feature_store).
+        model_file (str): The path to the persisted PCA model (.npz).
+
+    Returns:
+        dict: The fitted PCA model, or None if the store is empty.
+    """
+    if not feature_store["file_names"]:
         print("No features extracted from MIDI files. PCA cannot be applied.")
         return None
 
-    all_features = np.array(all_features)
-    pca_model = fit_pca_model(all_features)
+    fingerprint = store_fingerprint(feature_store)
+    pca_model = read_pca_model(model_file)
+    if (
+        pca_model is None
+        or pca_model["fingerprint"] != fingerprint
+        or pca_model["eigenvectors"].shape[1] != N_COMPONENTS
+    ):
+        print(f"Fitting PCA model on {len(feature_store['file_names'])} MIDI files...")
+        pca_model = fit_database_pca(feature_store)
+        pca_model["fingerprint"] = fingerprint
+        pca_model["file_names"] = list(feature_store["file_names"])
+        try:
+            save_pca_model(pca_model, model_file)
+        except Exception as e:
+            print(f"Error saving PCA model {model_file}: {e}")
+
+    pca_model["files"] = list(feature_store["files"])
     return pca_model
 
 
+def get_pca_model():
+    """
+    Resident PCA model over the resident feature store; refit or reloaded whenever
+    the feature store is refreshed (concurrent callers wait for a single load).
+    """
+    global _resident_pca
+    feature_store = get_feature_store()
+    model_store, pca_model = _resident_pca
+    if model_store is feature_store:
+        return pca_model
+    with _pca_model_lock:
+        model_store, pca_model = _resident_pca
+        if model_store is not feature_store:
+            pca_model = load_pca_model(feature_store)
+            _resident_pca = (feature_store, pca_model)
+        return pca_model
+
+
 # ====================================================================================
 # Entry Point: Main Function
 # ====================================================================================
@@ -471,38 +463,26 @@ def main():
         )
         return
 
-    # List of MIDI files for querying
-    database_files = [
-        os.path.join(midi_dataset_path, f)
-        for f in os.listdir(midi_dataset_path)
-        if f.endswith(".mid")
-    ]
-
-    if not database_files:
+    # Load the feature store and the PCA model fitted on it
+    feature_store = build_feature_store(midi_dataset_path)
+    if not feature_store["file_names"]:
         print(
             f"No MIDI files found in {midi_dataset_path}. Please convert the dataset first."
         )
         return
+    print(f"Loaded {len(feature_store['file_names'])} MIDI files for querying.")
 
-    # Debug print to check loaded MIDI files
-    print(f"Loaded {len(database_files)} MIDI files for querying.")
-
-    # Load and fit PCA model
-    pca_model = load_pca_model(midi_dataset_path)
+    pca_model = load_pca_model(feature_store)
     if pca_model is None:
         print("PCA model could not be loaded. Exiting.")
         return
 
     # Perform query by humming
     print("Processing query audio and retrieving similar MIDI files...\n")
-    mir_results = query_by_humming(
-        query_audio_file,
-        database_files,
-        mapper,
-        pca_model,
-        threshold=SIMILARITY_THRESHOLD,
-        result_dir=result_dir,
+    matches = query_by_humming(
+        query_audio_file, threshold=SIMILARITY_THRESHOLD, pca_model=pca_model
     )
+    mir_results = save_matches(matches, mapper, result_dir)
 
     # Print the matches
     if mir_results:
@@ -1,17 +1,35 @@
 import os
-import glob
 import json
 import shutil
 import uuid
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+import time
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from typing import List
 from backend.utils.database_parser import parse_uploaded_database, process_database
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from pathlib import Path
-from backend.APF2 import process_query
+from backend.APF2 import process_query, load_image_index
 from backend.MIR import *
+from backend import MIR_PCA
+from backend.utils.executors import (
+    run_in_thread,
+    run_in_process,
+    start_process_workers,
+    shutdown_executors,
+    ConcurrencyLimiter,
+    QueueFullError,
+)
+from backend.utils.catalogue import (
+    get_catalogue,
+    audio_url,
+    IMAGE_URL_PREFIX,
+    AUDIO_URL_PREFIX,
+)
 
 # ====================================================================================
 # Setup Logging
@@ -30,9 +48,10 @@ BASE_DIR = Path(__file__).resolve().parent
 # ====================================================================================
 # Define Directories
 # ====================================================================================
-MAPPER_FILE = BASE_DIR / "database" / "mapper" / "mapper.json"
 PICTURE_DIR = BASE_DIR / "database" / "picture"
 AUDIO_DIR = BASE_DIR / "database" / "audio"
+RESULT_DIR = BASE_DIR / "query_result"  # Opt-in exports (?export=true), one directory per query
+QUERY_WORKSPACE_PREFIX = "hatsune_query_"  # Per-request scratch directories (system temp dir)
 
 # Ensure directories exist
 PICTURE_DIR.mkdir(parents=True, exist_ok=True)
@@ -44,7 +63,10 @@ AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 
 app = FastAPI()
 
-app.mount("/static", StaticFiles(directory=PICTURE_DIR), name="static")
+# Result entries link to the canonical database files through these mounts (which
+# answer HTTP range requests, so audio can be streamed and seeked)
+app.mount(IMAGE_URL_PREFIX, StaticFiles(directory=PICTURE_DIR), name="static")
+app.mount(AUDIO_URL_PREFIX, StaticFiles(directory=AUDIO_DIR), name="audio")
 
 # ====================================================================================
 # CORS Configuration (Adjust Origins as Needed)
@@ -64,6 +86,102 @@ app.add_middleware(
 
 TASK_STATUS = {}
 
+# ====================================================================================
+# Search Concurrency Limits
+# ====================================================================================
+
+# Searches run on the shared executors; these bound how many run (and wait) per endpoint
+SEARCH_IMAGE_LIMITER = ConcurrencyLimiter("image search", limit=4, max_waiting=16)
+SEARCH_AUDIO_LIMITER = ConcurrencyLimiter("audio search", limit=2, max_waiting=8)
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+async def load_catalogue(missing_status=404):
+    """
+    Return the resident mapper catalogue, mapping load failures to HTTP errors.
+    """
+    try:
+        return await run_in_thread(get_catalogue)
+    except FileNotFoundError:
+        raise HTTPException(status_code=missing_status, detail="Mapper file not found.")
+    except json.JSONDecodeError as e:
+        raise HTTPException(
+            status_code=500, detail=f"Invalid JSON format in mapper file: {e}"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load mapper JSON: {e}")
+
+
+@asynccontextmanager
+async def query_workspace():
+    """
+    A unique scratch directory for one search request, removed when the request
+    ends (also on errors), so concurrent searches never share or overwrite files.
+    """
+    workspace = await run_in_thread(tempfile.mkdtemp, prefix=QUERY_WORKSPACE_PREFIX)
+    try:
+        yield Path(workspace)
+    finally:
+        await run_in_thread(shutil.rmtree, workspace, ignore_errors=True)
+
+
+def query_file_name(upload_name):
+    """
+    Name of an upload inside its workspace: only the client's extension is kept, so
+    the client-supplied name never reaches the file system.
+    """
+    return "query" + Path(upload_name).suffix.lower()
+
+
+def save_upload(upload, destination):
+    """
+    Copy an uploaded file to disk (blocking; run it on the thread pool).
+    """
+    with open(destination, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
+# ====================================================================================
+# Startup: Load Search Indexes
+# ====================================================================================
+
+
+@app.on_event("startup")
+async def load_search_indexes():
+    """
+    Load the image index, the mapper catalogue, the precomputed MIDI features (and
+    the PCA model fitted on them) once and start the transcription workers, so
+    queries never re-read the database or wait for a model load.
+    """
+    try:
+        await run_in_thread(load_image_index)
+    except Exception as e:
+        logger.error("Failed to load the image index: %s", str(e))
+    try:
+        await run_in_thread(get_feature_store)
+    except Exception as e:
+        logger.error("Failed to load the MIDI feature store: %s", str(e))
+    try:
+        await run_in_thread(MIR_PCA.get_pca_model)
+    except Exception as e:
+        logger.error("Failed to load the MIR PCA model: %s", str(e))
+    try:
+        await run_in_thread(get_catalogue)
+    except Exception as e:
+        logger.error("Failed to load the mapper catalogue: %s", str(e))
+    try:
+        start_process_workers()
+    except Exception as e:
+        logger.error("Failed to start the transcription workers: %s", str(e))
+
+
+@app.on_event("shutdown")
+async def stop_executors():
+    shutdown_executors()
+
 # ====================================================================================
 # Endpoint to Upload Dataset (Multiple Zip Files)
 # ====================================================================================
@@ -107,6 +225,8 @@ async def upload_dataset(
                 mapper_file=str(BASE_DIR / "database" / "mapper" / "mapper.json"),
                 process_db=True,
             )
+            await run_in_thread(refresh_feature_store)
+            await run_in_thread(MIR_PCA.get_pca_model)
             TASK_STATUS[task_id] = "Completed"
             logger.info(f"Task {task_id} completed successfully.")
         except Exception as e:
@@ -146,20 +266,15 @@ async def check_datasets():
         "mapper": False
     }
 
-    # Check if mapper.json exists
-    if not MAPPER_FILE.exists():
-        return datasets_present
-
+    # Check if a mapper file exists and is valid JSON
     try:
-        with open(MAPPER_FILE, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError:
-        return datasets_present
+        catalogue = await run_in_thread(get_catalogue)
     except Exception:
         return datasets_present
 
     # Check if mapper has entries
-    if not isinstance(mapper, list) or len(mapper) == 0:
+    mapper = catalogue.albums
+    if len(mapper) == 0:
         return datasets_present
 
     # Verify images
@@ -179,9 +294,6 @@ async def check_datasets():
         if not image_path.exists():
             all_images_exist = False
             print(f"Image file missing: {image_path}")
-            print(f"Image file missing: {image_path}")
-            print("Missing imageSrc in album:", album)
-            print("Missing audio file in song:", song)
             break
     datasets_present["images"] = all_images_exist
 
@@ -205,17 +317,8 @@ async def check_datasets():
 
 @app.get("/api/uploaded-images")
 async def get_uploaded_images():
-    if not MAPPER_FILE.exists():
-        raise HTTPException(status_code=404, detail="Mapper file not found.")
-    
-    try:
-        with open(MAPPER_FILE, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON format in mapper file.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
+    mapper = (await load_catalogue()).albums
+
     images = []
     for album in mapper:
         image_src = album.get("imageSrc")
@@ -233,17 +336,8 @@ async def get_uploaded_images():
 
 @app.get("/api/uploaded-audios")
 async def get_uploaded_audios():
-    if not MAPPER_FILE.exists():
-        raise HTTPException(status_code=404, detail="Mapper file not found.")
-    
-    try:
-        with open(MAPPER_FILE, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON format in mapper file.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
+    mapper = (await load_catalogue()).albums
+
     audios = []
     for album in mapper:
         album_id = album.get("id")
@@ -252,12 +346,10 @@ async def get_uploaded_audios():
         for song in songs:
             audio_file = song.get("file")
             if audio_file:
-                audio_filename = Path(audio_file).name
-                audio_url = f"http://localhost:8000/static/{audio_filename}"
                 audios.append({
                     "id": song.get("id"),
                     "title": song.get("title", f"Song {song.get('id')}"),
-                    "file": audio_url,
+                    "file": f"http://localhost:8000{audio_url(audio_file)}",
                     "albumId": album_id,
                     "albumTitle": album_title
                 })
@@ -266,144 +358,154 @@ async def get_uploaded_audios():
 
 @app.get("/api/uploaded-mapper")
 async def get_uploaded_mapper():
-    if not MAPPER_FILE.exists():
-        raise HTTPException(status_code=404, detail="Mapper file not found.")
-    
-    try:
-        with open(MAPPER_FILE, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON format in mapper file.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
+    mapper = (await load_catalogue()).albums
+
     return {"uploaded_mapper": mapper}
 
 # Endpoint to search by image
 @app.post("/search-image/")
-async def search_image(query_image: UploadFile = File(...)):
+async def search_image(query_image: UploadFile = File(...), export: bool = False):
     if not query_image.filename.lower().endswith((".png", ".jpg", ".jpeg")):
         raise HTTPException(status_code=400, detail="Invalid image format.")
 
-    # Define query directory and save the uploaded image
-    image_query_dir = "backend/query/"
-    os.makedirs(image_query_dir, exist_ok=True)
+    # The resident mapper catalogue (re-read only when the mapper file changes)
+    catalogue = await load_catalogue(missing_status=500)
 
-    image_path = os.path.join(image_query_dir, query_image.filename)
-    try:
-        with open(image_path, "wb") as buffer:
-            shutil.copyfileobj(query_image.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save image: {e}")
-
-    # Locate the mapper JSON file
-    mapper_dir = BASE_DIR / "database" / "mapper"
-    mapper_files = glob.glob(str(mapper_dir / "*.json"))
-    if not mapper_files:
-        raise HTTPException(status_code=500, detail="Mapper JSON file not found.")
-
-    mapper_file = mapper_files[0]  # Use the first found JSON file
+    # Copy the matched files to this query's own result directory only when asked to
+    query_id = uuid.uuid4().hex
+    result_dir = RESULT_DIR / query_id if export else None
 
-    # Load the mapper JSON data
+    # Read the uploaded image into memory; it is decoded straight from these bytes
     try:
-        with open(mapper_file, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError as e:
-        raise HTTPException(
-            status_code=500, detail=f"Invalid JSON format in mapper file: {e}"
-        )
+        image_bytes = await query_image.read()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load mapper JSON: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to read image: {e}")
+
+    # Perform image search on the thread pool (NumPy releases the GIL)
+    async with SEARCH_IMAGE_LIMITER:
+        apf_results = await run_in_thread(
+            process_query,
+            query_image=image_bytes,
+            result_directory=result_dir,
+            mapper=catalogue,
+            size=(60, 60),
+        )
 
-    # Optional: Add debug statements to verify mapper structure
-    print(f"Mapper Type: {type(mapper)}")  # Should output: <class 'list'>
-    if len(mapper) > 0:
-        print(f"First album keys: {mapper[0].keys()}")  # Should include 'imageSrc'
+    response = {"results": apf_results}
+    if export:
+        response["export_id"] = query_id
+    return response
 
-    # Define the result directory
-    RESULT_DIR = BASE_DIR / "query_result"
 
-    # Perform image search
-    apf_results = process_query(
-        query_image_path=image_path,
-        result_directory=RESULT_DIR,
-        mapper=mapper,  # Pass the loaded mapper data
-        size=(60, 60),
-    )
-
-    return {"results": apf_results}
+# Humming search engines: raw 638-dim histograms or their PCA projection
+AUDIO_SEARCH_ENGINES = ("raw", "pca")
 
 
 # Endpoint to search by audio
 @app.post("/search-audio/")
-async def search_audio(query_audio: UploadFile = File(...)):
+async def search_audio(
+    query_audio: UploadFile = File(...),
+    engine: str = "raw",
+    rerank_top_k: int = 0,
+    export: bool = False,
+):
     if not query_audio.filename.lower().endswith((".mp3", ".wav")):
         raise HTTPException(status_code=400, detail="Invalid audio format.")
-
-    audio_query_dir = "backend/query/"
-    os.makedirs(audio_query_dir, exist_ok=True)
-
-    audio_path = os.path.join(audio_query_dir, query_audio.filename)
-    try:
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(query_audio.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save audio: {e}")
-
-    # Locate the mapper JSON file
-    mapper_dir = BASE_DIR / "database" / "mapper"
-    mapper_files = glob.glob(str(mapper_dir / "*.json"))
-    if not mapper_files:
-        raise HTTPException(status_code=500, detail="Mapper JSON file not found.")
-
-    mapper_file = mapper_files[0]  # Use the first found JSON file
-
-    # Load the mapper JSON data
-    try:
-        with open(mapper_file, "r") as f:
-            mapper = json.load(f)
-    except json.JSONDecodeError as e:
+    if engine not in AUDIO_SEARCH_ENGINES:
         raise HTTPException(
-            status_code=500, detail=f"Invalid JSON format in mapper file: {e}"
+            status_code=400,
+            detail=f"Invalid search engine '{engine}'. Use one of: {', '.join(AUDIO_SEARCH_ENGINES)}.",
+        )
+    if rerank_top_k < 0 or (rerank_top_k > 0 and engine != "raw"):
+        raise HTTPException(
+            status_code=400,
+            detail="rerank_top_k must be >= 0 and is only supported by the raw engine.",
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load mapper JSON: {e}")
 
-    # Optional: Add debug statements to verify mapper structure
-    print(f"Mapper Type: {type(mapper)}")  # Should output: <class 'list'>
-    if len(mapper) > 0:
-        print(f"First album keys: {mapper[0].keys()}")  # Should include 'imageSrc'
+    # The resident mapper catalogue (re-read only when the mapper file changes)
+    catalogue = await load_catalogue(missing_status=500)
 
-    # Define the result directory
-    RESULT_DIR = BASE_DIR / "query_result"
+    # Copy the matched files to this query's own result directory only when asked to
+    query_id = uuid.uuid4().hex
+    result_dir = RESULT_DIR / query_id if export else None
 
     # QUERYING
-    # Get the list of MIDI files for querying
-    database_files = [
-        os.path.join(MIDI_DATASET_PATH, f)
-        for f in os.listdir(MIDI_DATASET_PATH)
-        if f.endswith(".mid")
-    ]
-
-    if not database_files:
-        print(
-            f"No MIDI files found in {MIDI_DATASET_PATH}. Please convert the dataset first."
+    # Use the precomputed features of the MIDI files
+    feature_store = await run_in_thread(get_feature_store)
+
+    if not feature_store["files"]:
+        logger.warning(
+            "No MIDI files found in %s. Please convert the dataset first.",
+            MIDI_DATASET_PATH,
         )
         return
 
-    # Debugging statement
-    print(f"Loaded {len(database_files)} MIDI files for querying.")
-
     # Query by humming
-    print("Processing query audio and retrieving similar MIDI files...\n")
-    matches = query_by_humming(
-        audio_path, database_files, threshold=SIMILARITY_THRESHOLD
+    logger.debug(
+        "Querying %d MIDI files (%s engine).", len(feature_store["files"]), engine
+    )
+    timings = {}
+    start = time.perf_counter()
+    async with SEARCH_AUDIO_LIMITER:
+        # Transcribe on the process pool from this request's scratch copy of the
+        # upload (removed right after), then score on the thread pool
+        async with query_workspace() as workspace:
+            audio_path = str(workspace / query_file_name(query_audio.filename))
+            try:
+                await run_in_thread(save_upload, query_audio, audio_path)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to save audio: {e}")
+            try:
+                query_notes = await run_in_process(query_notes_from_audio, audio_path)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500, detail=f"Failed to transcribe audio: {e}"
+                )
+        timings["transcription"] = time.perf_counter() - start
+
+        if engine == "pca":
+            pca_model = await run_in_thread(MIR_PCA.get_pca_model)
+            if pca_model is None:
+                raise HTTPException(
+                    status_code=500, detail="MIR PCA model is not available."
+                )
+            matches = await run_in_thread(
+                MIR_PCA.query_by_humming,
+                None,
+                threshold=MIR_PCA.SIMILARITY_THRESHOLD,
+                pca_model=pca_model,
+                query_notes=query_notes,
+            )
+        else:
+            matches = await run_in_thread(
+                query_by_humming,
+                None,
+                threshold=SIMILARITY_THRESHOLD,
+                feature_store=feature_store,
+                rerank_top_k=rerank_top_k,
+                timings=timings,
+                query_notes=query_notes,
+            )
+    search_time = time.perf_counter() - start
+    logger.info(
+        "Audio search (%s engine) took %.1f ms, %d matches.",
+        engine,
+        search_time * 1000,
+        len(matches),
     )
 
     # Save the matches to the result directories and MIR_result.json
-    mir_results = save_matches(matches, mapper, result_dir=RESULT_DIR)
+    mir_results = await run_in_thread(save_matches, matches, catalogue, result_dir=result_dir)
 
-    return {"results": mir_results}
+    response = {
+        "results": mir_results,
+        "engine": engine,
+        "search_time": search_time,
+        "timings": timings,
+    }
+    if export:
+        response["export_id"] = query_id
+    return response
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import os
+import glob
+import json
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # Points to 'backend/'
+MAPPER_DIR = BASE_DIR / "database" / "mapper"
+MAPPER_FILE = MAPPER_DIR / "mapper.json"
+IMAGE_URL_PREFIX = "/static"  # Route of the database/picture static mount
+AUDIO_URL_PREFIX = "/audio"  # Route of the database/audio static mount
+
+# ====================================================================================
+# Mapper Catalogue
+# ====================================================================================
+
+
+def file_basename(path):
+    """
+    File name without directories and extension ("a/b/pop.00021.wav" -> "pop.00021").
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class MapperCatalogue:
+    """
+    The albums of a mapper file with lookup tables for the result builders, so a
+    match is joined with its album in O(1) instead of scanning every album and song.
+
+    When several albums share an image (or several songs a file), the first one in
+    the mapper wins, as with the previous linear scans.
+    """
+
+    def __init__(self, albums, source=None, signature=None):
+        if not isinstance(albums, list):
+            raise ValueError("The mapper must be a list of albums.")
+        self.albums = albums
+        self.source = source  # Path of the mapper file (None when built from a list)
+        self.signature = signature  # (mtime_ns, size) of the file when it was read
+
+        self.albums_by_id = {}  # Album id -> album
+        self.albums_by_image = {}  # Image file name -> album
+        self.songs_by_basename = {}  # Song file name without extension -> (album, song)
+        for album in albums:
+            self.albums_by_id.setdefault(album.get("id"), album)
+            image_src = album.get("imageSrc")
+            if image_src:
+                self.albums_by_image.setdefault(os.path.basename(image_src), album)
+            for song in album.get("songs", []):
+                if song.get("file"):
+                    self.songs_by_basename.setdefault(
+                        file_basename(song["file"]), (album, song)
+                    )
+
+    def __len__(self):
+        return len(self.albums)
+
+    def album_for_image(self, image_path):
+        """
+        Returns:
+            dict: The album whose cover is the given image file, or None.
+        """
+        return self.albums_by_image.get(os.path.basename(image_path))
+
+    def song_for_file(self, file_path):
+        """
+        Parameters:
+            file_path (str): A song file (e.g. the matched MIDI file), compared by
+                name without extension.
+
+        Returns:
+            tuple: (album, song), or (None, None) if no song has that name.
+        """
+        return self.songs_by_basename.get(file_basename(file_path), (None, None))
+
+    @classmethod
+    def load(cls, mapper_file):
+        signature = file_signature(mapper_file)
+        with open(mapper_file, "r") as f:
+            albums = json.load(f)
+        return cls(albums, source=str(mapper_file), signature=signature)
+
+
+def as_catalogue(mapper):
+    """
+    Accept either a MapperCatalogue or the raw list of albums of a mapper file.
+    """
+    if isinstance(mapper, MapperCatalogue):
+        return mapper
+    return MapperCatalogue(mapper)
+
+
+# ====================================================================================
+# Result URLs (Served by the Static Mounts)
+# ====================================================================================
+
+
+def image_url(image_path):
+    """
+    URL of a database image (images are served by file name).
+    """
+    return f"{IMAGE_URL_PREFIX}/{quote(os.path.basename(image_path))}"
+
+
+def audio_url(audio_file):
+    """
+    URL of a song file (relative to the audio directory, as in the mapper).
+    """
+    return f"{AUDIO_URL_PREFIX}/{quote(Path(audio_file).as_posix())}"
+
+
+# ====================================================================================
+# Resident Catalogue (Reloaded When the Mapper File Changes)
+# ====================================================================================
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def find_mapper_file(mapper_dir=MAPPER_DIR):
+    """
+    Returns:
+        str: mapper.json if present, else the first JSON file of the mapper directory
+        (uploads keep their own name), or None.
+    """
+    mapper_file = Path(mapper_dir) / MAPPER_FILE.name
+    if mapper_file.exists():
+        return str(mapper_file)
+    mapper_files = sorted(glob.glob(str(Path(mapper_dir) / "*.json")))
+    return mapper_files[0] if mapper_files else None
+
+
+def get_catalogue(mapper_file=None):
+    """
+    Return the resident catalogue, re-reading the mapper file only when its
+    modification time or size changed since it was loaded.
+
+    Parameters:
+        mapper_file (str): The mapper file (defaults to find_mapper_file()).
+
+    Returns:
+        MapperCatalogue: The catalogue.
+
+    Raises:
+        FileNotFoundError: If there is no mapper file.
+        json.JSONDecodeError / ValueError: If the mapper file is not a list of albums.
+    """
+    global _catalogue
+    if mapper_file is None:
+        mapper_file = find_mapper_file()
+    if mapper_file is None:
+        raise FileNotFoundError(f"No mapper JSON file found in {MAPPER_DIR}.")
+
+    with _catalogue_lock:
+        try:
+            signature = file_signature(mapper_file)
+        except FileNotFoundError:
+            _catalogue = None
+            raise
+        if (
+            _catalogue is None
+            or _catalogue.source != str(mapper_file)
+            or _catalogue.signature != signature
+        ):
+            _catalogue = None
+            _catalogue = MapperCatalogue.load(mapper_file)
+        return _catalogue
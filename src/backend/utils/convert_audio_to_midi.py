@@ -1,8 +1,29 @@
 import os
-from basic_pitch.inference import predict_and_save
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from basic_pitch.inference import (
+    predict_and_save,
+    Model,
+    window_audio_file,
+    unwrap_output,
+)
+from basic_pitch.note_creation import model_output_to_notes
+from basic_pitch.constants import AUDIO_SAMPLE_RATE, AUDIO_N_SAMPLES, FFT_HOP
 from basic_pitch import ICASSP_2022_MODEL_PATH
 import librosa
-import soundfile as sf
+
+CONVERSION_BATCH_SIZE = 8  # Audio files handed to a worker at a time
+
+# basic_pitch model loaded once per conversion worker process
+_worker_model = None
+
+# basic_pitch model kept warm for query-time transcription
+_resident_model = None
 
 
 def convert_audio_to_midi(audio_file, midi_file):
@@ -14,41 +35,226 @@ def convert_audio_to_midi(audio_file, midi_file):
     midi_file (str): Path to the output MIDI file.
     """
     try:
-        # Load the audio file using librosa to handle various formats
-        y, sr = librosa.load(audio_file, sr=None)
-        temp_wav_file = audio_file.rsplit(".", 1)[0] + "_temp.wav"
-        sf.write(temp_wav_file, y, sr)
-
-        output_directory = os.path.dirname(midi_file)
-        predict_and_save(
-            audio_path_list=[temp_wav_file],
-            output_directory=output_directory,
-            save_midi=True,
-            sonify_midi=False,
-            save_model_outputs=False,
-            save_notes=False,
-            model_or_model_path=ICASSP_2022_MODEL_PATH,
-        )
-
-        # Rename the output file to match the original file name
-        base_name = (
-            os.path.basename(audio_file).rsplit(".", 1)[0] + "_temp_basic_pitch.mid"
-        )
-        output_path = os.path.join(output_directory, base_name)
-
-        # Process validation
-        if os.path.exists(output_path):
-            os.rename(output_path, midi_file)
-            print(f"Successfully converted {audio_file} to {midi_file}")
-        else:
-            print(f"Error: Expected output file {output_path} not found.")
-
-        # Remove the temporary WAV file
-        os.remove(temp_wav_file)
+        # Transcribe in memory with the resident model, then write the MIDI directly
+        _, midi_data = transcribe_audio_file(audio_file)
+        midi_data.write(str(midi_file))
+        print(f"Successfully converted {audio_file} to {midi_file}")
     except Exception as e:
         print(f"Error converting {audio_file} to MIDI: {e}")
 
 
+def get_basic_pitch_model():
+    """
+    Return the process-level basic_pitch model, loading it on first use
+    (the API loads it at startup so queries never pay for it).
+    """
+    global _resident_model
+    if _resident_model is None:
+        _resident_model = load_basic_pitch_model()
+    return _resident_model
+
+
+def run_model_on_waveform(audio, model):
+    """
+    Run basic_pitch on a mono waveform sampled at AUDIO_SAMPLE_RATE, mirroring
+    basic_pitch.inference.run_inference without reading the audio from disk.
+
+    Returns:
+    dict: The unwrapped "note", "onset" and "contour" model outputs.
+    """
+    # Overlap 30 frames, as basic_pitch does
+    n_overlapping_frames = 30
+    overlap_len = n_overlapping_frames * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+
+    original_length = audio.shape[0]
+    audio = np.concatenate(
+        [np.zeros(overlap_len // 2, dtype=np.float32), audio.astype(np.float32)]
+    )
+
+    output = {"note": [], "onset": [], "contour": []}
+    for window, _ in window_audio_file(audio, hop_size):
+        for key, value in model.predict(np.expand_dims(window, axis=0)).items():
+            output[key].append(value)
+
+    return {
+        key: unwrap_output(np.concatenate(value), original_length, n_overlapping_frames)
+        for key, value in output.items()
+    }
+
+
+def transcribe_waveform(
+    audio,
+    sample_rate,
+    model=None,
+    onset_threshold=0.5,
+    frame_threshold=0.3,
+    minimum_note_length=127.70,
+):
+    """
+    Transcribe a decoded waveform to note events in memory.
+
+    Parameters:
+    audio (numpy.ndarray): Mono waveform.
+    sample_rate (int): Sample rate of the waveform.
+    model (Model): basic_pitch model (defaults to the resident model).
+    onset_threshold, frame_threshold, minimum_note_length: basic_pitch defaults.
+
+    Returns:
+    tuple: (note events as (start_s, end_s, pitch_midi, amplitude, pitch_bends),
+            the pretty_midi.PrettyMIDI transcription)
+    """
+    if model is None:
+        model = get_basic_pitch_model()
+    if sample_rate != AUDIO_SAMPLE_RATE:
+        audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=AUDIO_SAMPLE_RATE)
+
+    model_output = run_model_on_waveform(audio, model)
+    min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+    midi_data, note_events = model_output_to_notes(
+        model_output,
+        onset_thresh=onset_threshold,
+        frame_thresh=frame_threshold,
+        min_note_len=min_note_len,
+    )
+    return note_events, midi_data
+
+
+def transcribe_audio_file(audio_file, model=None):
+    """
+    Decode an audio file (any format librosa reads) and transcribe it in memory.
+    """
+    audio, sample_rate = librosa.load(audio_file, sr=AUDIO_SAMPLE_RATE, mono=True)
+    return transcribe_waveform(audio, sample_rate, model)
+
+
+def load_basic_pitch_model():
+    """
+    Load the basic_pitch model (ICASSP 2022) once so it can be reused across files.
+    """
+    return Model(ICASSP_2022_MODEL_PATH)
+
+
+def is_valid_midi_file(midi_file):
+    """
+    Check that a MIDI file exists and starts with a Standard MIDI File header, so
+    conversions interrupted halfway are redone.
+    """
+    try:
+        with open(midi_file, "rb") as f:
+            return f.read(4) == b"MThd"
+    except OSError:
+        return False
+
+
+def _init_conversion_worker():
+    global _worker_model
+    _worker_model = load_basic_pitch_model()
+
+
+def _predict_to_directory(audio_files, output_directory):
+    predict_and_save(
+        audio_path_list=audio_files,
+        output_directory=output_directory,
+        save_midi=True,
+        sonify_midi=False,
+        save_model_outputs=False,
+        save_notes=False,
+        model_or_model_path=_worker_model,
+    )
+
+
+def _convert_batch(jobs):
+    """
+    Convert a batch of (audio_file, midi_file) jobs with the worker's model.
+
+    Returns:
+        list: (audio_file, midi_file, error message or None) for every job.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as output_directory:
+
+        def output_path_of(audio_file):
+            base_name = os.path.basename(audio_file).rsplit(".", 1)[0]
+            return os.path.join(output_directory, base_name + "_basic_pitch.mid")
+
+        try:
+            _predict_to_directory([audio for audio, _ in jobs], output_directory)
+        except Exception:
+            # predict_and_save stops at the first failure; retry the rest one by one
+            for audio_file, _ in jobs:
+                if os.path.exists(output_path_of(audio_file)):
+                    continue
+                try:
+                    _predict_to_directory([audio_file], output_directory)
+                except Exception as e:
+                    logging.error(f"Error converting {audio_file} to MIDI: {e}")
+
+        for audio_file, midi_file in jobs:
+            output_path = output_path_of(audio_file)
+            if os.path.exists(output_path):
+                # Copy next to the target, then rename, so a crash never leaves
+                # a truncated MIDI file behind
+                temp_path = midi_file + ".part"
+                shutil.copyfile(output_path, temp_path)
+                os.replace(temp_path, midi_file)
+                results.append((audio_file, midi_file, None))
+            else:
+                results.append((audio_file, midi_file, "no MIDI output produced"))
+    return results
+
+
+def convert_audio_files_to_midi(
+    jobs, workers=None, batch_size=CONVERSION_BATCH_SIZE
+):
+    """
+    Convert many audio files to MIDI on a pool of workers that each load the
+    basic_pitch model once. Jobs whose MIDI file is already valid are skipped, so an
+    interrupted conversion resumes where it stopped.
+
+    Parameters:
+    jobs (list): (audio_file, midi_file) pairs.
+    workers (int): Number of worker processes (defaults to the number of CPU cores).
+    batch_size (int): Number of files passed to predict_and_save at once.
+
+    Returns:
+    list: The (audio_file, midi_file) pairs that failed to convert.
+    """
+    pending = [job for job in jobs if not is_valid_midi_file(job[1])]
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        logging.info(f"Skipping {skipped} file(s) with an existing MIDI conversion.")
+    if not pending:
+        return []
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+    failed = []
+    done = 0
+    start = time.perf_counter()
+
+    # "spawn" keeps the model's runtime (TensorFlow/ONNX) out of forked state
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_conversion_worker,
+    ) as executor:
+        futures = [executor.submit(_convert_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            for audio_file, midi_file, error in future.result():
+                done += 1
+                if error:
+                    failed.append((audio_file, midi_file))
+                    logging.error(f"Error converting {audio_file} to MIDI: {error}")
+            elapsed = time.perf_counter() - start
+            logging.info(
+                f"Converted {done}/{len(pending)} audio files "
+                f"({done / elapsed:.2f} files/s, {len(failed)} failed)."
+            )
+
+    return failed
+
+
 if __name__ == "__main__":
     audio_file = "test/query/audio/pop.00099.wav"
     midi_file = audio_file.rsplit(".", 1)[0] + ".mid"
@@ -11,6 +11,8 @@ import logging
 import numpy as np
 from PIL import Image  # For image validation
 from backend.APF2 import *
+from backend import APF2
+from backend.utils.executors import run_in_thread
 
 # ====================================================================================
 # Setup Logging
@@ -325,52 +327,15 @@ async def process_database(
     - size (tuple): Image size for processing.
     - threshold (float): Variance threshold for selecting principal components.
     """
-    IMAGE_DB_PROJECTION_FILE = PROCESSED_DATA_DIR / "image_db_projection.npz"
-    MEAN_FILE = PROCESSED_DATA_DIR / "mean.npy"
-    PRINCIPAL_COMPONENTS_FILE = PROCESSED_DATA_DIR / "principal_components.npy"
-    ORIGINAL_IMAGE_PATHS_FILE = PROCESSED_DATA_DIR / "original_image_paths.npy"
-
-    if not process_db and IMAGE_DB_PROJECTION_FILE.exists():
-        logger.info("Loading existing database projections...")
-        data = np.load(IMAGE_DB_PROJECTION_FILE)
-        imageDB_projection = data["imageDB_projection"]
-        mean = np.load(MEAN_FILE)
-        principal_components = np.load(PRINCIPAL_COMPONENTS_FILE)
-        original_image_paths = np.load(
-            ORIGINAL_IMAGE_PATHS_FILE, allow_pickle=True
-        ).tolist()
-    else:
-        logger.info("Processing database images...")
-        # Load and preprocess database images
-        imageDB, original_image_paths = load_image_database(db_dir_path, size)
-        if imageDB.size == 0:
-            logger.error("No images loaded.")
-            return
-
-        # Standardize the data
-        imageDB_centered, mean = standardize_data(imageDB)
-
-        # Compute the covariance matrix
-        covariance_matrix = compute_covariance_matrix(imageDB_centered)
-
-        # Perform SVD
-        U, S, Vt = perform_svd(covariance_matrix)
-
-        # Select the principal components
-        principal_components = select_principal_components(U, S, threshold)
-
-        # Project imageDB_centered onto the principal components
-        imageDB_projection = project_data(imageDB_centered, principal_components)
-
-        # Save the data
-        os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
-        np.savez_compressed(
-            IMAGE_DB_PROJECTION_FILE, imageDB_projection=imageDB_projection
-        )
-        np.save(MEAN_FILE, mean)
-        np.save(PRINCIPAL_COMPONENTS_FILE, principal_components)
-        np.save(ORIGINAL_IMAGE_PATHS_FILE, original_image_paths)
-        logger.info("Database processing complete and data saved.")
+    logger.info("Processing database images...")
+    # Build the projections and swap the resident image index used by queries
+    imageDB_projection, mean, principal_components, original_image_paths = (
+        await run_in_thread(APF2.process_database, db_dir_path, process_db, size, threshold)
+    )
+    if imageDB_projection is None:
+        logger.error("No images loaded.")
+        return
+    logger.info("Database processing complete and data saved.")
 
     # Additional processing can be done here if needed
     # For example, handling queries or further analysis
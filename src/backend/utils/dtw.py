@@ -0,0 +1,230 @@
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+DTW_BAND_RATIO = 0.1  # Sakoe-Chiba band radius as a fraction of the query length
+WINDOW_HOP_RATIO = 0.25  # Hop between song windows as a fraction of the query length
+
+# ====================================================================================
+# Dynamic Time Warping
+# ====================================================================================
+
+
+def band_radius(length, band_ratio=DTW_BAND_RATIO):
+    return max(int(round(length * band_ratio)), 1)
+
+
+def dtw_distances(x, candidates, radius, best_so_far=np.inf):
+    """
+    Squared-difference DTW distance between a sequence and each row of candidates
+    (all of the same length) within a Sakoe-Chiba band, computed row by row for
+    every candidate at once.
+
+    Within a row, D[i, j] = min(a[j], c[i, j] + D[i, j - 1]) with
+    a[j] = c[i, j] + min(D[i - 1, j - 1], D[i - 1, j]), which unrolls to a running
+    minimum over prefix sums, so every row is a few numpy operations.
+
+    Parameters:
+        x (numpy.ndarray): The query sequence.
+        candidates (numpy.ndarray): K x len(x) candidate sequences.
+        radius (int): The band radius.
+        best_so_far (float): Candidates are abandoned as soon as their distance
+            cannot beat this value.
+
+    Returns:
+        numpy.ndarray: The DTW distance of every candidate (inf if abandoned).
+    """
+    n = len(x)
+    candidates = np.atleast_2d(candidates)
+    distances = np.full(len(candidates), np.inf)
+    active = np.arange(len(candidates))
+    previous = np.full((len(candidates), n), np.inf)
+    for i in range(n):
+        low, high = max(0, i - radius), min(n, i + radius + 1)
+        costs = (candidates[active, low:high] - x[i]) ** 2
+
+        if i == 0:
+            steps = np.full_like(costs, np.inf)
+            steps[:, 0] = costs[:, 0]
+        else:
+            diagonal = np.full((len(active), high - low), np.inf)
+            diagonal[:, 1 if low == 0 else 0 :] = previous[:, max(low - 1, 0) : high - 1]
+            steps = costs + np.minimum(diagonal, previous[:, low:high])
+
+        prefix = np.cumsum(costs, axis=1)
+        row = prefix + np.minimum.accumulate(steps - prefix, axis=1)
+
+        # Early abandoning: every warping path through this row already costs more
+        alive = row.min(axis=1) < best_so_far
+        active, row = active[alive], row[alive]
+        if len(active) == 0:
+            return distances
+        previous = np.full((len(active), n), np.inf)
+        previous[:, low:high] = row
+
+    distances[active] = previous[:, -1]
+    return distances
+
+
+def dtw_distance(x, y, radius, best_so_far=np.inf):
+    """
+    DTW distance of two equal-length sequences (see dtw_distances).
+    """
+    return dtw_distances(x, np.asarray(y)[None, :], radius, best_so_far)[0]
+
+
+# ====================================================================================
+# LB_Keogh Lower Bound
+# ====================================================================================
+
+
+def envelope(query, radius):
+    """
+    Upper and lower envelope of a sequence over a band of the given radius.
+    """
+    padded = np.pad(query, radius, mode="edge")
+    windows = sliding_window_view(padded, 2 * radius + 1)
+    return windows.max(axis=1), windows.min(axis=1)
+
+
+def lb_keogh(candidates, upper, lower):
+    """
+    LB_Keogh lower bound of the DTW distance between the query (given by its
+    envelope) and every row of candidates.
+    """
+    above = np.maximum(candidates - upper, 0)
+    below = np.maximum(lower - candidates, 0)
+    return np.sum(above**2 + below**2, axis=1)
+
+
+# ====================================================================================
+# Best Matching Window of a Song
+# ====================================================================================
+
+
+def normalize_windows(windows):
+    """
+    Z-normalize every row (a standard deviation of 0 is treated as 1).
+    """
+    mean = windows.mean(axis=1, keepdims=True)
+    std = windows.std(axis=1, keepdims=True)
+    std[std == 0] = 1
+    return (windows - mean) / std
+
+
+def best_window_distance(query, notes, best_so_far=np.inf, band_ratio=DTW_BAND_RATIO):
+    """
+    Smallest DTW distance between a normalized query contour and the z-normalized
+    query-length windows of a song's pitch sequence.
+
+    Windows whose LB_Keogh lower bound cannot beat the distance of the most
+    promising window are skipped without running DTW.
+
+    Parameters:
+        query (numpy.ndarray): The normalized query contour.
+        notes (numpy.ndarray): The song's pitch sequence.
+        best_so_far (float): Distance to beat (e.g. the best of the previous songs).
+        band_ratio (float): Band radius as a fraction of the query length.
+
+    Returns:
+        tuple: (distance or inf, number of windows, number of DTW computations run)
+    """
+    query = np.asarray(query, dtype=np.float64)
+    notes = np.asarray(notes, dtype=np.float64)
+    length = len(query)
+    if length == 0 or len(notes) == 0:
+        return np.inf, 0, 0
+    if len(notes) < length:
+        notes = np.pad(notes, (0, length - len(notes)), mode="edge")
+
+    hop = max(int(length * WINDOW_HOP_RATIO), 1)
+    windows = sliding_window_view(notes, length)
+    last = len(windows) - 1
+    starts = np.unique(np.append(np.arange(0, last + 1, hop), last))
+    windows = normalize_windows(windows[starts])
+
+    radius = band_radius(length, band_ratio)
+    upper, lower = envelope(query, radius)
+    bounds = lb_keogh(windows, upper, lower)
+
+    # Exact distance of the most promising window, then every window whose lower
+    # bound can still beat it, abandoning the others as soon as they fall behind
+    order = np.argsort(bounds, kind="stable")
+    best = min(best_so_far, dtw_distance(query, windows[order[0]], radius, best_so_far))
+    remaining = order[1:][bounds[order[1:]] < best]
+    if len(remaining):
+        best = min(best, dtw_distances(query, windows[remaining], radius, best).min())
+    computed = 1 + len(remaining)
+    return (best if best < best_so_far else np.inf), len(windows), computed
+
+
+def distance_to_similarity(distance, length):
+    """
+    Map a DTW distance to a similarity in (0, 1] (mean squared deviation per note).
+    """
+    return 1.0 / (1.0 + distance / max(length, 1))
+
+
+def rerank_candidates(query, candidate_notes):
+    """
+    DTW similarity of a normalized query contour to each candidate song.
+
+    Parameters:
+        query (numpy.ndarray): The normalized query contour.
+        candidate_notes (list): The pitch sequence of every candidate song.
+
+    Returns:
+        tuple: (the DTW similarity of every candidate, windows considered,
+        DTW computations run)
+    """
+    distances = np.full(len(candidate_notes), np.inf)
+    n_windows = computed = 0
+    for i, notes in enumerate(candidate_notes):
+        distances[i], windows, count = best_window_distance(query, notes)
+        n_windows += windows
+        computed += count
+    return distance_to_similarity(distances, len(query)), n_windows, computed
+
+
+# ====================================================================================
+# Pruned vs. Full DTW Benchmark
+# ====================================================================================
+
+
+def main():
+    rng = np.random.default_rng(0)
+    query = rng.normal(size=40).cumsum()
+    query = (query - query.mean()) / query.std()
+    songs = [rng.normal(size=rng.integers(100, 600)).cumsum() for _ in range(50)]
+
+    start = time.perf_counter()
+    results = [best_window_distance(query, song) for song in songs]
+    pruned = [distance for distance, _, _ in results]
+    pruned_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    radius = band_radius(len(query))
+    full = []
+    for song in songs:
+        windows = sliding_window_view(song, len(query))
+        hop = max(int(len(query) * WINDOW_HOP_RATIO), 1)
+        starts = np.unique(np.append(np.arange(0, len(windows), hop), len(windows) - 1))
+        full.append(
+            min(dtw_distance(query, w, radius) for w in normalize_windows(windows[starts]))
+        )
+    full_time = time.perf_counter() - start
+
+    print(
+        f"{len(songs)} songs - pruned: {pruned_time * 1000:.1f} ms, "
+        f"full: {full_time * 1000:.1f} ms, identical: {np.allclose(pruned, full)}, "
+        f"DTW runs: {sum(count for _, _, count in results)}/"
+        f"{sum(windows for _, windows, _ in results)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
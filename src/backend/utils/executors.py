@@ -0,0 +1,178 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+CPU_COUNT = os.cpu_count() or 1
+THREAD_WORKERS = min(32, CPU_COUNT + 4)  # NumPy scoring and file I/O (release the GIL)
+PROCESS_WORKERS = max(1, CPU_COUNT // 2)  # Audio transcription (one model per worker)
+PARSE_WORKERS = CPU_COUNT  # MIDI parsing (pure Python, no model)
+
+logger = logging.getLogger(__name__)
+
+# ====================================================================================
+# Shared Executors
+# ====================================================================================
+
+_thread_executor = None
+_process_executor = None
+_parse_executor = None
+
+
+def warm_up_worker():
+    """
+    Process pool initializer: load the basic_pitch model once per worker process, so
+    transcriptions never pay for the model load.
+    """
+    from backend.utils.convert_audio_to_midi import get_basic_pitch_model
+
+    try:
+        get_basic_pitch_model()
+    except Exception as e:
+        logger.error("Failed to load the basic_pitch model in a worker: %s", str(e))
+
+
+def get_thread_executor():
+    global _thread_executor
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(
+            max_workers=THREAD_WORKERS, thread_name_prefix="search"
+        )
+    return _thread_executor
+
+
+def get_process_executor():
+    """
+    Process pool for audio transcription. Workers are spawned (not forked) so they
+    never inherit the server's threads or a half-initialized TensorFlow runtime.
+    """
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_worker,
+        )
+    return _process_executor
+
+
+def get_parse_executor():
+    """
+    Process pool for MIDI parsing. Unlike the transcription pool, its workers load
+    no model, so a feature store rebuild only pays for the parser.
+    """
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_executor
+
+
+def start_process_workers():
+    """
+    Start every process pool worker now (each loads its basic_pitch model in the
+    background), instead of on the first transcriptions.
+    """
+    executor = get_process_executor()
+    for _ in range(PROCESS_WORKERS):
+        executor.submit(os.getpid)
+
+
+def shutdown_executors():
+    global _thread_executor, _process_executor, _parse_executor
+    if _thread_executor is not None:
+        _thread_executor.shutdown(wait=False, cancel_futures=True)
+        _thread_executor = None
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+        _parse_executor = None
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Run a blocking call on the shared thread pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_thread_executor(), partial(func, *args, **kwargs)
+    )
+
+
+async def run_in_process(func, *args, **kwargs):
+    """
+    Run a CPU-bound call on the shared process pool (func and its arguments must be
+    picklable, i.e. module-level functions and plain data).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_process_executor(), partial(func, *args, **kwargs)
+    )
+
+
+# ====================================================================================
+# Per-Endpoint Concurrency Limits
+# ====================================================================================
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised when an endpoint already has as many requests waiting as it may queue.
+    """
+
+
+class ConcurrencyLimiter:
+    """
+    Bounded admission for one endpoint: at most `limit` requests run at once and at
+    most `max_waiting` more wait for a slot; further requests are rejected at once
+    instead of piling up.
+
+    Usage:
+        async with limiter:
+            ...
+    """
+
+    def __init__(self, name, limit, max_waiting):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = None  # Created lazily, inside the server's event loop
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            raise QueueFullError(
+                f"Too many {self.name} requests in progress, please retry later."
+            )
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.running -= 1
+        self._semaphore.release()
+        return False
+
+    def status(self):
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+        }
@@ -0,0 +1,314 @@
+import time
+import numpy as np
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+DEFAULT_N_PROBE = 8  # Number of closest lists scanned per query
+KMEANS_ITERATIONS = 20
+CHUNK_SIZE = 4096  # Rows per block when computing distances to the centroids
+CALIBRATION_QUERIES = 64  # Sample rows used to calibrate the farthest-distance estimate
+
+# ====================================================================================
+# K-Means Clustering
+# ====================================================================================
+
+
+def assign_to_centroids(data, centroids):
+    """
+    Index of the closest centroid for every row, computed block by block in float32
+    (|x|^2 is the same for every centroid, so only |c|^2 - 2 x.c is compared).
+    """
+    centroids = np.asarray(centroids, dtype=np.float32)
+    centroid_norms = np.sum(centroids**2, axis=1)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), CHUNK_SIZE):
+        block = np.asarray(data[start : start + CHUNK_SIZE], dtype=np.float32)
+        assignments[start : start + CHUNK_SIZE] = np.argmin(
+            centroid_norms - 2 * block @ centroids.T, axis=1
+        )
+    return assignments
+
+
+def cluster_sums(data, assignments, n_clusters):
+    """
+    Sum of the rows of every cluster, one weighted bincount per column.
+    """
+    return np.stack(
+        [
+            np.bincount(assignments, weights=data[:, column], minlength=n_clusters)
+            for column in range(data.shape[1])
+        ],
+        axis=1,
+    )
+
+
+def kmeans(data, n_clusters, n_iter=KMEANS_ITERATIONS, seed=0):
+    """
+    Lloyd's k-means. Empty clusters are re-seeded with random rows.
+    The data is used in its own dtype; only the centroids are float64.
+
+    Returns:
+        tuple: (centroids, assignments)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.asarray(
+        data[rng.choice(len(data), n_clusters, replace=False)], dtype=np.float64
+    )
+
+    for _ in range(n_iter):
+        assignments = assign_to_centroids(data, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = cluster_sums(data, assignments, n_clusters)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), empty.sum(), replace=False)]
+
+    return centroids, assign_to_centroids(data, centroids)
+
+
+# ====================================================================================
+# Inverted File (IVF) Index
+# ====================================================================================
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour index over a projection matrix.
+
+    Rows are clustered with k-means into inverted lists; a query only scans the rows
+    of its n_probe closest lists instead of the whole matrix.
+    """
+
+    def __init__(
+        self,
+        centroids,
+        list_offsets,
+        list_rows,
+        list_radii,
+        n_probe=None,
+        farthest_scale=1.0,
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets  # list i holds list_rows[offsets[i]:offsets[i+1]]
+        self.list_rows = list_rows
+        self.list_radii = list_radii  # Distance from each centroid to its farthest row
+        self.n_probe = n_probe or DEFAULT_N_PROBE
+        # Typical ratio of the farthest group distance to max_distance_bound
+        self.farthest_scale = farthest_scale
+
+    @classmethod
+    def build(cls, data, n_lists=None, n_probe=None, seed=0):
+        """
+        Parameters:
+            data (numpy.ndarray): N x D matrix to index.
+            n_lists (int): Number of inverted lists (defaults to sqrt(N)).
+            n_probe (int): Default number of lists scanned per query.
+        """
+        n_lists = min(n_lists or int(np.sqrt(len(data))) or 1, len(data))
+        centroids, assignments = kmeans(data, n_lists, seed=seed)
+
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=n_lists)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(counts)
+
+        list_radii = np.zeros(n_lists)
+        for start in range(0, len(data), CHUNK_SIZE):
+            block_assignments = assignments[start : start + CHUNK_SIZE]
+            row_radii = np.linalg.norm(
+                data[start : start + CHUNK_SIZE] - centroids[block_assignments], axis=1
+            )
+            np.maximum.at(list_radii, block_assignments, row_radii)
+
+        return cls(centroids, list_offsets, list_rows, list_radii, n_probe)
+
+    def search(self, query, data, n_probe=None):
+        """
+        Parameters:
+            query (numpy.ndarray): The D-dimensional query vector.
+            data (numpy.ndarray): The indexed N x D matrix.
+            n_probe (int): Number of closest lists to scan.
+
+        Returns:
+            tuple: (candidate row indices, their exact Euclidean distances to the query)
+        """
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        centroid_distances = np.linalg.norm(self.centroids - query, axis=1)
+        probed = np.argpartition(centroid_distances, n_probe - 1)[:n_probe]
+
+        rows = np.concatenate(
+            [
+                self.list_rows[self.list_offsets[i] : self.list_offsets[i + 1]]
+                for i in probed
+            ]
+        )
+        distances = np.linalg.norm(data[rows] - query, axis=1)
+        return rows, distances
+
+    def max_distance_bound(self, query):
+        """
+        Upper bound on the distance from the query to any indexed row
+        (triangle inequality over every list's centroid and radius).
+        """
+        return np.max(np.linalg.norm(self.centroids - query, axis=1) + self.list_radii)
+
+    def estimate_farthest_distance(self, query):
+        """
+        Estimate of the distance from the query to its farthest group in O(n_lists):
+        the triangle-inequality bound scaled by the ratio calibrated at build time.
+        """
+        return self.farthest_scale * self.max_distance_bound(query)
+
+    def calibrate_farthest(
+        self, data, group_ids, n_groups, n_queries=CALIBRATION_QUERIES, seed=0
+    ):
+        """
+        Calibrate farthest_scale once: the median ratio, over sample rows used as
+        queries, of the exact farthest group distance (the distance of a group, e.g.
+        the augmented rows of one image, is the minimum over its rows) to
+        max_distance_bound.
+        """
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(data), min(n_queries, len(data)), replace=False)
+        queries = np.asarray(data[sample], dtype=np.float32)
+
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, reduced to the per-group minimum per block
+        group_distances = np.full((n_groups, len(queries)), np.inf)
+        for start in range(0, len(data), CHUNK_SIZE):
+            block = np.asarray(data[start : start + CHUNK_SIZE], dtype=np.float32)
+            np.minimum.at(
+                group_distances,
+                group_ids[start : start + CHUNK_SIZE],
+                np.sum(block**2, axis=1)[:, None] - 2 * block @ queries.T,
+            )
+        group_distances = group_distances[np.isfinite(group_distances[:, 0])]
+        farthest = np.sqrt(
+            np.maximum(group_distances.max(axis=0) + np.sum(queries**2, axis=1), 0)
+        )
+        bounds = np.array([self.max_distance_bound(query) for query in queries])
+        self.farthest_scale = float(np.median(farthest / bounds))
+        return self.farthest_scale
+
+    def save(self, file_path):
+        with open(file_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+                list_radii=self.list_radii,
+                n_probe=self.n_probe,
+                farthest_scale=self.farthest_scale,
+            )
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(
+                data["centroids"],
+                data["list_offsets"],
+                data["list_rows"],
+                data["list_radii"],
+                int(data["n_probe"]),
+                float(data["farthest_scale"]) if "farthest_scale" in data else 1.0,
+            )
+
+
+# ====================================================================================
+# Recall vs. Latency Benchmark
+# ====================================================================================
+
+
+def benchmark(image_index, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32)):
+    """
+    Compare the full query path (APF2.search_top_k) with the IVF lists against the
+    exact scan of the same image index.
+
+    Returns:
+        list: One dict per setting with its mean latency (ms), recall@k (of images)
+        and largest similarity deviation (percentage points) from the exact scan.
+    """
+    from backend.APF2 import ImageIndex, search_top_k
+
+    ann_index = image_index.ann_index
+    exact_index = ImageIndex(
+        image_index.imageDB_projection,
+        image_index.mean,
+        image_index.principal_components,
+        image_index.image_paths,
+        image_index.image_ids,
+    )
+
+    start = time.perf_counter()
+    exact_results = [dict(search_top_k(query, exact_index, k)) for query in queries]
+    exact_latency = (time.perf_counter() - start) / len(queries) * 1000
+
+    results = [
+        {"method": "exact", "latency_ms": exact_latency, "recall": 1.0, "deviation": 0.0}
+    ]
+    default_n_probe = ann_index.n_probe
+    try:
+        for n_probe in n_probes:
+            if n_probe > len(ann_index.centroids):
+                break
+            ann_index.n_probe = n_probe
+            start = time.perf_counter()
+            ann_results = [search_top_k(query, image_index, k) for query in queries]
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+
+            hits, deviation = 0, 0.0
+            for expected, found in zip(exact_results, ann_results):
+                for path, similarity in found:
+                    if path in expected:
+                        hits += 1
+                        deviation = max(deviation, abs(expected[path] - similarity))
+            results.append(
+                {
+                    "method": f"ivf (n_probe={n_probe})",
+                    "latency_ms": latency,
+                    "recall": hits / (k * len(queries)),
+                    "deviation": deviation,
+                }
+            )
+    finally:
+        ann_index.n_probe = default_n_probe
+    return results
+
+
+def main():
+    from backend.APF2 import ImageIndex, ANN_N_PROBE
+
+    index = ImageIndex.load()
+    if index is None:
+        print("Database projections not found. Please process the database first.")
+        return
+    if index.ann_index is None:
+        print("Building the IVF lists for the benchmark...")
+        index.ann_index = IVFIndex.build(index.imageDB_projection, n_probe=ANN_N_PROBE)
+        index.ann_index.calibrate_farthest(
+            index.imageDB_projection, index.image_ids, len(index.image_paths)
+        )
+
+    data = index.imageDB_projection
+    rng = np.random.default_rng(0)
+    sample = np.asarray(
+        data[rng.choice(len(data), min(200, len(data)), replace=False)],
+        dtype=np.float32,
+    )
+    queries = sample + rng.normal(scale=sample.std() * 0.1, size=sample.shape)
+
+    print(f"Benchmarking {len(queries)} queries against {len(data)} rows...")
+    for result in benchmark(index, queries):
+        print(
+            f"{result['method']:<22} latency: {result['latency_ms']:8.3f} ms   "
+            f"recall@10: {result['recall']:.3f}   "
+            f"max deviation: {result['deviation']:.2f} points"
+        )
+
+
+if __name__ == "__main__":
+    main()
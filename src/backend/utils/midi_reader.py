@@ -0,0 +1,471 @@
+import math
+import itertools
+from fractions import Fraction
+import numpy as np
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+QUANTIZATION_DIVISORS = (4, 3)  # Sixteenths and eighth-note triplets (music21's default)
+DEFAULT_BAR_LENGTH = 4  # Quarter lengths per measure (4/4)
+DENOMINATOR_LIMIT = 65535  # Largest offset denominator music21 keeps exactly
+
+# Data bytes that follow each channel message status (high nibble)
+CHANNEL_MESSAGE_LENGTHS = {
+    0x80: 2,  # Note off
+    0x90: 2,  # Note on
+    0xA0: 2,  # Polyphonic key pressure
+    0xB0: 2,  # Control change
+    0xC0: 1,  # Program change
+    0xD0: 1,  # Channel pressure
+    0xE0: 2,  # Pitch bend
+}
+META_END_OF_TRACK = 0x2F
+META_TIME_SIGNATURE = 0x58
+
+# ====================================================================================
+# Pitch Sequence (music21 semantics)
+# ====================================================================================
+
+# Mirrors music21 10.5 (quantization, voices and ties of converter.parse); the parity
+# test (test/test_midi_reader.py) runs against the music21 pinned in requirements.txt.
+
+
+def nearest_multiple(value, unit):
+    """
+    Closest multiple of unit (halfway values round down), with the error rounded
+    to 7 decimals like music21.common.nearestMultiple.
+    """
+    multiple = math.floor(value / unit)
+    low = unit * multiple
+    if value <= low + unit / 2:
+        return low, round(value - low, 7)
+    high = unit * (multiple + 1)
+    return high, round(high - value, 7)
+
+
+def exact_offset(value):
+    """
+    The exact quarter length music21 stores for a float (opFrac): floats that are not
+    short binary fractions become the nearest fraction with a small denominator.
+    """
+    fraction = Fraction(value)
+    if fraction.denominator > DENOMINATOR_LIMIT:
+        fraction = fraction.limit_denominator(DENOMINATOR_LIMIT)
+    return fraction
+
+
+def quantize_quarter_length(
+    value, divisors=QUANTIZATION_DIVISORS, zero_allowed=True, gap_to_fill=0.0
+):
+    """
+    Snap a quarter length to the closest multiple of 1/divisor, following music21's
+    quantize rule: prefer the grid that leaves no gap before the next onset
+    (gap_to_fill), then the smallest error, then the finer grid.
+    """
+    candidates = []
+    for divisor in divisors:
+        tick = 1 / divisor
+        match, error = nearest_multiple(value, tick)
+        if not zero_allowed and match == 0:
+            match = tick
+            error = abs(round(value - match, 7))
+        if float(gap_to_fill) % tick == 0:
+            remaining_gap = 0.0
+        else:
+            remaining_gap = max(float(gap_to_fill) - match, 0.0)
+        candidates.append((remaining_gap, error, tick, match))
+    return min(candidates)[3]
+
+
+def bar_length_at(offset, time_signatures):
+    """
+    Parameters:
+        offset (Fraction): Start of a measure in quarter lengths.
+        time_signatures (list): (start, bar length) pairs in quarter lengths, sorted.
+
+    Returns:
+        Fraction: The length of the measure under the time signature active at offset.
+    """
+    bar_length = DEFAULT_BAR_LENGTH
+    for start, length in time_signatures:
+        if start > offset:
+            break
+        bar_length = length
+    return bar_length
+
+
+def group_chords(notes):
+    """
+    Collect notes that start within the quantization tolerance and end together into
+    chords, as music21's midiTrackToStream does.
+
+    Returns:
+        tuple: (list of (onset, duration, pitches), whether some notes share an onset
+                but not an end and need separate voices)
+    """
+    tolerance = 1 / max(QUANTIZATION_DIVISORS)
+    chords = []
+    voices_required = False
+    gathered = [False] * len(notes)
+    for i, (start, end, pitch) in enumerate(notes):
+        if gathered[i]:
+            continue
+        pitches = [pitch]
+        duration = end - start
+        for j in range(i + 1, len(notes)):
+            other_start, other_end, other_pitch = notes[j]
+            if other_start - start >= tolerance:
+                break
+            if abs(other_end - end) > tolerance:
+                voices_required = True
+                continue
+            pitches.append(other_pitch)
+            # music21 takes a chord's duration from its last member alone
+            duration = other_end - other_start
+            gathered[j] = True
+        chords.append((start, duration, pitches))
+    return chords, voices_required
+
+
+def quantize_chords(chords):
+    """
+    Quantize onsets and durations; durations stretch to close the gap before the
+    next onset where one of the grids allows it.
+
+    Returns:
+        list: (offset, duration, pitches) with exact offsets, in stream order.
+    """
+    matches = [quantize_quarter_length(start) for start, _, _ in chords]
+    offsets = [exact_offset(match) for match in matches]
+    quantized = []
+    for i, (_, duration, pitches) in enumerate(chords):
+        next_match = next(
+            (m for m, o in zip(matches[i + 1 :], offsets[i + 1 :]) if o > offsets[i]),
+            None,
+        )
+        if next_match is None:
+            gap_to_fill = 0.0
+        else:
+            gap_to_fill = exact_offset(next_match - float(offsets[i]))
+        duration = quantize_quarter_length(
+            duration, zero_allowed=False, gap_to_fill=gap_to_fill
+        )
+        quantized.append((offsets[i], exact_offset(duration), pitches))
+
+    # Stable sort keeps the insertion order of chords that land on the same offset
+    quantized.sort(key=lambda chord: chord[0])
+    return quantized
+
+
+class Measure:
+    """
+    The notes of one measure, kept either at measure level or split into voices.
+    Every note is [offset in the measure, duration, pitches, insertion index].
+    """
+
+    def __init__(self, start, length):
+        self.start = start
+        self.length = length
+        self.notes = []
+        self.voices = []
+
+
+def sort_notes(notes):
+    return sorted(notes, key=lambda note: (note[0], note[3]))
+
+
+def make_voices(measure, insertions):
+    """
+    Greedily spread overlapping notes over voices (music21's makeVoices).
+    """
+    notes = sort_notes(measure.notes)
+    highest_time = 0
+    for offset, duration, _, _ in notes:
+        if offset < highest_time:
+            break
+        highest_time = max(highest_time, offset + duration)
+    else:
+        return  # No overlaps, nothing to do
+
+    voice_ends = []
+    for offset, duration, pitches, _ in notes:
+        for i, end in enumerate(voice_ends):
+            if end <= offset:
+                break
+        else:
+            i = len(voice_ends)
+            voice_ends.append(0)
+            measure.voices.append([])
+        measure.voices[i].append([offset, duration, pitches, next(insertions)])
+        voice_ends[i] = max(voice_ends[i], offset + duration)
+    measure.notes = []
+
+
+def make_ties(measures, time_signatures, insertions):
+    """
+    Cut notes at the end of their measure and carry the remainder into the next one
+    (music21's makeTies, including where it places remainders around voices).
+    """
+    index = 0
+    while index < len(measures):
+        measure = measures[index]
+        if index + 1 < len(measures):
+            following = measures[index + 1]
+            appended = True
+        else:
+            start = measure.start + measure.length
+            following = Measure(start, bar_length_at(start, time_signatures))
+            appended = False
+        following_has_voices = bool(following.voices)
+
+        for container in measure.voices or [measure.notes]:
+            for note in sort_notes(container):
+                offset, duration, pitches, _ = note
+                overshoot = offset + duration - measure.length
+                if overshoot <= 0 or offset >= measure.length:
+                    continue
+                note[1] = measure.length - offset
+
+                if following_has_voices:
+                    # Voice ids never match across measures, so remainders coming
+                    # from a voice land at measure level
+                    destination = (
+                        following.notes if measure.voices else following.voices[0]
+                    )
+                elif measure.voices:
+                    following.voices.append(
+                        [[*moved[:3], next(insertions)] for moved in sort_notes(following.notes)]
+                    )
+                    following.notes = []
+                    destination = following.voices[0]
+                else:
+                    destination = following.notes
+                destination.append([0, overshoot, pitches, next(insertions)])
+
+                if not appended:
+                    measures.append(following)
+                    appended = True
+        index += 1
+
+
+def pitch_sequence(notes, time_signatures=()):
+    """
+    Turn timed notes into the pitch list music21 yields from a parsed Part's
+    flatten().notes: notes that start and end together become chords, onsets and
+    durations are quantized, and notes are laid out in measures (and voices where
+    they overlap), with a tied copy in every further measure they reach.
+
+    Parameters:
+        notes (list): (onset, offset, pitch) triples in quarter lengths, ordered by onset.
+        time_signatures (list): (start, bar length) pairs in quarter lengths.
+
+    Returns:
+        list: A list of MIDI note pitches in playback order.
+    """
+    chords, voices_required = group_chords(notes)
+    if not chords:
+        return []
+    insertions = itertools.count()
+
+    measures = [Measure(0, bar_length_at(0, time_signatures))]
+    for offset, duration, pitches in quantize_chords(chords):
+        while offset >= measures[-1].start + measures[-1].length:
+            start = measures[-1].start + measures[-1].length
+            measures.append(Measure(start, bar_length_at(start, time_signatures)))
+        measure = measures[-1]
+        measure.notes.append([offset - measure.start, duration, pitches, next(insertions)])
+
+    if voices_required:
+        for measure in measures:
+            make_voices(measure, insertions)
+    make_ties(measures, time_signatures, insertions)
+
+    sequence = []
+    for measure in measures:
+        voices = [voice for voice in measure.voices if voice]
+        if len(voices) == 1:
+            # A lone voice is folded back into the measure
+            measure.notes.extend(
+                [*note[:3], next(insertions)] for note in sort_notes(voices[0])
+            )
+            voices = []
+        # Voices come before measure-level notes at the same offset
+        ordered = [note for voice in voices for note in sort_notes(voice)]
+        ordered += sort_notes(measure.notes)
+        for note in sorted(ordered, key=lambda note: note[0]):
+            sequence.extend(note[2])
+    return sequence
+
+
+# ====================================================================================
+# Standard MIDI File Reader
+# ====================================================================================
+
+
+def read_variable_length(data, position):
+    """
+    Decode a variable-length quantity.
+
+    Returns:
+        tuple: (value, position after the quantity)
+    """
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+
+def read_track_events(data):
+    """
+    Walk the events of one MTrk chunk.
+
+    Parameters:
+        data (bytes): The chunk payload.
+
+    Returns:
+        tuple: (note events as (tick, is_note_on, pitch, channel),
+                time signatures as (tick, numerator, denominator))
+    """
+    note_events = []
+    time_signatures = []
+    position = tick = 0
+    status = None
+    while position < len(data):
+        delta, position = read_variable_length(data, position)
+        tick += delta
+
+        byte = data[position]
+        if byte & 0x80:
+            position += 1
+            if byte < 0xF0:
+                status = byte  # Running status only applies to channel messages
+        elif status is None:
+            raise ValueError("Data byte without a running status")
+
+        if byte == 0xFF:
+            meta_type = data[position]
+            length, position = read_variable_length(data, position + 1)
+            if meta_type == META_END_OF_TRACK:
+                break
+            if meta_type == META_TIME_SIGNATURE and length >= 2:
+                time_signatures.append(
+                    (tick, data[position], 2 ** data[position + 1])
+                )
+            position += length
+        elif byte in (0xF0, 0xF7):
+            length, position = read_variable_length(data, position)
+            position += length
+        else:
+            kind = status & 0xF0
+            if kind in (0x80, 0x90):
+                pitch, velocity = data[position], data[position + 1]
+                note_events.append((tick, kind == 0x90 and velocity > 0, pitch, status & 0x0F))
+            position += CHANNEL_MESSAGE_LENGTHS[kind]
+    return note_events, time_signatures
+
+
+def pair_note_events(note_events):
+    """
+    Match every note-on with the next note-off of the same pitch and channel
+    (like music21, overlapping note-ons share the same note-off).
+
+    Returns:
+        list: (on_tick, off_tick, pitch) triples ordered by note-on.
+    """
+    notes = []
+    awaiting = {}
+    for tick, is_note_on, pitch, channel in reversed(note_events):
+        if not is_note_on:
+            awaiting[pitch, channel] = tick
+        elif (pitch, channel) in awaiting:
+            notes.append((tick, awaiting[pitch, channel], pitch))
+    notes.reverse()
+    return notes
+
+
+def read_midi_tracks(midi_file_path, first_note_track_only=False):
+    """
+    Stream the chunks of a Standard MIDI File.
+
+    Parameters:
+        midi_file_path (str): The path to the MIDI file.
+        first_note_track_only (bool): Stop reading after the first track with notes.
+
+    Returns:
+        tuple: (ticks per quarter note, list of tracks as (on_tick, off_tick, pitch)
+                triples (tracks without notes are skipped), time signatures)
+    """
+    tracks = []
+    time_signatures = []
+    with open(midi_file_path, "rb") as f:
+        if f.read(4) != b"MThd":
+            raise ValueError("Not a Standard MIDI File")
+        header = f.read(int.from_bytes(f.read(4), "big"))
+        ticks_per_quarter = int.from_bytes(header[4:6], "big")
+        if ticks_per_quarter & 0x8000:
+            raise ValueError("SMPTE time division is not supported")
+
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_type = chunk_header[:4]
+            data = f.read(int.from_bytes(chunk_header[4:], "big"))
+            if chunk_type != b"MTrk":
+                continue  # Unknown chunks are skipped per the spec
+
+            note_events, track_time_signatures = read_track_events(data)
+            time_signatures.extend(track_time_signatures)
+            notes = pair_note_events(note_events)
+            if notes:
+                tracks.append(notes)
+                if first_note_track_only:
+                    break
+
+    time_signatures.sort()
+    return ticks_per_quarter, tracks, time_signatures
+
+
+def read_midi_notes(midi_file_path):
+    """
+    Extract the pitches of the melody (first note-bearing) track, with the same chord
+    expansion and ordering as music21's converter.parse(...).parts[0].flatten().notes.
+
+    Parameters:
+        midi_file_path (str): The path to the MIDI file.
+
+    Returns:
+        numpy.ndarray: The MIDI note pitches (int64).
+    """
+    ticks_per_quarter, tracks, time_signatures = read_midi_tracks(
+        midi_file_path, first_note_track_only=True
+    )
+    if not tracks:
+        return np.zeros(0, dtype=np.int64)
+
+    notes = [
+        (on_tick / ticks_per_quarter, off_tick / ticks_per_quarter, pitch)
+        for on_tick, off_tick, pitch in tracks[0]
+    ]
+    bar_lengths = [
+        (Fraction(tick, ticks_per_quarter), Fraction(numerator * 4, denominator))
+        for tick, numerator, denominator in time_signatures
+    ]
+    return np.array(pitch_sequence(notes, bar_lengths), dtype=np.int64)
+
+
+def read_midi_notes_or_empty(midi_file_path):
+    """
+    read_midi_notes for batch parsing: an unreadable file yields no notes instead of
+    aborting the whole batch.
+    """
+    try:
+        return read_midi_notes(midi_file_path)
+    except Exception as e:
+        print(f"Error processing MIDI file {midi_file_path}: {e}")
+        return np.zeros(0, dtype=np.int64)
@@ -0,0 +1,242 @@
+import os
+import time
+import numpy as np
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+NGRAM_LENGTH = 4  # Consecutive intervals per n-gram
+INTERVAL_LEVEL_EDGES = (0.5, 2.5, 4.5, 7.5)  # |interval| edges (semitones) of the levels
+N_LEVELS = 2 * len(INTERVAL_LEVEL_EDGES) + 1  # Down / repeat / up levels
+DEFAULT_MAX_CANDIDATES = 500  # Songs returned (and re-ranked by MIR) per query
+MAX_DF_RATIO = 0.5  # N-grams found in more songs than this carry no information
+
+# ====================================================================================
+# Melody Contour N-Grams
+# ====================================================================================
+
+
+def quantize_intervals(intervals):
+    """
+    Map pitch intervals (semitones) to coarse contour levels in [0, N_LEVELS).
+
+    Small transcription errors of a hummed melody (a semitone off, a slightly too
+    wide leap) fall into the same level as the intended interval.
+    """
+    intervals = np.asarray(intervals, dtype=np.float64)
+    magnitude = np.searchsorted(INTERVAL_LEVEL_EDGES, np.abs(intervals), side="right")
+    return (len(INTERVAL_LEVEL_EDGES) + np.sign(intervals) * magnitude).astype(np.int64)
+
+
+def contour_ngrams(values, offsets, n=NGRAM_LENGTH):
+    """
+    Interval n-gram keys of every song of a ragged pitch array.
+
+    Repeated pitches are dropped first: they carry no contour, and a held note is
+    often split into several notes by the transcription.
+
+    Parameters:
+        values (numpy.ndarray): Concatenated note pitches.
+        offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+        n (int): Number of consecutive intervals per n-gram.
+
+    Returns:
+        tuple: (keys, song ids) with one entry per n-gram occurrence.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    # Intervals inside each song, without repeated notes
+    same_song = ids[1:] == ids[:-1]
+    intervals = np.diff(values)
+    keep = same_song & (intervals != 0)
+    levels = quantize_intervals(intervals[keep])
+    level_ids = ids[1:][keep]
+
+    count = len(levels) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # An n-gram is valid when its n intervals belong to the same song
+    valid = level_ids[:count] == level_ids[n - 1 :]
+    keys = np.zeros(count, dtype=np.int64)
+    for i in range(n):
+        keys = keys * N_LEVELS + levels[i : i + count]
+    return keys[valid], level_ids[:count][valid]
+
+
+# ====================================================================================
+# Inverted N-Gram Index
+# ====================================================================================
+
+
+class NGramIndex:
+    """
+    Inverted index from melody contour n-grams to the songs containing them.
+
+    A query only visits the posting lists of its own n-grams, so retrieving the
+    candidate songs does not scan the whole catalogue.
+    """
+
+    def __init__(self, keys, posting_offsets, postings, idf, n_songs, n=NGRAM_LENGTH):
+        self.keys = keys  # Sorted distinct n-gram keys
+        self.posting_offsets = posting_offsets  # keys[i] -> postings[offsets[i]:offsets[i+1]]
+        self.postings = postings  # Song rows
+        self.idf = idf  # Inverse document frequency of each key
+        self.n_songs = n_songs
+        self.n = n
+
+    @classmethod
+    def build(cls, values, offsets, n=NGRAM_LENGTH):
+        """
+        Parameters:
+            values (numpy.ndarray): Concatenated note pitches of the catalogue.
+            offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+            n (int): Number of consecutive intervals per n-gram.
+        """
+        n_songs = len(offsets) - 1
+        keys, song_rows = contour_ngrams(values, offsets, n)
+
+        # Distinct (key, song) pairs, sorted by key then song
+        pairs = np.unique(keys * max(n_songs, 1) + song_rows)
+        pair_keys = pairs // max(n_songs, 1)
+        postings = (pairs % max(n_songs, 1)).astype(np.int32)
+
+        distinct_keys, counts = np.unique(pair_keys, return_counts=True)
+        posting_offsets = np.zeros(len(distinct_keys) + 1, dtype=np.int64)
+        posting_offsets[1:] = np.cumsum(counts)
+        idf = np.log((n_songs + 1) / (counts + 1)) + 1
+        return cls(distinct_keys, posting_offsets, postings, idf, n_songs, n)
+
+    def search(self, query_notes, max_candidates=DEFAULT_MAX_CANDIDATES):
+        """
+        Parameters:
+            query_notes (numpy.ndarray): The query pitch sequence.
+            max_candidates (int): Maximum number of songs to return.
+
+        Returns:
+            tuple: (candidate song rows, their n-gram scores), best first. Both are empty
+            when the query has no n-gram in common with the catalogue.
+        """
+        query_notes = np.asarray(query_notes)
+        query_keys, _ = contour_ngrams(query_notes, np.array([0, len(query_notes)]), self.n)
+        query_keys = np.unique(query_keys)
+
+        # Look up the query n-grams, skipping unknown and uninformative ones
+        positions = np.searchsorted(self.keys, query_keys)
+        positions = positions[positions < len(self.keys)]
+        positions = positions[np.isin(self.keys[positions], query_keys)]
+        sizes = self.posting_offsets[positions + 1] - self.posting_offsets[positions]
+        positions = positions[sizes <= max(MAX_DF_RATIO * self.n_songs, 1)]
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # Sum the idf of the shared n-grams per song
+        rows = np.concatenate(
+            [
+                self.postings[self.posting_offsets[i] : self.posting_offsets[i + 1]]
+                for i in positions
+            ]
+        )
+        weights = np.repeat(
+            self.idf[positions],
+            self.posting_offsets[positions + 1] - self.posting_offsets[positions],
+        )
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        if len(candidates) > max_candidates:
+            top = np.argpartition(-scores, max_candidates - 1)[:max_candidates]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return candidates[order].astype(np.int64), scores[order]
+
+    def save(self, file_path, fingerprint=""):
+        """
+        Write the index (through a temporary file, replaced in one step) with the
+        fingerprint of the catalogue it was built from.
+        """
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                keys=self.keys,
+                posting_offsets=self.posting_offsets,
+                postings=self.postings,
+                idf=self.idf,
+                n_songs=self.n_songs,
+                n=self.n,
+                fingerprint=fingerprint,
+            )
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path, fingerprint=None):
+        """
+        Parameters:
+            file_path (str): The file the index was saved to.
+            fingerprint (str): Expected fingerprint of the indexed catalogue.
+
+        Returns:
+            NGramIndex: The index, or None if it is missing, unreadable or outdated.
+        """
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with np.load(file_path) as data:
+                if fingerprint is not None and str(data["fingerprint"]) != fingerprint:
+                    return None
+                return cls(
+                    data["keys"],
+                    data["posting_offsets"],
+                    data["postings"],
+                    data["idf"],
+                    int(data["n_songs"]),
+                    int(data["n"]),
+                )
+        except Exception as e:
+            print(f"Error loading n-gram index {file_path}: {e}")
+            return None
+
+
+# ====================================================================================
+# Candidate Recall vs. Latency Benchmark
+# ====================================================================================
+
+
+def main():
+    from backend.MIR import get_feature_store
+
+    store = get_feature_store()
+    values, offsets = store["notes"], store["note_offsets"]
+    if len(offsets) < 2:
+        print("Feature store is empty. Please convert the dataset first.")
+        return
+
+    start = time.perf_counter()
+    index = NGramIndex.build(values, offsets)
+    build_time = time.perf_counter() - start
+
+    # Simulated hums: 20-note excerpts of random songs, a few notes a semitone off
+    rng = np.random.default_rng(0)
+    lengths = np.diff(offsets)
+    songs = rng.choice(np.flatnonzero(lengths >= 20), min(200, (lengths >= 20).sum()))
+    hits = 0
+    start = time.perf_counter()
+    for song in songs:
+        first = offsets[song] + rng.integers(0, lengths[song] - 19)
+        hum = values[first : first + 20] + rng.choice([-1, 0, 0, 0, 1], 20)
+        candidates, _ = index.search(hum, max_candidates=10)
+        hits += song in candidates
+    latency = (time.perf_counter() - start) / max(len(songs), 1) * 1000
+
+    print(
+        f"{len(offsets) - 1} songs, {len(index.keys)} n-grams - build: "
+        f"{build_time * 1000:.1f} ms, query: {latency:.3f} ms, "
+        f"source song in top 10 candidates: {hits}/{len(songs)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
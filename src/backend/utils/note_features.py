@@ -0,0 +1,175 @@
+import time
+import numpy as np
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+ATB_BINS = 128  # Absolute tone bins over [0, 128]
+INTERVAL_BINS = 255  # Relative / first tone bins over [-127, 128]
+INTERVAL_MIN = -127
+
+# ====================================================================================
+# Ragged Note Arrays
+# ====================================================================================
+
+
+def ragged_notes(note_sequences):
+    """
+    Concatenate note sequences into one array.
+
+    Parameters:
+        note_sequences (list): One sequence of MIDI pitches per song.
+
+    Returns:
+        tuple: (values, offsets) where song i is values[offsets[i]:offsets[i+1]].
+    """
+    offsets = np.zeros(len(note_sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(notes) for notes in note_sequences])
+    if offsets[-1] == 0:
+        return np.zeros(0), offsets
+    values = np.concatenate([np.asarray(notes, dtype=np.float64) for notes in note_sequences])
+    return values, offsets
+
+
+def song_ids(offsets):
+    """
+    Song index of every value in a ragged array.
+    """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+# ====================================================================================
+# Batch Normalization and Histograms
+# ====================================================================================
+
+
+def normalize_notes_batch(values, offsets):
+    """
+    Z-normalize every song's pitches by its own mean and standard deviation
+    (a standard deviation of 0 is treated as 1), like MIR.normalize_notes.
+
+    Parameters:
+        values (numpy.ndarray): Concatenated note pitches.
+        offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+
+    Returns:
+        numpy.ndarray: The normalized pitches, in the same ragged layout.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    ids = song_ids(offsets)
+    lengths = np.maximum(np.diff(offsets), 1)
+    n_songs = len(offsets) - 1
+
+    mean = np.bincount(ids, weights=values, minlength=n_songs) / lengths
+    deviations = values - mean[ids]
+    std = np.sqrt(np.bincount(ids, weights=deviations**2, minlength=n_songs) / lengths)
+    std[std == 0] = 1  # Prevent division by zero
+    return deviations / std[ids]
+
+
+def histogram_rows(row_ids, values, n_rows, first_edge, n_bins):
+    """
+    Per-row histograms over unit-width bins [first_edge, first_edge + n_bins], the last
+    bin closed, normalized to a density (np.histogram(..., density=True) per row).
+    """
+    shifted = values - first_edge
+    inside = (shifted >= 0) & (shifted <= n_bins)
+    bins = np.minimum(np.floor(shifted[inside]).astype(np.int64), n_bins - 1)
+    counts = np.bincount(
+        row_ids[inside] * n_bins + bins, minlength=n_rows * n_bins
+    ).reshape(n_rows, n_bins)
+
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts / totals
+
+
+def extract_features_batch(normalized_values, offsets):
+    """
+    ATB, RTB and FTB histograms of many songs in one pass (same values as running
+    MIR.extract_features on every song; songs without notes get zero rows).
+
+    Parameters:
+        normalized_values (numpy.ndarray): Concatenated normalized note pitches.
+        offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+
+    Returns:
+        tuple: The N x 128 ATB, N x 255 RTB and N x 255 FTB matrices.
+    """
+    values = np.asarray(normalized_values, dtype=np.float64)
+    n_songs = len(offsets) - 1
+    ids = song_ids(offsets)
+    lengths = np.diff(offsets)
+
+    # ATB
+    atb = histogram_rows(ids, values, n_songs, 0, ATB_BINS)
+
+    # RTB: consecutive intervals inside each song; a single note counts as interval 0
+    same_song = ids[1:] == ids[:-1]
+    single = np.flatnonzero(lengths == 1)
+    interval_ids = np.concatenate([ids[1:][same_song], single])
+    intervals = np.concatenate([np.diff(values)[same_song], np.zeros(len(single))])
+    rtb = histogram_rows(interval_ids, intervals, n_songs, INTERVAL_MIN, INTERVAL_BINS)
+
+    # FTB: distance of every note to its song's first note
+    non_empty = lengths > 0
+    first_notes = np.zeros(n_songs)
+    first_notes[non_empty] = values[offsets[:-1][non_empty]]
+    ftb = histogram_rows(ids, values - first_notes[ids], n_songs, INTERVAL_MIN, INTERVAL_BINS)
+
+    empty = ~non_empty
+    atb[empty] = rtb[empty] = ftb[empty] = 0
+    return atb, rtb, ftb
+
+
+def normalize_rows(matrix):
+    """
+    Scale every row of a matrix to unit L2 norm.
+
+    Parameters:
+        matrix (numpy.ndarray): A 2D array (one feature vector per row).
+
+    Returns:
+        numpy.ndarray: The row-normalized matrix. Zero or non-finite rows become zero rows,
+        so they score a cosine similarity of 0 like MIR.cosine_similarity does.
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+    matrix = np.where(np.isfinite(matrix).all(axis=1, keepdims=True), matrix, 0.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+# ====================================================================================
+# Per-Song vs. Batch Benchmark
+# ====================================================================================
+
+
+def main():
+    from backend.MIR import extract_features, normalize_notes, get_feature_store
+
+    store = get_feature_store()
+    offsets = store["note_offsets"]
+    notes = [store["notes"][start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    start = time.perf_counter()
+    expected = [extract_features(normalize_notes(song)) for song in notes]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    values, offsets = ragged_notes(notes)
+    features = extract_features_batch(normalize_notes_batch(values, offsets), offsets)
+    batch_time = time.perf_counter() - start
+
+    matches = all(
+        np.allclose(np.array(column), matrix, equal_nan=True)
+        for column, matrix in zip(zip(*expected), features)
+    )
+    print(
+        f"{len(notes)} songs - per-song: {loop_time * 1000:.1f} ms, "
+        f"batch: {batch_time * 1000:.1f} ms, identical: {matches}"
+    )
+
+
+if __name__ == "__main__":
+    main()
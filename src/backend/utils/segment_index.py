@@ -0,0 +1,178 @@
+import os
+import json
+import numpy as np
+from backend.utils.note_features import (
+    normalize_notes_batch,
+    extract_features_batch,
+    normalize_rows,
+)
+
+# ====================================================================================
+# Constants
+# ====================================================================================
+
+SEGMENT_WINDOW = 32  # Notes per segment (roughly a 10 second hum)
+SEGMENT_HOP = 16  # Notes between the starts of consecutive segments
+SEGMENT_DTYPE = np.float32  # Storage type of the segment matrices (several rows per song)
+FEATURE_NAMES = ("atb", "rtb", "ftb")
+METADATA_FILE = "segment_index.json"
+
+# ====================================================================================
+# Note Windows
+# ====================================================================================
+
+
+def segment_windows(offsets, window=SEGMENT_WINDOW, hop=SEGMENT_HOP):
+    """
+    Overlapping note windows of every song of a ragged pitch array.
+
+    Every song gets at least one segment: songs shorter than a window (and songs
+    without notes) are a single segment, and the last window of a longer song is
+    aligned with its end so the tail is covered.
+
+    Parameters:
+        offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+        window (int): Notes per segment.
+        hop (int): Notes between the starts of consecutive segments.
+
+    Returns:
+        tuple: (segment starts, segment lengths, segment offsets) where song i owns
+        segments segment_offsets[i]:segment_offsets[i+1].
+    """
+    lengths = np.diff(offsets)
+    counts = np.maximum(-(-(lengths - window) // hop), 0) + 1
+    segment_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    segment_offsets[1:] = np.cumsum(counts)
+
+    songs = np.repeat(np.arange(len(lengths)), counts)
+    positions = np.arange(segment_offsets[-1]) - segment_offsets[songs]
+    relative_starts = np.minimum(positions * hop, np.maximum(lengths[songs] - window, 0))
+    starts = offsets[:-1][songs] + relative_starts
+    return starts, np.minimum(lengths[songs], window), segment_offsets
+
+
+def gather_ranges(starts, lengths):
+    """
+    Concatenated indices of the ranges [start, start + length).
+    """
+    ids = np.repeat(np.arange(len(starts)), lengths)
+    range_offsets = np.cumsum(lengths) - lengths
+    return starts[ids] + np.arange(len(ids)) - range_offsets[ids]
+
+
+# ====================================================================================
+# Segment Index
+# ====================================================================================
+
+
+class SegmentIndex:
+    """
+    Row-normalized ATB/RTB/FTB features of overlapping note windows of every song.
+
+    A query is scored against every segment and a song takes the score of its best
+    segment, so a short hum can match inside a long song.
+    """
+
+    def __init__(self, matrices, segment_offsets, window, hop):
+        self.matrices = matrices  # Row-normalized ATB, RTB and FTB segment matrices
+        self.segment_offsets = segment_offsets  # Song i -> segments offsets[i]:offsets[i+1]
+        self.window = window
+        self.hop = hop
+
+    @classmethod
+    def build(cls, values, offsets, window=SEGMENT_WINDOW, hop=SEGMENT_HOP):
+        """
+        Parameters:
+            values (numpy.ndarray): Concatenated note pitches of the catalogue.
+            offsets (numpy.ndarray): Song boundaries (N + 1 entries).
+            window (int): Notes per segment.
+            hop (int): Notes between the starts of consecutive segments.
+        """
+        starts, lengths, segment_offsets = segment_windows(offsets, window, hop)
+        segment_values = np.asarray(values, dtype=np.float64)[gather_ranges(starts, lengths)]
+        value_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        value_offsets[1:] = np.cumsum(lengths)
+
+        features = extract_features_batch(
+            normalize_notes_batch(segment_values, value_offsets), value_offsets
+        )
+        matrices = tuple(normalize_rows(matrix).astype(SEGMENT_DTYPE) for matrix in features)
+        return cls(matrices, segment_offsets, window, hop)
+
+    def score(self, query_matrices, weights, rows=None):
+        """
+        Parameters:
+            query_matrices (tuple): Row-normalized ATB, RTB and FTB query vectors.
+            weights (tuple): The weight of each feature.
+            rows (numpy.ndarray): Optional song rows to score (defaults to every song).
+
+        Returns:
+            numpy.ndarray: The best segment similarity of each scored song.
+        """
+        if rows is None:
+            segments = slice(None)
+            segment_offsets = self.segment_offsets
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            counts = self.segment_offsets[rows + 1] - self.segment_offsets[rows]
+            segments = gather_ranges(self.segment_offsets[rows], counts)
+            segment_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            segment_offsets[1:] = np.cumsum(counts)
+        if segment_offsets[-1] == 0:
+            return np.zeros(len(segment_offsets) - 1)
+
+        similarities = 0.0
+        for query_vector, matrix, weight in zip(query_matrices, self.matrices, weights):
+            query_vector = np.asarray(query_vector, dtype=matrix.dtype)
+            similarities = similarities + weight * (matrix[segments] @ query_vector)
+        return np.maximum.reduceat(similarities, segment_offsets[:-1]).astype(np.float64)
+
+    def save(self, directory, fingerprint):
+        """
+        Write the segment matrices as .npy files (memory-mappable), then the metadata
+        that marks the index as complete.
+        """
+        os.makedirs(directory, exist_ok=True)
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+
+        arrays = dict(zip(FEATURE_NAMES, self.matrices))
+        arrays["segment_offsets"] = self.segment_offsets
+        for name, array in arrays.items():
+            temp_path = os.path.join(directory, f"{name}.npy.tmp")
+            with open(temp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(temp_path, os.path.join(directory, f"{name}.npy"))
+
+        with open(metadata_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "window": self.window, "hop": self.hop}, f)
+
+    @classmethod
+    def load(cls, directory, fingerprint=None, mmap_mode="r"):
+        """
+        Parameters:
+            directory (str): The directory the index was saved to.
+            fingerprint (str): Expected fingerprint of the indexed catalogue.
+            mmap_mode (str): Memory-map mode of the segment matrices (None reads them).
+
+        Returns:
+            SegmentIndex: The index, or None if it is missing, incomplete or outdated.
+        """
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            return None
+        try:
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+            if fingerprint is not None and metadata["fingerprint"] != fingerprint:
+                return None
+            matrices = tuple(
+                np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in FEATURE_NAMES
+            )
+            segment_offsets = np.load(os.path.join(directory, "segment_offsets.npy"))
+        except Exception as e:
+            print(f"Error loading segment index {directory}: {e}")
+            return None
+        return cls(matrices, segment_offsets, metadata["window"], metadata["hop"])
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is imported as the 'backend' package from src/
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+QUERY_DIR = ROOT_DIR / "test" / "query"
+
+
+@pytest.fixture(scope="session")
+def feature_store(tmp_path_factory):
+    """
+    Feature store of the bundled MIDI dataset, built in a temporary directory so the
+    tests never touch database/processed_data.
+    """
+    from backend import MIR
+
+    directory = tmp_path_factory.mktemp("feature_store")
+    return MIR.build_feature_store(
+        str(MIR.MIDI_DATASET_PATH),
+        str(directory / "midi_feature_store.npz"),
+        str(directory / "midi_segments"),
+        str(directory / "midi_ngram_index.npz"),
+    )
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend import APF2
+
+SIZE = (60, 60)
+
+
+@pytest.mark.parametrize("fit_mode", ["gram", "covariance", "randomized", "auto"])
+def test_identical_images_keep_one_component(fit_mode):
+    # Duplicate images centre to zero: no variance, but the index must stay searchable
+    images = np.tile(np.arange(48, dtype=np.float64), (6, 1))
+    centered, _ = APF2.standardize_data(images, np.float64)
+    components = APF2.fit_principal_components(centered, fit_mode=fit_mode)
+    assert components.shape[1] >= 1
+    assert np.all(np.isfinite(components))
+
+
+def test_constant_image_database_is_searchable(tmp_path):
+    # Plain covers: every augmented row is the same image
+    for i in range(4):
+        Image.new("RGB", (80, 80), (200, 30, 30)).save(tmp_path / f"cover_{i}.png")
+
+    index = APF2.build_image_index(str(tmp_path), SIZE, fit_mode="gram")
+    assert index.principal_components.shape[1] == 1
+    ranking = APF2.rank_query_image(str(tmp_path / "cover_0.png"), index, SIZE, 4)
+    assert len(ranking) == 4
+
+
+def test_incremental_pca_warns_when_capped_below_the_threshold(tmp_path, caplog):
+    rng = np.random.default_rng(0)
+    for i in range(12):
+        pixels = rng.integers(0, 256, size=(16, 16, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(tmp_path / f"cover_{i:02d}.png")
+    image_paths = APF2.list_image_files(str(tmp_path))
+
+    with caplog.at_level("WARNING"):
+        APF2.fit_incremental_pca(image_paths, (16, 16), threshold=0.95, n_components=2)
+    assert "Incremental PCA capped at 2 components" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level("WARNING"):
+        APF2.fit_incremental_pca(image_paths, (16, 16), threshold=0.95, n_components=200)
+    assert "Incremental PCA capped" not in caplog.text
@@ -0,0 +1,40 @@
+import glob
+
+import pytest
+
+# The reference parser is only needed by this test module
+converter = pytest.importorskip("music21").converter
+
+from backend.MIR import MIDI_DATASET_PATH
+from backend.utils.midi_reader import read_midi_notes
+from conftest import QUERY_DIR
+
+# Every bundled MIDI file: the song database and the query transcriptions
+MIDI_FILES = sorted(glob.glob(f"{MIDI_DATASET_PATH}/*.mid")) + sorted(
+    glob.glob(f"{QUERY_DIR}/audio/*.mid")
+)
+
+
+def music21_notes(midi_file_path):
+    """
+    Reference extraction (the original music21-based process_midi_file).
+    """
+    score = converter.parse(midi_file_path)
+    parts = score.getElementsByClass("Part")
+    melody_part = parts[0] if parts else score
+    notes = []
+    for element in melody_part.flatten().notes:
+        if element.isNote:
+            notes.append(element.pitch.midi)
+        elif element.isChord:
+            notes.extend(p.midi for p in element.pitches)
+    return notes
+
+
+def test_bundled_midi_files_are_found():
+    assert len(MIDI_FILES) > 100
+
+
+@pytest.mark.parametrize("midi_file", MIDI_FILES, ids=lambda path: path.split("/")[-1])
+def test_read_midi_notes_matches_music21(midi_file):
+    assert read_midi_notes(midi_file).tolist() == music21_notes(midi_file)
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+from backend import MIR
+from backend.utils.midi_reader import read_midi_notes
+from backend.utils.ngram_index import NGramIndex
+from backend.utils.segment_index import SEGMENT_WINDOW, SEGMENT_HOP
+from conftest import QUERY_DIR
+
+# Bundled query transcriptions and the database song each one was taken from
+QUERIES = [
+    ("pop.00099.mid", "pop.00099.mid"),  # Exact copy of a database song
+    ("Cogitation of Epochs.mid", "Cogitation of Epochs.mid"),
+    ("Cogitation of Epochs_trimmed.mid", "Cogitation of Epochs.mid"),  # Short excerpt
+]
+
+
+def source_rank(matches, source):
+    names = [os.path.basename(match[0]) for match in matches]
+    return names.index(source) + 1
+
+
+def query_notes(query):
+    return read_midi_notes(str(QUERY_DIR / "audio" / query))
+
+
+@pytest.mark.parametrize("query, source", QUERIES)
+def test_default_scoring_ranks_the_source_song_first(feature_store, query, source):
+    matches = MIR.query_by_humming(
+        None, threshold=0.0, feature_store=feature_store, query_notes=query_notes(query)
+    )
+    assert source_rank(matches, source) == 1
+
+
+@pytest.mark.parametrize("query, source", QUERIES)
+def test_default_threshold_filters_the_catalogue(feature_store, query, source):
+    matches = MIR.query_by_humming(
+        None, feature_store=feature_store, query_notes=query_notes(query)
+    )
+    assert source_rank(matches, source) == 1
+    assert len(matches) < len(feature_store["files"])
+
+
+def test_segment_index_is_only_built_on_demand(feature_store):
+    assert feature_store["segment_index"] is None
+    segment_metadata = os.path.join(feature_store["segment_dir"], "segment_index.json")
+    assert not os.path.exists(segment_metadata)
+
+
+def test_segment_scoring_finds_a_window_inside_a_song(feature_store):
+    # A query that is exactly one note window of a long song matches that window
+    store = dict(feature_store)  # Keep the session store without a segment index
+    offsets = store["note_offsets"]
+    row = int(np.argmax(np.diff(offsets)))
+    start = offsets[row] + SEGMENT_HOP
+    window_notes = store["notes"][start : start + SEGMENT_WINDOW]
+
+    matches = MIR.query_by_humming(
+        None,
+        threshold=0.0,
+        feature_store=store,
+        use_segments=True,
+        query_notes=window_notes,
+    )
+    assert store["segment_index"] is not None
+    assert os.path.exists(os.path.join(store["segment_dir"], "segment_index.json"))
+    assert matches[0][0] == store["files"][row]
+    assert matches[0][1] == pytest.approx(1.0, abs=1e-4)
+
+
+def test_ngram_index_is_saved_with_the_store_fingerprint(feature_store, tmp_path):
+    ngram_file = str(tmp_path / "midi_ngram_index.npz")
+    built = MIR.load_ngram_index(feature_store, ngram_file)
+    loaded = NGramIndex.load(ngram_file, MIR.store_fingerprint(feature_store))
+    assert loaded is not None
+    assert np.array_equal(loaded.keys, built.keys)
+    assert np.array_equal(loaded.postings, built.postings)
+    assert NGramIndex.load(ngram_file, "another catalogue") is None
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from backend import MIR
+from backend.utils.midi_reader import read_midi_notes
+
+# basic_pitch writes its transcriptions with pretty_midi
+pretty_midi = pytest.importorskip("pretty_midi")
+
+
+def write_transcription(note_events, midi_file_path):
+    """
+    Write note events the way basic_pitch's note_events_to_midi does.
+    """
+    midi = pretty_midi.PrettyMIDI(initial_tempo=MIR.NOTE_EVENT_TEMPO)
+    instrument = pretty_midi.Instrument(program=4)
+    for start, end, pitch, amplitude, _ in note_events:
+        instrument.notes.append(
+            pretty_midi.Note(int(round(127 * amplitude)), pitch, start, end)
+        )
+    midi.instruments.append(instrument)
+    midi.write(str(midi_file_path))
+
+
+def random_note_events(seed, count=200):
+    # Short notes on a coarse grid, so chords, re-struck pitches and notes ending
+    # exactly where another starts are frequent
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 80, count) * 0.125
+    durations = rng.integers(1, 6, count) * 0.125
+    pitches = rng.integers(55, 67, count)
+    return [
+        (float(start), float(start + duration), int(pitch), 0.8, None)
+        for start, duration, pitch in zip(starts, durations, pitches)
+    ]
+
+
+EDGE_CASES = [
+    (0.0, 0.5, 60, 0.8, None),
+    (0.5, 1.0, 60, 0.8, None),  # Re-struck where the previous note ends
+    (0.5, 1.0, 64, 0.8, None),  # Chord
+    (0.5, 0.75, 67, 0.8, None),
+    (0.75, 1.5, 67, 0.8, None),
+    (1.0, 2.0, 62, 0.8, None),
+    (1.25, 1.5, 62, 0.8, None),  # Overlaps a held note of the same pitch
+]
+
+
+@pytest.mark.parametrize(
+    "note_events",
+    [EDGE_CASES] + [random_note_events(seed) for seed in range(5)],
+    ids=["edge_cases"] + [f"random_{seed}" for seed in range(5)],
+)
+def test_notes_from_note_events_match_the_written_file(note_events, tmp_path):
+    midi_file_path = tmp_path / "transcription.mid"
+    write_transcription(note_events, midi_file_path)
+    assert MIR.notes_from_note_events(note_events) == read_midi_notes(
+        str(midi_file_path)
+    ).tolist()
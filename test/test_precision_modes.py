@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend import APF2
+from conftest import QUERY_DIR
+
+SIZE = (60, 60)
+TOP_K = 10
+TOLERANCE = 0.5  # Similarity percentage points within which two images may swap ranks
+
+
+def rankings_match(reference, ranking, tolerance):
+    """
+    Two rankings match when every rank holds the same image, or images whose
+    similarities are within tolerance percentage points (a near tie may swap).
+    """
+    if len(reference) != len(ranking):
+        return False
+    return all(
+        reference_path == path
+        or abs(reference_similarity - similarity) <= tolerance
+        for (reference_path, reference_similarity), (path, similarity) in zip(
+            reference, ranking
+        )
+    )
+
+
+@pytest.fixture(scope="module")
+def picture_database(tmp_path_factory):
+    # Smooth random covers (a few blurred blobs each) so the PCA keeps some structure
+    directory = tmp_path_factory.mktemp("picture")
+    rng = np.random.default_rng(0)
+    for i in range(40):
+        pixels = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        Image.fromarray(pixels).resize((96, 96), Image.BILINEAR).save(
+            directory / f"cover_{i:02d}.jpg"
+        )
+    return directory
+
+
+@pytest.fixture(scope="module")
+def query_images(picture_database):
+    return sorted(picture_database.glob("cover_0*.jpg")) + sorted(
+        (QUERY_DIR / "picture").glob("*.jpg")
+    )
+
+
+@pytest.fixture(scope="module")
+def reference_rankings(picture_database, query_images):
+    index = APF2.build_image_index(str(picture_database), SIZE, precision="float64")
+    return [
+        APF2.rank_query_image(str(path), index, SIZE, TOP_K) for path in query_images
+    ]
+
+
+@pytest.mark.parametrize("precision", ["float32", "float16"])
+def test_reduced_precision_rankings_match_float64(
+    picture_database, query_images, reference_rankings, precision
+):
+    index = APF2.build_image_index(str(picture_database), SIZE, precision=precision)
+    assert index.imageDB_projection.dtype == APF2.storage_dtype(precision)
+    for path, reference in zip(query_images, reference_rankings):
+        ranking = APF2.rank_query_image(str(path), index, SIZE, TOP_K)
+        assert ranking is not None and len(ranking) == TOP_K
+        assert rankings_match(reference, ranking, TOLERANCE), path.name